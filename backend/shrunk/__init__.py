@@ -17,13 +17,18 @@ from bson import ObjectId
 from flask.json import JSONEncoder
 from flask.logging import default_handler
 from flask_mailman import Mail
-from urllib.parse import parse_qsl, urlencode
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.routing import BaseConverter, ValidationError
 
 # Extensions
 # Blueprints
-from . import api, dev_logins, sso, views
+from . import api, commands, dev_logins, redirects, sso, views
+from .app_setup import (
+    init_logging,
+    init_redirect_cache,
+    init_shrunk_client,
+    load_config,
+)
 from .client import ShrunkClient
 from .util.github import pull_outlook_assets_from_github
 from .util.ldap import is_university_guest, is_valid_netid, query_position_info
@@ -95,22 +100,6 @@ class RequestFormatter(logging.Formatter):
         return super().format(record)
 
 
-def _init_logging() -> None:
-    """Sets up self.logger with default settings."""
-    formatter = logging.Formatter(os.getenv("SHRUNK_LOG_FORMAT"))
-    handler = logging.FileHandler(os.getenv("SHRUNK_LOG_FILENAME"))
-    handler.setLevel(logging.INFO)
-    handler.setFormatter(formatter)
-    current_app.logger.addHandler(handler)
-    current_app.logger.setLevel(logging.INFO)
-
-
-def _init_shrunk_client() -> None:
-    """Connect to the database.
-    self.logger must be initialized before this function is called."""
-    current_app.client = ShrunkClient()
-
-
 def _init_roles() -> None:
     client: ShrunkClient = current_app.client
 
@@ -185,6 +174,7 @@ def create_app(**kwargs: Any) -> Flask:
     app = Flask(__name__, static_url_path="/static")
     app.secret_key = os.getenv("SHRUNK_SECRET_KEY")
     app.testing = bool(int(os.getenv("SHRUNK_FLASK_TESTING", 0)))
+    load_config(app, kwargs)
 
     app.config["SSO_LOGIN_URL"] = os.getenv("SSO_LOGIN_URL", "/login")
     # Maybe move to env?
@@ -210,10 +200,14 @@ def create_app(**kwargs: Any) -> Flask:
     app.url_map.converters["hex_token"] = HexTokenConverter
 
     # call initialization functions
-    app.before_first_request(_init_logging)
-    app.before_first_request(_init_shrunk_client)
+    app.before_first_request(init_logging)
+    app.before_first_request(init_shrunk_client)
+    app.before_first_request(init_redirect_cache)
     app.before_first_request(_init_roles)
 
+    # maintenance commands
+    app.cli.add_command(commands.cli)
+
     # wsgi middleware
     app.wsgi_app = ProxyFix(app.wsgi_app)  # type: ignore
 
@@ -235,6 +229,7 @@ def create_app(**kwargs: Any) -> Flask:
     app.register_blueprint(api.linkv1.bp)
     app.register_blueprint(api.trackingpixelv1.bp)
     app.register_blueprint(api.orgv1.bp)
+    app.register_blueprint(redirects.bp)
 
     # set up extensions
     mail = Mail()
@@ -375,168 +370,6 @@ def create_app(**kwargs: Any) -> Flask:
             }
         )
 
-    # serve redirects
-    @app.route("/<alias>", methods=["GET"])
-    def _serve_shortened_links(alias: str) -> Any:
-        client: ShrunkClient = current_app.client
-
-        # Check if the alias is a legacy tracking pixel link
-        link_info = client.links.get_link_info_by_alias(alias)
-        if link_info is None:
-            link_info = client.links.get_link_info_by_alias(alias.lower())
-            alias = alias.lower()
-
-        if link_info is None:
-            return jsonify({"message": "Link not found1"}), 404
-
-        is_tracking_pixel_link = client.links.is_tracking_pixel_link(alias)
-        if is_tracking_pixel_link:
-            # TODO: Add legacy testing after this is done: https://gitlab.rutgers.edu/MaCS/OSS/shrunk/-/issues/223
-
-            # Documents have "is_trackingpixel_legacy_endpoint" field if not legacy.. lol
-            if link_info.get("is_trackingpixel_legacy_endpoint", True):
-                # Treat legacy tracking pixels.
-
-                # TODO: Make this for the /<alias> route
-                return redirect(f"/api/core/t/{alias}")
-            else:
-                # We do not want to promote the use of tracking pixels used under the alias route.
-                return jsonify({"message": "Link not found2"}), 404
-
-        long_url = client.links.get_long_url(alias)
-        if long_url is None:
-            return jsonify({"message": "Link not found3"}), 404
-
-        # Get or generate a tracking id
-        tracking_id = request.cookies.get("shrunkid") or client.tracking.get_new_id()
-
-        # Check if the request is coming from a custom domain
-        full_domain = request.headers.get("Host", "")
-        custom_domain_alias = None
-        request_domain = full_domain.split(".")[0] if full_domain else ""
-
-        if request_domain.startswith("localhost"):
-            request_domain = "localhost"
-        if not is_tracking_pixel_link and request_domain not in {
-            "localhost",
-            "go",
-            "shrunk",
-        }:
-            custom_domain_alias = client.links.get_custom_domain(alias)
-            if request_domain != custom_domain_alias:
-                return jsonify({"message": "Domain not found"}), 404
-
-        if long_url is None and not is_tracking_pixel_link:
-            return jsonify({"message": "Link not found4"}), 404
-
-        # Get or generate a tracking id
-        tracking_id = request.cookies.get("shrunkid") or client.tracking.get_new_id()
-
-        q_strings = {}
-        mid = None
-        uid = None
-        source = None
-
-        # Preserve URL parameters from the original request
-        if request.query_string:
-            print("true", request.query_string, flush=True)
-            separator = "&" if "?" in long_url else "?"
-
-            decoded = request.query_string.decode("utf-8").replace("&amp;", "&")
-            q_strings = dict(parse_qsl(decoded))
-            mid = q_strings.get("mid", None)
-            uid = q_strings.get("uid", None)
-            source = q_strings.get("source", None)
-            q_strings.pop("mid", None)
-            q_strings.pop("uid", None)
-            q_strings.pop("source", None)
-
-            if len(q_strings) == 0:
-                separator = ""
-            long_url = f"{long_url}{separator}{urlencode(q_strings)}"
-
-        allowed_sources = ["qr"]
-
-        if source not in allowed_sources:
-            source = None
-
-        client.links.visit(
-            alias,
-            tracking_id,
-            request.remote_addr,
-            request.headers.get("User-Agent"),
-            request.headers.get("Referer"),
-            uid,
-            mid,
-            source,
-        )
-
-        if "://" not in long_url:
-            long_url = f"http://{long_url}"
-
-        response = redirect(long_url)
-
-        # Not entirely sure what this is here for, maybe to track unique visitors?
-        response.set_cookie("shrunkid", tracking_id)
-
-        return response
-
-    # Redirect to the alias stats page if "/manage" is appended to the alias
-    @app.route("/<alias>/manage", methods=["GET"])
-    def _serve_shortened_links_manage(alias: str) -> Any:
-        client: ShrunkClient = current_app.client
-        link_info = client.links.get_link_info_by_alias(alias)
-        # might be legacy alias
-        if link_info is None:
-            link_info = client.links.get_link_info_by_alias(alias.lower())
-            alias = alias.lower()
-
-        if link_info is None:
-            return jsonify({"message": "Link not found"}), 404
-
-        return redirect(f'/app/links/{str(link_info["_id"])}')
-
-    # Add "/api/core/t/" because you're technically using an API endpoint for the websites using the tracking pixel.
-    # This will also make it easier for the NGINX server in the near future.
-    @app.route("/api/core/t/<tracking_pixel>", methods=["GET"])
-    def _serve_tracking_pixel(tracking_pixel: str) -> Any:
-        client: ShrunkClient = current_app.client
-        tracking_id = request.cookies.get("shrunkid") or client.tracking.get_new_id()
-
-        if client.links.get_link_info_by_alias(tracking_pixel) is None:
-            return "There was an error trying to find your tracking pixel.", 404
-
-        mid = request.args.get("mid", None)
-        uid = request.args.get("uid", None)
-
-        client.links.visit(
-            tracking_pixel,
-            tracking_id,
-            request.remote_addr,
-            request.headers.get("User-Agent"),
-            request.headers.get("Referer"),
-            uid,
-            mid,
-        )
-
-        extension = None
-
-        if "." in tracking_pixel:
-            extension = tracking_pixel.split(".")[-1]
-        else:
-            extension = "gif"
-
-        filename = "./static/img/pixel.{}".format(extension)
-        response = send_file(filename, mimetype="image/{}".format(extension))
-        response.headers["X-Image-Name"] = "pixel.{}".format(extension)
-        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-
-        response.set_cookie("shrunkid", tracking_id)
-
-        return response
-
     @app.before_request
     def _record_visit() -> None:
         netid = flask.session["user"]["netid"] if "user" in flask.session else None
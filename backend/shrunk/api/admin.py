@@ -59,7 +59,15 @@ def get_overview_stats(netid: str, client: ShrunkClient, req: Any) -> Any:
 
     .. code-block:: json
 
-       { "links": "number", "visits": "number", "users": "number" }
+       {
+         "links": "number",
+         "visits": "number",
+         "users": "number",
+         "approx_unique_visitors": "number"
+       }
+
+    ``approx_unique_visitors`` is an estimate, typically within a few percent,
+    made from the HyperLogLog sketches of the daily visit rollups.
 
     :param netid:
     :param client:
@@ -94,3 +102,23 @@ def get_endpoint_stats(netid: str, client: ShrunkClient) -> Any:
         abort(403)
     stats = client.endpoint_stats()
     return jsonify({"stats": stats})
+
+
+@bp.route("/stats/redirect", methods=["GET"])
+@require_login
+def get_redirect_stats(netid: str, client: ShrunkClient) -> Any:
+    """``GET /api/stats/redirect``
+
+    Returns the counters of the in-memory structures used to serve redirects
+    in the worker that handles the request. Response format:
+
+    .. code-block:: json
+
+       { "cache": { "size": "number", "hits": "number", "misses": "number", "evictions": "number" } }
+
+    :param netid:
+    :param client:
+    """
+    if not client.users.has_role(netid, "admin"):
+        abort(403)
+    return jsonify(client.links.get_redirect_stats())
@@ -22,10 +22,7 @@ from shrunk.client.exceptions import (
     SecurityRiskDetected,
     LinkIsPendingOrRejected,
 )
-from shrunk.util.stats import (
-    get_human_readable_referer_domain,
-    browser_stats_from_visits,
-)
+from shrunk.util.stats import get_human_readable_referer_domain
 from shrunk.util.ldap import is_valid_netid
 from shrunk.util.decorators import (
     require_login,
@@ -649,7 +646,19 @@ def get_link_overall_stats(netid: str, client: ShrunkClient, link_id: ObjectId)
 
     .. code-block:: json
 
-       { "total_visits": "number", "unique_visits": "number" }
+       {
+         "total_visits": "number",
+         "unique_visits": "number",
+         "bot_visits?": "number",
+         "collapsed_visits?": "number"
+       }
+
+    ``bot_visits`` counts requests recognized as bots when
+    ``SHRUNK_BOT_VISITS`` is ``count``, and ``collapsed_visits`` repeat
+    visits dropped by ``SHRUNK_VISIT_DEDUP_WINDOW``. Both are omitted when
+    ``source`` is given.
+    Pass ``include_pending=1`` to also count visits that have been counted
+    in memory but not written to the database yet.
 
     :param netid:
     :param client:
@@ -661,8 +670,11 @@ def get_link_overall_stats(netid: str, client: ShrunkClient, link_id: ObjectId)
         abort(403)
 
     source = request.args.get("source")
+    include_pending = bool(int(request.args.get("include_pending", 0)))
 
-    stats = client.links.get_overall_visits(link_id, None, source)
+    stats = client.links.get_overall_visits(
+        link_id, None, source, include_pending=include_pending
+    )
     return jsonify(stats)
 
 
@@ -781,8 +793,7 @@ def get_link_browser_stats(netid: str, client: ShrunkClient, link_id: ObjectId)
 
     source = request.args.get("source")
 
-    visits = client.links.get_visits(link_id, source=source)
-    stats = browser_stats_from_visits(visits)
+    stats = client.links.get_browser_stats(link_id, source=source)
     return jsonify(stats)
 
 
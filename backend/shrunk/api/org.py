@@ -360,8 +360,12 @@ def get_org_stats(netid: str, client: ShrunkClient, org_id: ObjectId) -> Any:
          "total_links": "number",
          "total_visits": "number",
          "total_users": "number",
+         "approx_unique_visitors": "number",
        }
 
+    ``approx_unique_visitors`` estimates, typically within a few percent, the
+    distinct visitors across all of the org's links.
+
     """
 
     if client.orgs.get_org(org_id) is None:
@@ -104,6 +104,10 @@ SEARCH_SCHEMA = {
             "type": "string",
             "description": "Filter links by owner netid",
         },
+        "include_pending_visits": {
+            "type": "boolean",
+            "description": "Include visits counted by this worker but not yet written",
+        },
     },
 }
 
@@ -137,7 +141,8 @@ def post_search_urls(netid: str, client: ShrunkClient, req: Any) -> Any:
            "limit": "number"
          },
          "begin_time?": "date-time",
-         "end_time?": "date-time"
+         "end_time?": "date-time",
+         "include_pending_visits?": "boolean"
        }
 
     Response format:
@@ -0,0 +1,49 @@
+"""Initialization functions shared by the applications in
+:py:mod:`shrunk` and :py:mod:`shrunk.redirector`. Those named ``init_*``
+are registered with ``app.before_first_request``."""
+
+import logging
+import os
+from typing import Any, Dict
+
+from flask import Flask, current_app
+
+from .client import ShrunkClient
+from .client.config import from_env
+
+__all__ = ["load_config", "init_logging", "init_shrunk_client", "init_redirect_cache"]
+
+
+def load_config(app: Flask, overrides: Dict[str, Any]) -> None:
+    """Put the settings of :py:class:`ShrunkClient` in ``app.config``: those
+    set in the environment, then ``overrides``."""
+    app.config.update(from_env())
+    app.config.update(overrides)
+
+
+def init_logging() -> None:
+    """Sets up self.logger with default settings."""
+    formatter = logging.Formatter(os.getenv("SHRUNK_LOG_FORMAT"))
+    handler = logging.FileHandler(os.getenv("SHRUNK_LOG_FILENAME"))
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(formatter)
+    current_app.logger.addHandler(handler)
+    current_app.logger.setLevel(logging.INFO)
+
+
+def init_shrunk_client() -> None:
+    """Connect to the database.
+    self.logger must be initialized before this function is called."""
+    current_app.client = ShrunkClient(**current_app.config)
+
+
+def init_redirect_cache() -> None:
+    """Preload the most visited links, so that the first requests after a
+    deploy do not all go to the database."""
+    client: ShrunkClient = current_app.client
+    count = client.links.warm_redirect_cache(client.config["REDIRECT_CACHE_WARM_SIZE"])
+    if client.links.warmup_stats is not None:
+        seconds = client.links.warmup_stats["seconds"]
+        current_app.logger.info(
+            f"warmed the redirect cache with {count} links in {seconds:.3f}s"
+        )
@@ -6,9 +6,12 @@ from typing import Any, List, Optional, Set
 import os
 import pymongo
 
+from .config import DEFAULTS, degraded_mode_enabled
+from .counters import CounterBuffer
 from .geoip import GeoipClient
 from .links import LinksClient
 from .orgs import OrgsClient
+from .redirect_cache import LinkChangeLog
 from .search import SearchClient
 from .security import SecurityClient
 from .tickets import TicketsClient
@@ -23,7 +26,12 @@ __all__ = ["ShrunkClient"]
 class ShrunkClient:
     """This class implements all of the backend functionality for Shrunk.
     It is responsible for interacting with Mongo and the GeoIP database
-    as well as managing in-memory roles state."""
+    as well as managing in-memory roles state.
+
+    The settings listed in :py:data:`shrunk.client.config.DEFAULTS` are
+    taken from the keyword arguments, e.g. ``ShrunkClient(**app.config)``.
+    Visits are located with ``geoip``, or else with the database at
+    ``SHRUNK_GEOLITE_PATH``."""
 
     def __init__(
         self,
@@ -31,38 +39,96 @@ class ShrunkClient:
         DB_PASSWORD: Optional[str] = None,
         RESERVED_WORDS: Optional[Set[str]] = None,
         BANNED_REGEXES: Optional[List[str]] = None,
-        **_kwargs: Any,
+        geoip: Optional[GeoipClient] = None,
+        **config: Any,
     ):
-        self.conn = pymongo.MongoClient(
-            os.getenv("SHRUNK_DB_HOST"),
-            int(os.getenv("SHRUNK_DB_PORT")),
+        self.config = dict(DEFAULTS)
+        self.config.update(
+            (name, value) for name, value in config.items() if name in DEFAULTS
+        )
+
+        connection = dict(
+            host=os.getenv("SHRUNK_DB_HOST"),
+            port=int(os.getenv("SHRUNK_DB_PORT")),
             username=DB_USERNAME,
             password=DB_PASSWORD,
             authSource="admin",
             connect=False,
             tz_aware=True,
         )
+        self.conn = pymongo.MongoClient(**connection)
         self.db = self.conn[os.getenv("SHRUNK_DB_NAME")]
         self._ensure_indexes()
 
-        self.geoip = GeoipClient(GEOLITE_PATH=os.getenv("SHRUNK_GEOLITE_PATH"))
+        # In degraded mode, the redirect path has its own connection, which
+        # gives up quickly when the database is unreachable so that degraded
+        # mode can take over.
+        self.redirect_conn: Optional[pymongo.MongoClient] = None
+        if degraded_mode_enabled(self.config):
+            redirect_timeout_ms = int(self.config["REDIRECT_DB_TIMEOUT"] * 1000)
+            self.redirect_conn = pymongo.MongoClient(
+                **connection,
+                serverSelectionTimeoutMS=redirect_timeout_ms,
+                connectTimeoutMS=redirect_timeout_ms,
+            )
+
+        self.geoip = geoip or GeoipClient(GEOLITE_PATH=os.getenv("SHRUNK_GEOLITE_PATH"))
+        self.link_changes = LinkChangeLog(
+            db=self.db,
+            poll_interval=self.config["LINK_CHANGES_POLL_INTERVAL"],
+        )
         self.links = LinksClient(
             db=self.db,
             geoip=self.geoip,
             RESERVED_WORDS=RESERVED_WORDS or set(),
             BANNED_REGEXES=BANNED_REGEXES or [],
+            link_changes=self.link_changes,
             other_clients=self,
+            config=self.config,
+            redirect_db=(
+                self.redirect_conn[os.getenv("SHRUNK_DB_NAME")]
+                if self.redirect_conn is not None
+                else None
+            ),
         )
         self.tracking = TrackingClient(db=self.db)
 
-        self.orgs = OrgsClient(db=self.db)
+        self.orgs = OrgsClient(
+            db=self.db,
+            link_changes=self.link_changes,
+            other_clients=self,
+            redirect_db=self.links.redirect_db,
+        )
         self.search = SearchClient(db=self.db, client=self)
         self.security = SecurityClient(db=self.db, other_clients=self)
         self.tickets = TicketsClient(db=self.db)
         self.users = UserClient(db=self.db)
         self.access_tokens = AccessTokenClient(db=self.db)
+        self.endpoint_counters = self._make_endpoint_counters()
         self.roles = RolesClient(db=self.db)
 
+    def close(self) -> None:
+        """Stop the background threads, after writing what they have buffered,
+        and close the database connections."""
+        if self.endpoint_counters is not None:
+            self.endpoint_counters.stop()
+        self.links.stop()
+        if self.redirect_conn is not None:
+            self.redirect_conn.close()
+        self.conn.close()
+
+    def _make_endpoint_counters(self) -> Optional[CounterBuffer]:
+        flush_interval = self.config["ENDPOINT_STATS_FLUSH_INTERVAL"]
+        if flush_interval <= 0:
+            return None
+        return CounterBuffer(
+            collection=self.db.endpoint_statistics,
+            flush_interval=flush_interval,
+            key_fields=("endpoint", "netid"),
+            upsert=True,
+            flush_every=self.config["ENDPOINT_STATS_FLUSH_SIZE"],
+        )
+
     def _ensure_indexes(self) -> None:
         self.db.access_tokens.create_index([("token", pymongo.TEXT)], unique=True)
 
@@ -71,6 +137,11 @@ class ShrunkClient:
             partialFilterExpression={"alias": {"$exists": True}, "deleted": False},
             unique=True,
         )
+        self.db.urls.create_index(
+            [("alias_norm", pymongo.ASCENDING)],
+            partialFilterExpression={"alias_norm": {"$exists": True}, "deleted": False},
+            unique=True,
+        )
         self.db.urls.create_index([("owner._id", pymongo.ASCENDING)])
         self.db.urls.create_index(
             [
@@ -91,6 +162,28 @@ class ShrunkClient:
         self.db.visits.create_index([("source_ip", pymongo.ASCENDING)])
         self.db.visits.create_index([("mid", pymongo.ASCENDING)])
         self.db.visits.create_index([("uid", pymongo.ASCENDING)])
+        self.db.visits.create_index(
+            [("enriched", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            partialFilterExpression={"enriched": False},
+        )
+        self.db.visits.create_index(
+            [("enriched", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            name="enriched_claims",
+            partialFilterExpression={"enriched": {"$type": "objectId"}},
+        )
+        self.db.link_visitors.create_index(
+            [("link_id", pymongo.ASCENDING), ("tracking_id", pymongo.ASCENDING)],
+            unique=True,
+        )
+        self.db.visits_daily.create_index(
+            [
+                ("link_id", pymongo.ASCENDING),
+                ("day", pymongo.ASCENDING),
+                ("source", pymongo.ASCENDING),
+            ],
+            unique=True,
+        )
+        self.db.visits_daily.create_index([("day", pymongo.ASCENDING)])
         self.db.visitors.create_index([("ip", pymongo.ASCENDING)], unique=True)
         self.db.organizations.create_index([("name", pymongo.ASCENDING)], unique=True)
         self.db.organizations.create_index(
@@ -125,9 +218,23 @@ class ShrunkClient:
             "users",
             "visitors",
             "visits",
+            "link_visitors",
+            "visits_daily",
+            "visit_sketches",
+            "migrations",
             "access_tokens",
         ]:
             self.db[col].delete_many({})
+        self.links.redirect_cache.clear()
+        self.orgs.domain_routes.on_domain_changes(None)
+        if self.links.visit_counters is not None:
+            self.links.visit_counters.clear()
+        if self.links.rollup_counters is not None:
+            self.links.rollup_counters.clear()
+        if self.links.aggregate_counters is not None:
+            self.links.aggregate_counters.clear()
+        if self.endpoint_counters is not None:
+            self.endpoint_counters.clear()
 
     def admin_stats(
         self, begin: Optional[datetime] = None, end: Optional[datetime] = None
@@ -154,6 +261,7 @@ class ShrunkClient:
             num_links = self.db.urls.estimated_document_count()
             num_visits = self.db.visits.estimated_document_count()
             num_users = self.db.users.estimated_document_count()
+            num_visitors = self.links.estimate_unique_visitors()
 
         elif begin is not None and end is not None:
 
@@ -167,6 +275,7 @@ class ShrunkClient:
 
             num_links = self.db.urls.count_documents(match_range("timeCreated"))
             num_visits = self.db.visits.count_documents(match_range("time"))
+            num_visitors = self.links.estimate_unique_visitors(date_range=(begin, end))
 
         else:
             raise ValueError(f"Invalid input begin={begin} end={end}")
@@ -175,10 +284,14 @@ class ShrunkClient:
             "links": num_links,
             "visits": num_visits,
             "users": num_users,
+            "approx_unique_visitors": num_visitors,
         }
 
     def endpoint_stats(self) -> List[Any]:
-        """Get statistics about visits to the different Flask endpoints."""
+        """Get statistics about visits to the different Flask endpoints.
+        Visits buffered by this process are written first."""
+        if self.endpoint_counters is not None:
+            self.endpoint_counters.flush()
 
         mongo_response = list(
             self.db.endpoint_statistics.aggregate(
@@ -226,6 +339,9 @@ class ShrunkClient:
           not logged in
         :param endpoint: The name of the Flask endpoint
         """
+        if self.endpoint_counters is not None:
+            self.endpoint_counters.add((endpoint, netid), {"count": 1})
+            return
         self.db.endpoint_statistics.find_one_and_update(
             {"endpoint": endpoint, "netid": netid},
             {"$set": {"endpoint": endpoint, "netid": netid}, "$inc": {"count": 1}},
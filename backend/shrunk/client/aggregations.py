@@ -7,77 +7,64 @@ def match_link_id(link_id: str) -> Any:
     return {"$match": {"link_id": link_id}}
 
 
-group_tracking_ids = {
-    "$group": {
-        "_id": "$tracking_id",
-        "visits": {
-            "$addToSet": "$$ROOT",
-        },
+# number of visits a visit document stands for; see VisitSampler
+visit_weight = {"$ifNull": ["$weight", 1]}
+
+
+def day_of(date: str) -> Any:
+    """Truncate a date to the start of its UTC day."""
+    return {
+        "$dateFromParts": {
+            "year": {"$year": date},
+            "month": {"$month": date},
+            "day": {"$dayOfMonth": date},
+        }
     }
-}
 
-find_first = {
-    "$project": {
-        "visits": {
-            "$reduce": {
-                # input is with visits[1:] beacuse first starts as visits[0]
-                # not removing 0 from input would double include
-                "input": {"$slice": ["$visits", 1, {"$size": "$visits"}]},
-                "initialValue": {"first": {"$arrayElemAt": ["$visits", 0]}, "rest": []},
-                "in": {
-                    "$cond": {
-                        "if": {"$lt": ["$$this.time", "$$value.first.time"]},
-                        "then": {
-                            "first": "$$this",
-                            "rest": {
-                                "$concatArrays": [["$$value.first"], "$$value.rest"]
-                            },
-                        },
-                        "else": {
-                            "first": "$$value.first",
-                            "rest": {"$concatArrays": [["$$this"], "$$value.rest"]},
-                        },
-                    },
-                },
-            },
+
+# count each visitor's visits per day, remembering their earliest visit that day
+group_visitor_days = {
+    "$group": {
+        "_id": {
+            "tracking_id": "$tracking_id",
+            "month": {"$month": "$time"},
+            "year": {"$year": "$time"},
+            "day": {"$dayOfMonth": "$time"},
         },
+        "first_time": {"$min": "$time"},
+        "visits": {"$sum": visit_weight},
     }
 }
 
-mark_unique = {
-    "$project": {
-        "visits": {
-            "$let": {
-                "vars": {
-                    "first": {"$mergeObjects": ["$visits.first", {"first_time": 1}]},
-                    "rest": {
-                        "$map": {
-                            "input": "$visits.rest",
-                            "as": "visit",
-                            "in": {"$mergeObjects": ["$$visit", {"first_time": 0}]},
-                        }
-                    },
+# one entry per day a visitor came back, not one per visit
+group_visitors = {
+    "$group": {
+        "_id": "$_id.tracking_id",
+        "first_time": {"$min": "$first_time"},
+        "days": {
+            "$push": {
+                "day": {
+                    "month": "$_id.month",
+                    "year": "$_id.year",
+                    "day": "$_id.day",
                 },
-                "in": {"$concatArrays": [["$$first"], "$$rest"]},
-            },
+                "first_time": "$first_time",
+                "visits": "$visits",
+            }
         },
     }
 }
 
-unwind_ips = {"$unwind": "$visits"}
+unwind_days = {"$unwind": "$days"}
 
 group_days = {
     "$group": {
-        "_id": {
-            "month": {"$month": "$visits.time"},
-            "year": {"$year": "$visits.time"},
-            "day": {"$dayOfMonth": "$visits.time"},
-        },
+        "_id": "$days.day",
         "first_time_visits": {
-            "$sum": "$visits.first_time",
+            "$sum": {"$cond": [{"$eq": ["$days.first_time", "$first_time"]}, 1, 0]},
         },
         "all_visits": {
-            "$sum": 1,
+            "$sum": "$days.visits",
         },
     }
 }
@@ -128,11 +115,10 @@ clean_results = {
 
 
 visits_aggregation = [
-    # mark the first_time_visits
-    group_tracking_ids,
-    find_first,
-    mark_unique,
-    unwind_ips,
+    # find the day of each visitor's first visit
+    group_visitor_days,
+    group_visitors,
+    unwind_days,
     # break into days
     group_days,
     # sort
@@ -140,3 +126,73 @@ visits_aggregation = [
     chronological_sort,
     clean_results,
 ]
+
+# sums visits_daily rollups into the same format as visits_aggregation
+group_rollup_days = {
+    "$group": {
+        "_id": {
+            "month": {"$month": "$day"},
+            "year": {"$year": "$day"},
+            "day": {"$dayOfMonth": "$day"},
+        },
+        "first_time_visits": {
+            "$sum": "$first_visits",
+        },
+        "all_visits": {
+            "$sum": "$visits",
+        },
+    }
+}
+
+daily_rollups_aggregation = [
+    group_rollup_days,
+    make_sortable,
+    chronological_sort,
+    clean_results,
+]
+
+
+def sum_rollup_counts(field: str) -> Any:
+    """sums a map of counts in visits_daily rollups, keyed by code"""
+    return [
+        {"$project": {"counts": {"$objectToArray": {"$ifNull": [field, {}]}}}},
+        {"$unwind": "$counts"},
+        {"$group": {"_id": "$counts.k", "value": {"$sum": "$counts.v"}}},
+        {"$addFields": {"code": "$_id"}},
+        {"$project": {"_id": 0}},
+    ]
+
+
+# sums visits_daily rollups into visits by US state and by country
+geo_rollups_facet = {
+    "$facet": {
+        "us": sum_rollup_counts("$states"),
+        "world": sum_rollup_counts("$countries"),
+    }
+}
+
+
+def sum_visits_by(field: str) -> Any:
+    """sums visit weights by the value of field, most visited first"""
+    return [
+        {"$group": {"_id": field, "value": {"$sum": visit_weight}}},
+        {"$sort": {"value": -1}},
+    ]
+
+
+# counts enriched visits by browser, platform and referer domain
+browser_stats_facet = {
+    "$facet": {
+        "browsers": sum_visits_by("$browser"),
+        "platforms": sum_visits_by("$platform"),
+        "referers": sum_visits_by("$referer_domain"),
+    }
+}
+
+
+# merges the HyperLogLog registers of visits_daily rollups, keyed by index
+merge_hll_registers = [
+    {"$project": {"registers": {"$objectToArray": {"$ifNull": ["$hll", {}]}}}},
+    {"$unwind": "$registers"},
+    {"$group": {"_id": "$registers.k", "value": {"$max": "$registers.v"}}},
+]
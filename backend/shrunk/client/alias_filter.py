@@ -0,0 +1,157 @@
+"""Implements the :py:class:`AliasFilter` class."""
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from bson.objectid import ObjectId
+import pymongo
+
+from shrunk.util.background import PeriodicWorker
+from shrunk.util.bloom import BloomFilter
+
+__all__ = ["AliasFilter"]
+
+
+class AliasFilter:
+    """Tells the redirect path which aliases certainly do not exist, so that
+    scanners and typos can be answered with a 404 without a database read.
+
+    Live aliases are kept in a Bloom filter that is built in the background
+    from ``urls`` and rebuilt every ``rebuild_interval`` seconds to forget
+    deleted aliases. Aliases that got past the Bloom filter but were not
+    found are remembered for ``negative_ttl`` seconds. Until the first build
+    finishes every alias is considered to possibly exist.
+
+    Aliases must be normalized (lowercased) by the caller."""
+
+    def __init__(
+        self,
+        *,
+        db: pymongo.database.Database,
+        error_rate: float,
+        rebuild_interval: float,
+        negative_ttl: float,
+        negative_max_size: int,
+    ):
+        self.db = db
+        self.error_rate = error_rate
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+        self._bloom: Optional[BloomFilter] = None
+        self._building = False
+        self._added_while_building: List[str] = []
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = PeriodicWorker(
+            self.rebuild,
+            interval=rebuild_interval,
+            name="shrunk-alias-filter",
+            run_at_exit=False,
+        )
+        self.bloom_rejections = 0
+        self.negative_hits = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+        self.last_rebuild_seconds: Optional[float] = None
+
+    def might_exist(self, alias: str) -> bool:
+        """Check whether a link could have the given alias."""
+        # A rebuild may replace the filter while this runs.
+        bloom = self._bloom
+        if bloom is None:
+            self._worker.start()
+            if not self._building:
+                self._worker.wake()
+            return True
+        with self._lock:
+            missing_since = self._missing.get(alias)
+            if missing_since is not None:
+                if time.monotonic() - missing_since <= self.negative_ttl:
+                    self.negative_hits += 1
+                    return False
+                del self._missing[alias]
+        if alias not in bloom:
+            self.bloom_rejections += 1
+            return False
+        return True
+
+    def record_missing(self, alias: str) -> None:
+        """Remember that a database lookup for ``alias`` found nothing."""
+        with self._lock:
+            if self._bloom is not None and alias in self._bloom:
+                self.false_positives += 1
+            self._missing[alias] = time.monotonic()
+            self._missing.move_to_end(alias)
+            while len(self._missing) > self.negative_max_size:
+                self._missing.popitem(last=False)
+
+    def add(self, alias: str) -> None:
+        """Mark an alias as live."""
+        with self._lock:
+            self._missing.pop(alias, None)
+            if self._building:
+                self._added_while_building.append(alias)
+            if self._bloom is not None:
+                self._bloom.add(alias)
+
+    def on_link_changes(self, link_ids: Optional[List[ObjectId]]) -> None:
+        """Listener for :py:class:`~shrunk.client.redirect_cache.LinkChangeLog`.
+        New and renamed links are added; unknown changes trigger a rebuild."""
+        if link_ids is None:
+            with self._lock:
+                self._missing.clear()
+            self._worker.wake()
+            return
+        for link in self.db.urls.find(
+            {"_id": {"$in": link_ids}, "deleted": False}, {"alias": 1}
+        ):
+            self.add(link["alias"].lower())
+
+    def rebuild(self) -> None:
+        """Build a new Bloom filter from the live aliases in the database."""
+        started = time.monotonic()
+        with self._lock:
+            self._building = True
+            self._added_while_building = []
+        try:
+            live = {"alias": {"$exists": True}, "deleted": False}
+            bloom = BloomFilter(
+                capacity=2 * self.db.urls.count_documents(live) + 1024,
+                error_rate=self.error_rate,
+            )
+            for link in self.db.urls.find(live, {"_id": 0, "alias": 1}):
+                bloom.add(link["alias"].lower())
+            with self._lock:
+                for alias in self._added_while_building:
+                    bloom.add(alias)
+                self._bloom = bloom
+        finally:
+            with self._lock:
+                self._building = False
+                self._added_while_building = []
+        self.rebuilds += 1
+        self.last_rebuild_seconds = time.monotonic() - started
+
+    def stop(self) -> None:
+        """Stop rebuilding the filter in the background."""
+        self._worker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        bloom = self._bloom
+        return {
+            "ready": bloom is not None,
+            "aliases": bloom.count if bloom is not None else 0,
+            "bits": bloom.num_bits if bloom is not None else 0,
+            "hashes": bloom.num_hashes if bloom is not None else 0,
+            "estimated_false_positive_rate": (
+                bloom.estimated_false_positive_rate() if bloom is not None else None
+            ),
+            "observed_false_positives": self.false_positives,
+            "bloom_rejections": self.bloom_rejections,
+            "negative_cache_size": len(self._missing),
+            "negative_cache_hits": self.negative_hits,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_seconds": self.last_rebuild_seconds,
+        }
@@ -0,0 +1,253 @@
+"""Implements the alias table: a read-only hash table of live links, stored
+in a file that every worker process maps into memory.
+
+File layout (all integers little-endian)::
+
+    header   magic, change log version, entries, slots, slots offset, build time
+    records  one BSON document per link, in no particular order
+    slots    (alias hash, record offset) pairs, open addressing with linear
+             probing; an offset of 0 marks an empty slot
+
+Since the file is mapped read-only, the operating system keeps a single
+copy of it in the page cache no matter how many workers open it."""
+
+from array import array
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+
+from shrunk.util.background import PeriodicWorker
+from .redirect_cache import LinkChangeLog
+
+__all__ = ["AliasTable", "AliasTableFile", "write_alias_table"]
+
+logger = logging.getLogger("shrunk")
+
+MAGIC = b"SHRKALT1"
+HEADER = struct.Struct("<8sqQQQd")
+SLOT = struct.Struct("<QQ")
+RECORD_LENGTH = struct.Struct("<i")
+CODEC_OPTIONS = CodecOptions(tz_aware=True)
+
+
+def _hash(alias_norm: str) -> int:
+    digest = hashlib.blake2b(alias_norm.encode("utf8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def write_alias_table(path: str, docs: Iterable[Dict[str, Any]], version: int) -> int:
+    """Write an alias table and atomically move it to ``path``.
+
+    :param path: Where to put the table
+    :param docs: Link documents. Each must have an ``alias_norm`` field.
+    :param version: The :py:class:`LinkChangeLog` version read before ``docs``
+        was queried. Links changed after it are not served from the table.
+    :returns: The number of links in the table.
+    """
+    hashes = array("Q")
+    offsets = array("Q")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(bytes(HEADER.size))
+            offset = HEADER.size
+            for doc in docs:
+                record = bson.encode(doc)
+                hashes.append(_hash(doc["alias_norm"]))
+                offsets.append(offset)
+                f.write(record)
+                offset += len(record)
+
+            # Keep the load factor at or below 1/2 so that probes stay short.
+            num_slots = 1 << max(4, (2 * len(hashes) - 1).bit_length())
+            mask = num_slots - 1
+            slots = array("Q", [0]) * (2 * num_slots)
+            for alias_hash, record_offset in zip(hashes, offsets):
+                i = alias_hash & mask
+                while slots[2 * i + 1]:
+                    i = (i + 1) & mask
+                slots[2 * i] = alias_hash
+                slots[2 * i + 1] = record_offset
+            if sys.byteorder != "little":
+                slots.byteswap()
+            f.write(slots.tobytes())
+
+            f.seek(0)
+            f.write(
+                HEADER.pack(MAGIC, version, len(hashes), num_slots, offset, time.time())
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return len(hashes)
+
+
+class AliasTableFile:
+    """A memory-mapped alias table written by :py:func:`write_alias_table`."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        (
+            magic,
+            self.version,
+            self.entries,
+            self.num_slots,
+            self.slots_offset,
+            self.built_at,
+        ) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an alias table")
+
+    def get(self, alias_norm: str) -> Optional[Dict[str, Any]]:
+        """Get the link document with the given normalized alias."""
+        alias_hash = _hash(alias_norm)
+        mask = self.num_slots - 1
+        i = alias_hash & mask
+        while True:
+            slot_hash, offset = SLOT.unpack_from(
+                self._mmap, self.slots_offset + i * SLOT.size
+            )
+            if offset == 0:
+                return None
+            if slot_hash == alias_hash:
+                (length,) = RECORD_LENGTH.unpack_from(self._mmap, offset)
+                doc: Dict[str, Any] = bson.decode(
+                    self._mmap[offset : offset + length], codec_options=CODEC_OPTIONS
+                )
+                if doc["alias_norm"] == alias_norm:
+                    return doc
+            i = (i + 1) & mask
+
+
+class AliasTable:
+    """Serves link documents from the alias table at ``path``, skipping
+    links that changed after it was built.
+
+    The file is checked for replacement every ``reload_interval`` seconds.
+    ``None`` from :py:meth:`get` means the table cannot answer, and the
+    caller should read the database."""
+
+    def __init__(
+        self, *, path: str, link_changes: LinkChangeLog, reload_interval: float
+    ):
+        self.path = path
+        self.link_changes = link_changes
+        self._file: Optional[AliasTableFile] = None
+        self._identity: Optional[Tuple[int, int]] = None
+        self._stale_ids: Set[ObjectId] = set()
+        self._changed_during_reload: Optional[Set[ObjectId]] = None
+        self._invalidated_during_reload = False
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._worker = PeriodicWorker(
+            self.reload,
+            interval=reload_interval,
+            name="shrunk-alias-table",
+            run_at_exit=False,
+        )
+        self.link_changes.subscribe(self.on_link_changes)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.reloads = 0
+
+    def get(self, alias_norm: str) -> Optional[Dict[str, Any]]:
+        """Get the link document with the given normalized alias, if the
+        table has it and the link has not changed since the table was built."""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                self.reload()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(f"failed to load alias table {self.path}")
+        self._worker.start()
+        table = self._file
+        if table is None:
+            return None
+        doc = table.get(alias_norm)
+        if doc is None:
+            self.misses += 1
+            return None
+        if doc["_id"] in self._stale_ids:
+            self.stale += 1
+            return None
+        self.hits += 1
+        return doc
+
+    def on_link_changes(self, link_ids: Optional[List[ObjectId]]) -> None:
+        """Listener for :py:class:`LinkChangeLog`. Changed links are no longer
+        served from the table; unknown changes disable it until the next build."""
+        with self._lock:
+            if link_ids is None:
+                self._file = None
+                self._invalidated_during_reload = True
+                return
+            self._stale_ids.update(link_ids)
+            if self._changed_during_reload is not None:
+                self._changed_during_reload.update(link_ids)
+
+    def reload(self) -> None:
+        """Switch to the file at :py:attr:`path` if it was replaced."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns) == self._identity:
+            return
+
+        with self._lock:
+            self._changed_during_reload = set()
+            self._invalidated_during_reload = False
+        try:
+            table = AliasTableFile(self.path)
+            changed = self.link_changes.changes_since(table.version)
+        except Exception:
+            with self._lock:
+                self._changed_during_reload = None
+            raise
+
+        with self._lock:
+            self._identity = table.identity
+            if changed is None or self._invalidated_during_reload:
+                logger.warning(
+                    f"alias table {self.path} is older than the link change history"
+                )
+                self._file = None
+            else:
+                self._file = table
+                self._stale_ids = set(changed) | self._changed_during_reload
+            self._changed_during_reload = None
+        self.reloads += 1
+
+    def stop(self) -> None:
+        """Stop reloading the table in the background."""
+        self._worker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        table = self._file
+        return {
+            "loaded": table is not None,
+            "entries": table.entries if table is not None else 0,
+            "built_at": table.built_at if table is not None else None,
+            "stale_links": len(self._stale_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "reloads": self.reloads,
+        }
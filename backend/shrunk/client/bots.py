@@ -0,0 +1,133 @@
+"""Implements the :py:class:`BotClassifier` class."""
+
+import ipaddress
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Pattern, Union
+
+__all__ = ["BotClassifier"]
+
+logger = logging.getLogger("shrunk")
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+DEFAULT_USER_AGENTS = [
+    r"bot\b",
+    r"crawler",
+    r"spider",
+    r"BingPreview",
+    r"facebookexternalhit",
+    r"Slack-ImgProxy",
+    r"SkypeUriPreview",
+    r"MicrosoftPreview",
+    r"Google-Safety",
+    r"WhatsApp",
+    r"HeadlessChrome",
+]
+"""Link previewers and crawlers that identify themselves. Most use
+``...bot`` (Slackbot, Twitterbot, LinkedInBot, Discordbot, Googlebot)."""
+
+
+class BotClassifier:
+    """Recognizes requests made by crawlers, link previewers and mail
+    scanners rather than by people.
+
+    A request is a bot if it is a ``HEAD`` request, if its user agent
+    matches one of the patterns, or if it comes from one of the networks.
+    Besides :py:data:`DEFAULT_USER_AGENTS`, signatures are read from the
+    JSON file at ``signatures_path``::
+
+        {"user_agents": ["regex", ...], "networks": ["192.0.2.0/24", ...]}
+
+    The file is read again within ``reload_interval`` seconds of changing."""
+
+    def __init__(self, *, signatures_path: Optional[str], reload_interval: float):
+        self.signatures_path = signatures_path
+        self.reload_interval = reload_interval
+        self._user_agents = self._compile(DEFAULT_USER_AGENTS)
+        self._user_agent_count = len(DEFAULT_USER_AGENTS)
+        self._networks: List[Network] = []
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.matches: Dict[str, int] = {"head": 0, "user_agent": 0, "network": 0}
+        self.reloads = 0
+
+    @staticmethod
+    def _compile(patterns: List[str]) -> Pattern[str]:
+        return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+
+    def classify(
+        self, user_agent: Optional[str], source_ip: Optional[str], method: str
+    ) -> Optional[str]:
+        """Check whether a request was made by a bot.
+
+        :returns: Why the request is considered a bot (``"head"``,
+            ``"user_agent"`` or ``"network"``), or ``None`` for people.
+        """
+        self._maybe_reload()
+        reason = None
+        if method == "HEAD":
+            reason = "head"
+        elif user_agent and self._user_agents.search(user_agent):
+            reason = "user_agent"
+        elif self._networks and source_ip and self._in_networks(source_ip):
+            reason = "network"
+        if reason is not None:
+            self.matches[reason] += 1
+        return reason
+
+    def _in_networks(self, source_ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(source_ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self._networks)
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if self.signatures_path is None or now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+            try:
+                mtime: Optional[float] = os.stat(self.signatures_path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            try:
+                signatures: Dict[str, List[str]] = {}
+                if mtime is not None:
+                    with open(self.signatures_path) as f:
+                        signatures = json.load(f)
+                patterns = DEFAULT_USER_AGENTS + list(signatures.get("user_agents", []))
+                user_agents = self._compile(patterns)
+                networks = [
+                    ipaddress.ip_network(network, strict=False)
+                    for network in signatures.get("networks", [])
+                ]
+            except (OSError, ValueError, re.error):
+                logger.exception(
+                    f"failed to load bot signatures from {self.signatures_path}"
+                )
+                return
+            self._user_agents = user_agents
+            self._user_agent_count = len(patterns)
+            self._networks = networks
+            self._mtime = mtime
+            self.reloads += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "matches": dict(self.matches),
+            "user_agent_patterns": self._user_agent_count,
+            "networks": len(self._networks),
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,90 @@
+"""Settings of :py:class:`shrunk.client.ShrunkClient` and their defaults.
+
+Each setting is passed to ``ShrunkClient`` as a keyword argument of the
+same name; the applications pass their ``app.config``. Deployments set
+them through ``SHRUNK_<name>`` environment variables, read by
+:py:func:`from_env`. See ``.env.example`` for what each one does."""
+
+import os
+from typing import Any, Dict
+
+__all__ = ["DEFAULTS", "from_env", "degraded_mode_enabled"]
+
+DEFAULTS: Dict[str, Any] = {
+    # Change notifications and endpoint statistics
+    "LINK_CHANGES_POLL_INTERVAL": 1.0,
+    "ENDPOINT_STATS_FLUSH_INTERVAL": 0.0,
+    "ENDPOINT_STATS_FLUSH_SIZE": 1000,
+    # Resolving links
+    "REDIRECT_CACHE_SIZE": 10000,
+    "REDIRECT_CACHE_TTL": 300.0,
+    "REDIRECT_CACHE_WARM_SIZE": 1000,
+    "ALIAS_FILTER_ENABLED": False,
+    "ALIAS_FILTER_ERROR_RATE": 0.001,
+    "ALIAS_FILTER_REBUILD_INTERVAL": 3600.0,
+    "ALIAS_FILTER_NEGATIVE_TTL": 60.0,
+    "ALIAS_FILTER_NEGATIVE_CACHE_SIZE": 10000,
+    "ALIAS_TABLE_PATH": None,
+    "ALIAS_TABLE_RELOAD_INTERVAL": 30.0,
+    # Writing visits
+    "VISIT_WRITE_CONCERN": None,
+    "VISIT_COUNTER_FLUSH_INTERVAL": 0.0,
+    "VISIT_INGEST_MODE": "sync",
+    "VISIT_QUEUE_SIZE": 10000,
+    "VISIT_BATCH_SIZE": 500,
+    "VISIT_FLUSH_INTERVAL": 1.0,
+    "VISIT_QUEUE_TIMEOUT": 0.05,
+    "HLL_PRECISION": 10,
+    # Enriching visits
+    "VISIT_ENRICHMENT": "inline",
+    "VISIT_ENRICHMENT_BATCH_SIZE": 1000,
+    "VISIT_ENRICHMENT_INTERVAL": 5.0,
+    "VISIT_ENRICHMENT_CACHE_SIZE": 10000,
+    "VISIT_ENRICHMENT_CLAIM_TIMEOUT": 300.0,
+    # Visits from bots
+    "BOT_VISITS": "record",
+    "BOT_SIGNATURES_PATH": None,
+    "BOT_SIGNATURES_RELOAD": 60.0,
+    "AGGREGATE_COUNTER_FLUSH_INTERVAL": 10.0,
+    # Repeat clicks
+    "VISIT_DEDUP_WINDOW": 0.0,
+    "VISIT_DEDUP_SIZE": 100000,
+    "VISIT_DEDUP_RECORD": False,
+    # Sampling visits to hot links
+    "VISIT_SAMPLE_THRESHOLD": 0,
+    "VISIT_SAMPLE_RATE": 10,
+    # Degraded mode
+    "REDIRECT_SNAPSHOT_PATH": None,
+    "VISIT_SPOOL_DIR": None,
+    "DEGRADED_RETRY_INTERVAL": 5.0,
+    "REDIRECT_DB_TIMEOUT": 0.3,
+}
+
+
+def from_env() -> Dict[str, Any]:
+    """Read the settings in :py:data:`DEFAULTS` from the environment, as the
+    type of their default. Settings that are not set keep their default."""
+    config: Dict[str, Any] = {}
+    for name, default in DEFAULTS.items():
+        value = os.getenv(f"SHRUNK_{name}")
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            config[name] = bool(int(value))
+        elif isinstance(default, int):
+            config[name] = int(value)
+        elif isinstance(default, float):
+            config[name] = float(value)
+        else:
+            config[name] = value or default
+    return config
+
+
+def degraded_mode_enabled(config: Dict[str, Any]) -> bool:
+    """Whether ``config`` gives degraded mode a snapshot to serve redirects
+    from or a directory to spool visits to."""
+    return bool(
+        config["REDIRECT_SNAPSHOT_PATH"]
+        or config["ALIAS_TABLE_PATH"]
+        or config["VISIT_SPOOL_DIR"]
+    )
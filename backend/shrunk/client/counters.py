@@ -0,0 +1,149 @@
+"""Implements the :py:class:`CounterBuffer` class."""
+
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+import pymongo
+import pymongo.errors
+
+from shrunk.util.background import PeriodicWorker
+
+__all__ = ["CounterBuffer"]
+
+
+class CounterBuffer:
+    """Coalesces ``$inc`` and ``$max`` updates to documents of one collection.
+
+    Deltas are summed and maxima kept in memory, and written every
+    ``flush_interval`` seconds as a single unordered ``bulk_write``. Since
+    both operators commute, any number of processes can flush their own
+    buffers concurrently without losing updates. Updates that fail to write
+    are kept and retried on the next flush.
+
+    Documents are identified by ``_id`` unless ``key_fields`` is given, in
+    which case keys are tuples of the values of those fields. With
+    ``upsert``, missing documents are created. If ``flush_every`` is
+    positive, a flush also starts after that many calls to :py:meth:`add`."""
+
+    def __init__(
+        self,
+        *,
+        collection: pymongo.collection.Collection,
+        flush_interval: float,
+        key_fields: Sequence[str] = ("_id",),
+        upsert: bool = False,
+        flush_every: int = 0,
+    ):
+        self.collection = collection
+        self.key_fields = tuple(key_fields)
+        self.upsert = upsert
+        self.flush_every = flush_every
+        self._added_since_flush = 0
+        self._pending: Dict[Any, Dict[str, int]] = {}
+        self._pending_max: Dict[Any, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._worker = PeriodicWorker(
+            self.flush,
+            interval=flush_interval,
+            name=f"shrunk-{collection.name}-counters",
+        )
+        self.added = 0
+        self.flushed_updates = 0
+        self.flushes = 0
+
+    def add(
+        self,
+        doc_id: Any,
+        deltas: Dict[str, int],
+        maxima: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Add ``deltas`` to the counters of the document with ``_id`` ``doc_id``,
+        and raise its fields in ``maxima`` to at least the given values."""
+        self._worker.start()
+        with self._lock:
+            self._merge(doc_id, deltas, maxima or {})
+            self.added += 1
+            self._added_since_flush += 1
+            if self.flush_every > 0 and self._added_since_flush >= self.flush_every:
+                self._added_since_flush = 0
+                self._worker.wake()
+
+    def stop(self) -> None:
+        """Stop the background thread, after writing the pending deltas."""
+        self._worker.stop()
+
+    def pending(self, doc_id: Any) -> Dict[str, int]:
+        """Get the deltas for a document that have not been written yet."""
+        with self._lock:
+            return dict(self._pending.get(doc_id, {}))
+
+    def flush(self) -> None:
+        """Write all pending deltas."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            pending_max, self._pending_max = self._pending_max, {}
+            self._added_since_flush = 0
+        operations: Dict[Any, Dict[str, Dict[str, int]]] = {}
+        for doc_id, deltas in pending.items():
+            if deltas:
+                operations.setdefault(doc_id, {})["$inc"] = deltas
+        for doc_id, maxima in pending_max.items():
+            if maxima:
+                operations.setdefault(doc_id, {})["$max"] = maxima
+        if not operations:
+            return
+        doc_ids = list(operations)
+        updates = [
+            pymongo.UpdateOne(
+                self._filter(doc_id), operations[doc_id], upsert=self.upsert
+            )
+            for doc_id in doc_ids
+        ]
+        try:
+            self.collection.bulk_write(updates, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            failed = [doc_ids[error["index"]] for error in e.details["writeErrors"]]
+            self._restore({doc_id: operations[doc_id] for doc_id in failed})
+            raise
+        except pymongo.errors.PyMongoError:
+            self._restore(operations)
+            raise
+        self.flushed_updates += len(updates)
+        self.flushes += 1
+
+    def clear(self) -> None:
+        """Discard all pending deltas."""
+        with self._lock:
+            self._pending = {}
+            self._pending_max = {}
+
+    def _filter(self, doc_id: Any) -> Dict[str, Any]:
+        if len(self.key_fields) == 1:
+            return {self.key_fields[0]: doc_id}
+        return dict(zip(self.key_fields, doc_id))
+
+    def _merge(
+        self, doc_id: Any, deltas: Dict[str, int], maxima: Dict[str, int]
+    ) -> None:
+        pending = self._pending.setdefault(doc_id, {})
+        for field, delta in deltas.items():
+            if delta:
+                pending[field] = pending.get(field, 0) + delta
+        if maxima:
+            pending_max = self._pending_max.setdefault(doc_id, {})
+            for field, value in maxima.items():
+                if field not in pending_max or value > pending_max[field]:
+                    pending_max[field] = value
+
+    def _restore(self, operations: Dict[Any, Dict[str, Dict[str, int]]]) -> None:
+        with self._lock:
+            for doc_id, update in operations.items():
+                self._merge(doc_id, update.get("$inc", {}), update.get("$max", {}))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_documents": len(self._pending.keys() | self._pending_max.keys()),
+            "added": self.added,
+            "flushed_updates": self.flushed_updates,
+            "flushes": self.flushes,
+        }
@@ -0,0 +1,220 @@
+"""Implements the :py:class:`DegradedMode` class."""
+
+import fcntl
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import json_util
+import pymongo.errors
+
+from shrunk.util.background import PeriodicWorker
+from .alias_table import AliasTableFile
+
+__all__ = ["DegradedMode"]
+
+logger = logging.getLogger("shrunk")
+
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+
+class DegradedMode:
+    """Keeps short links working while the database is unreachable.
+
+    After a connection error, :py:meth:`trip` stops the redirect path from
+    trying the database for ``retry_interval`` seconds. In the meantime
+    links are looked up in the alias table file at ``snapshot_path``, and
+    visits are appended to a JSON lines file per process in ``spool_dir``.
+    A background thread replays spooled visits once the database is back,
+    including those left behind by processes that have exited."""
+
+    def __init__(
+        self,
+        *,
+        snapshot_path: Optional[str],
+        spool_dir: Optional[str],
+        retry_interval: float,
+        write: Callable[[List[Dict[str, Any]]], None],
+        batch_size: int = 500,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.snapshot_path = snapshot_path
+        self.spool_dir = spool_dir
+        self.retry_interval = retry_interval
+        self.write = write
+        self.batch_size = batch_size
+        self.clock = clock
+        self._down_until = 0.0
+        self._snapshot: Optional[AliasTableFile] = None
+        self._snapshot_checked = 0.0
+        self._lock = threading.Lock()
+        self._worker = PeriodicWorker(
+            self.replay,
+            interval=retry_interval,
+            name="shrunk-visit-replay",
+            run_at_exit=False,
+        )
+        self.trips = 0
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        """Start replaying spool files in the background."""
+        if self.spool_dir is not None:
+            self._worker.start()
+
+    def stop(self) -> None:
+        """Stop replaying spool files in the background."""
+        self._worker.stop()
+
+    @property
+    def active(self) -> bool:
+        """Whether the database is currently considered unreachable."""
+        return self.clock() < self._down_until
+
+    def trip(self) -> None:
+        """Record that the database could not be reached."""
+        if not self.active:
+            self.trips += 1
+            logger.warning(
+                f"database unreachable, serving redirects from {self.snapshot_path}"
+            )
+        self._down_until = self.clock() + self.retry_interval
+
+    def lookup(self, alias_norm: str) -> Optional[Dict[str, Any]]:
+        """Get a link document from the snapshot."""
+        snapshot = self._open_snapshot()
+        doc = snapshot.get(alias_norm) if snapshot is not None else None
+        if doc is None:
+            self.snapshot_misses += 1
+        else:
+            self.snapshot_hits += 1
+        return doc
+
+    def _open_snapshot(self) -> Optional[AliasTableFile]:
+        now = time.monotonic()
+        if self.snapshot_path is None or now - self._snapshot_checked < 1.0:
+            return self._snapshot
+        self._snapshot_checked = now
+        try:
+            stat = os.stat(self.snapshot_path)
+            current = self._snapshot
+            if current is None or current.identity != (
+                stat.st_ino,
+                stat.st_mtime_ns,
+            ):
+                self._snapshot = AliasTableFile(self.snapshot_path)
+        except (OSError, ValueError):
+            logger.exception(f"cannot open redirect snapshot {self.snapshot_path}")
+        return self._snapshot
+
+    def spool(self, visits: List[Dict[str, Any]]) -> None:
+        """Append visits to this process's spool file, to be written later."""
+        if self.spool_dir is None:
+            self.dropped += len(visits)
+            return
+        lines = "".join(
+            json_util.dumps(visit, json_options=JSON_OPTIONS) + "\n" for visit in visits
+        )
+        path = os.path.join(self.spool_dir, f"visits-{os.getpid()}.jsonl")
+        with self._lock:
+            while True:
+                with open(path, "a") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    # If the replay thread claimed the file while we waited
+                    # for the lock, start a new one.
+                    try:
+                        claimed = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+                    except FileNotFoundError:
+                        claimed = True
+                    if claimed:
+                        continue
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    break
+        self.spooled += len(visits)
+
+    def replay(self) -> None:
+        """Write the visits of all spool files in :py:attr:`spool_dir`."""
+        if self.spool_dir is None or self.active:
+            return
+        claimed = []
+        for path in glob.glob(os.path.join(self.spool_dir, "visits-*.jsonl")):
+            claimed_path = f"{path}.{os.getpid()}.replaying"
+            with open(path) as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    os.rename(path, claimed_path)
+                except FileNotFoundError:
+                    continue
+            claimed.append(claimed_path)
+        # Files claimed by a process that died while replaying them
+        for path in glob.glob(os.path.join(self.spool_dir, "*.replaying")):
+            if not _process_exists(int(path.split(".")[-2])):
+                claimed_path = f"{path[: -len('.replaying')]}.{os.getpid()}.replaying"
+                try:
+                    os.rename(path, claimed_path)
+                except FileNotFoundError:
+                    continue
+                claimed.append(claimed_path)
+
+        for path in sorted(claimed):
+            if not self._replay_file(path):
+                return
+
+    def _replay_file(self, path: str) -> bool:
+        """Write the visits in a claimed spool file and remove it.
+
+        :returns: ``False`` if the database became unreachable.
+        """
+        with open(path) as f:
+            visits = [
+                json_util.loads(line, json_options=JSON_OPTIONS)
+                for line in f
+                if line.strip()
+            ]
+        for i in range(0, len(visits), self.batch_size):
+            batch = visits[i : i + self.batch_size]
+            try:
+                self.write(batch)
+            except pymongo.errors.ConnectionFailure:
+                self.trip()
+                self.spool(visits[i:])
+                os.remove(path)
+                return False
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(f"failed to replay visits from {path}")
+                os.rename(path, f"{path}.failed")
+                return True
+            self.replayed += len(batch)
+        os.remove(path)
+        logger.info(f"replayed {len(visits)} spooled visits")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "trips": self.trips,
+            "snapshot_hits": self.snapshot_hits,
+            "snapshot_misses": self.snapshot_misses,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+        }
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
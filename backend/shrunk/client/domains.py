@@ -0,0 +1,89 @@
+"""Implements the :py:class:`DomainRoutingTable` class."""
+
+import threading
+from typing import Any, Dict, List, Optional
+
+from bson.objectid import ObjectId
+import pymongo
+import pymongo.errors
+
+from .redirect_cache import LinkChangeLog
+
+__all__ = ["DomainRoutingTable", "MAIN_HOSTS"]
+
+MAIN_HOSTS = frozenset(["localhost", "go", "shrunk"])
+"""First labels of the hosts that serve every link."""
+
+
+def _host_label(host: str) -> str:
+    """Get the part of a ``Host`` header that names a custom domain."""
+    label = host.split(".")[0] if host else ""
+    if label.startswith("localhost"):
+        return "localhost"
+    return label
+
+
+class DomainRoutingTable:
+    """Maps the custom domains in ``organizations.domains`` to their orgs, so
+    that the redirect path can look them up in memory.
+
+    The table is read on first use and again whenever ``domain_changes``
+    reports that a domain was added or removed, by this process or another.
+    Both are read from ``db``, which is the database as seen by the redirect
+    path; while it is unreachable the last table read is kept."""
+
+    def __init__(self, *, db: pymongo.database.Database, domain_changes: LinkChangeLog):
+        self.db = db
+        self.domain_changes = domain_changes
+        self.domain_changes.subscribe(self.on_domain_changes)
+        self._domains: Optional[Dict[str, ObjectId]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def on_domain_changes(self, _ids: Optional[List[ObjectId]]) -> None:
+        """Listener for ``domain_changes``. The table is read again on next use."""
+        with self._lock:
+            self._domains = None
+            self._generation += 1
+
+    def domains(self) -> Dict[str, ObjectId]:
+        """Get the id of the org owning each custom domain."""
+        try:
+            self.domain_changes.poll(db=self.db)
+        except pymongo.errors.ConnectionFailure:
+            if self._domains is None:
+                raise
+        domains = self._domains
+        if domains is not None:
+            return domains
+        generation = self._generation
+        domains = {}
+        for org in self.db.organizations.find(
+            {"domains.domain": {"$exists": True}}, {"domains.domain": 1}
+        ):
+            for entry in org["domains"]:
+                domains[entry["domain"]] = org["_id"]
+        with self._lock:
+            # Keep the table unloaded if a domain changed while it was read.
+            if self._generation == generation:
+                self._domains = domains
+        self.reloads += 1
+        return domains
+
+    def may_serve(self, host: str, domain: str) -> bool:
+        """Check whether a request to ``host`` may be answered with a link
+        belonging to the custom domain ``domain`` (``""`` for none).
+
+        The main hosts serve every link. Any other host only serves the links
+        of the custom domain it names. This needs neither the table nor a query."""
+        label = _host_label(host)
+        return label in MAIN_HOSTS or label == domain
+
+    def stats(self) -> Dict[str, Any]:
+        domains = self._domains
+        return {
+            "loaded": domains is not None,
+            "domains": len(domains) if domains is not None else 0,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,233 @@
+"""Implements the :py:class:`VisitEnricher` class."""
+
+from datetime import datetime, timezone
+from functools import lru_cache
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from bson.objectid import ObjectId
+import pymongo
+
+from shrunk.util.background import PeriodicWorker
+from shrunk.util.stats import get_browser_platform, get_human_readable_referer_domain
+from .geoip import GeoipClient
+
+__all__ = ["VisitEnricher"]
+
+logger = logging.getLogger("shrunk")
+
+PENDING = {"enriched": False}
+"""Visits stored by :py:meth:`~shrunk.client.links.LinksClient.visit` in
+deferred mode that have not been enriched yet."""
+
+UNPARSED = {"browser": {"$exists": False}}
+"""Visits that have not been enriched, for any reason."""
+
+LEGACY = {"browser": {"$exists": False}, "enriched": {"$exists": False}}
+"""Visits stored before visits were enriched."""
+
+
+def stale_claims(cutoff: datetime) -> Dict[str, Any]:
+    """Visits claimed by :py:meth:`VisitEnricher.enrich` before ``cutoff``
+    that the claiming process did not finish enriching."""
+    return {"enriched": {"$type": "objectId", "$lt": ObjectId.from_datetime(cutoff)}}
+
+
+FIELDS = ["state_code", "country_code", "browser", "platform", "referer_domain"]
+"""The fields computed by :py:meth:`VisitEnricher.fields`."""
+
+PROJECTION = {
+    "link_id": 1,
+    "time": 1,
+    "source": 1,
+    "weight": 1,
+    "source_ip": 1,
+    "user_agent": 1,
+    "referer": 1,
+}
+
+
+class VisitEnricher:
+    """Derives the fields that the stats pages group by from the raw fields
+    of a visit: ``state_code`` and ``country_code`` from ``source_ip``,
+    ``browser`` and ``platform`` from ``user_agent``, and ``referer_domain``
+    from ``referer``.
+
+    Visits are enriched either as they are written, or afterwards in batches
+    of ``batch_size`` by a background thread that runs every ``interval``
+    seconds. The locations of the last ``cache_size`` addresses are kept in
+    memory; parsed user agents and referers are cached by
+    :py:mod:`shrunk.util.stats`.
+
+    Pending visits are claimed before they are enriched, so that several
+    processes can run the background thread without taking the same visits.
+    A claim that is not finished within ``claim_timeout`` seconds is taken
+    over by the next run. Every visit is therefore passed to ``on_enriched``
+    at least once; it is passed twice if the process that claimed it stops,
+    or takes longer than ``claim_timeout``, between calling ``on_enriched``
+    and marking the visit as done."""
+
+    def __init__(
+        self,
+        *,
+        db: pymongo.database.Database,
+        geoip: GeoipClient,
+        batch_size: int,
+        interval: float,
+        cache_size: int,
+        claim_timeout: float,
+        on_enriched: Callable[[List[Dict[str, Any]]], None],
+        clock: Callable[[], float] = time.time,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.claim_timeout = claim_timeout
+        self.on_enriched = on_enriched
+        self.clock = clock
+        self._location = lru_cache(maxsize=cache_size)(geoip.get_location_codes)
+        self._worker = PeriodicWorker(
+            self.run,
+            interval=interval,
+            name="shrunk-visit-enrichment",
+            run_at_exit=False,
+        )
+        self.enabled = interval > 0
+        self.enriched = 0
+        self.batches = 0
+        self.reclaimed = 0
+
+    def start(self) -> None:
+        """Start enriching pending visits in the background."""
+        if self.enabled:
+            self._worker.start()
+
+    def stop(self) -> None:
+        """Stop enriching visits in the background."""
+        self._worker.stop()
+
+    def fields(self, visit: Dict[str, Any]) -> Dict[str, Any]:
+        """Compute the derived fields of a visit."""
+        state_code, country_code = self._location(visit["source_ip"])
+        browser, platform = get_browser_platform(visit.get("user_agent"))
+        return {
+            "state_code": state_code,
+            "country_code": country_code,
+            "browser": browser,
+            "platform": platform,
+            "referer_domain": get_human_readable_referer_domain(
+                visit.get("referer") or "Unknown"
+            ),
+        }
+
+    def run(self) -> int:
+        """Enrich all visits written in deferred mode, including the visits
+        of batches claimed more than ``claim_timeout`` seconds ago by a
+        process that did not finish them.
+
+        :returns: The number of visits enriched.
+        """
+        cutoff = datetime.fromtimestamp(
+            self.clock() - self.claim_timeout, tz=timezone.utc
+        )
+        reclaimed = self.enrich(stale_claims(cutoff), claim=True)
+        self.reclaimed += reclaimed
+        return reclaimed + self.enrich(PENDING, claim=True)
+
+    def enrich(self, query: Dict[str, Any], claim: bool = False) -> int:
+        """Enrich all visits matching ``query``, in batches ordered by ``_id``.
+
+        :param claim: Mark each batch as taken before enriching it, skip the
+            visits another process took first, and pass the enriched visits
+            to ``on_enriched`` before marking them as done
+        :returns: The number of visits enriched.
+        """
+        total = 0
+        last_id: Optional[ObjectId] = None
+        while True:
+            batch_query = (
+                query if last_id is None else {**query, "_id": {"$gt": last_id}}
+            )
+            ids = [
+                visit["_id"]
+                for visit in self.db.visits.find(batch_query, {"_id": 1})
+                .sort("_id", pymongo.ASCENDING)
+                .limit(self.batch_size)
+            ]
+            if not ids:
+                break
+            batch = {"_id": {"$in": ids}}
+            if claim:
+                token = ObjectId()
+                self.db.visits.update_many(
+                    {**query, **batch}, {"$set": {"enriched": token}}
+                )
+                batch = {"enriched": token}
+            visits = list(self.db.visits.find(batch, PROJECTION))
+            for visit in visits:
+                visit.update(self.fields(visit))
+            if visits and not claim:
+                self.db.visits.bulk_write(
+                    [
+                        pymongo.UpdateOne(
+                            {"_id": visit["_id"]},
+                            {
+                                "$set": {
+                                    **{field: visit[field] for field in FIELDS},
+                                    "enriched": True,
+                                }
+                            },
+                        )
+                        for visit in visits
+                    ],
+                    ordered=False,
+                )
+            elif visits:
+                visits = self._finish_claim(batch, visits)
+            total += len(visits)
+            self.enriched += len(visits)
+            self.batches += 1
+            last_id = ids[-1]
+            if len(ids) < self.batch_size:
+                break
+        return total
+
+    def _finish_claim(
+        self, claimed: Dict[str, Any], visits: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Store the derived fields of claimed visits, pass them to
+        ``on_enriched`` and mark them as done. The visits keep their claim
+        until then, so that they are enriched again if this is interrupted.
+
+        :returns: The visits that were still claimed by ``claimed``.
+        """
+        result = self.db.visits.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {**claimed, "_id": visit["_id"]},
+                    {"$set": {field: visit[field] for field in FIELDS}},
+                )
+                for visit in visits
+            ],
+            ordered=False,
+        )
+        if result.matched_count < len(visits):
+            # Another process reclaimed some of them after the claim timed out.
+            still_claimed = {
+                visit["_id"] for visit in self.db.visits.find(claimed, {"_id": 1})
+            }
+            visits = [visit for visit in visits if visit["_id"] in still_claimed]
+        if visits:
+            self.on_enriched(visits)
+        self.db.visits.update_many(claimed, {"$set": {"enriched": True}})
+        return visits
+
+    def stats(self) -> Dict[str, Any]:
+        location_cache = self._location.cache_info()
+        return {
+            "enriched": self.enriched,
+            "batches": self.batches,
+            "reclaimed": self.reclaimed,
+            "location_cache_hits": location_cache.hits,
+            "location_cache_misses": location_cache.misses,
+        }
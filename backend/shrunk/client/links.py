@@ -1,11 +1,23 @@
 """Database-level interactions for shrunk."""
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import random
 import string
 import re
 import secrets
-from typing import Optional, List, Set, Any, Dict, Union, cast, Tuple
+import time
+from typing import (
+    Optional,
+    List,
+    Set,
+    Any,
+    Dict,
+    Iterator,
+    Union,
+    cast,
+    Tuple,
+    NamedTuple,
+)
 from functools import lru_cache
 
 from flask import current_app, url_for
@@ -13,16 +25,31 @@ from flask_mailman import Mail
 import requests
 import os
 import pymongo
+import pymongo.errors
 from pymongo.collection import ReturnDocument
 from pymongo.results import UpdateResult
+from pymongo.write_concern import WriteConcern
 from bson.objectid import ObjectId
 
 from shrunk.util.ldap import query_given_name
 from shrunk.util.string import get_domain
 from shrunk.util.ldap import is_valid_netid
+from shrunk.util.hyperloglog import HyperLogLog
+from shrunk.util.stats import count_browser_stats, top_browser_stats
 from . import aggregations
 
 from .geoip import GeoipClient
+from .alias_filter import AliasFilter
+from .alias_table import AliasTable, write_alias_table
+from .redirect_cache import LinkChangeLog, RedirectCache
+from .visit_dedup import VisitDeduplicator
+from .visit_sampler import VisitSampler
+from .visit_writer import VisitWriter
+from .bots import BotClassifier
+from .counters import CounterBuffer
+from .config import degraded_mode_enabled
+from .degraded import DegradedMode
+from .enrichment import LEGACY, UNPARSED, VisitEnricher
 from .exceptions import (
     NoSuchObjectException,
     BadAliasException,
@@ -32,7 +59,115 @@ from .exceptions import (
     SecurityRiskDetected,
 )
 
-__all__ = ["LinksClient"]
+__all__ = ["LinksClient", "ResolvedLink"]
+
+
+class ResolvedLink(NamedTuple):
+    """The subset of a link document needed to serve a redirect or a tracking pixel."""
+
+    id: ObjectId
+    alias: str
+    long_url: str
+    expiration_time: Optional[datetime]
+    domain: str
+    is_tracking_pixel_link: bool
+    is_trackingpixel_legacy_endpoint: bool
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        if self.expiration_time is None:
+            return False
+        return (now or datetime.now(timezone.utc)) >= self.expiration_time
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "ResolvedLink":
+        return cls(
+            id=doc["_id"],
+            alias=doc["alias"],
+            long_url=doc["long_url"],
+            expiration_time=doc.get("expiration_time"),
+            domain=doc.get("domain") or "",
+            is_tracking_pixel_link=doc.get("is_tracking_pixel_link", False),
+            is_trackingpixel_legacy_endpoint=doc.get(
+                "is_trackingpixel_legacy_endpoint", True
+            ),
+        )
+
+
+RESOLVE_PROJECTION = {
+    "_id": 1,
+    "alias": 1,
+    "long_url": 1,
+    "expiration_time": 1,
+    "domain": 1,
+    "is_tracking_pixel_link": 1,
+    "is_trackingpixel_legacy_endpoint": 1,
+}
+
+
+ROLLUP_KEY = ("link_id", "day", "source")
+"""The fields identifying a document in ``visits_daily``."""
+
+SKETCH_FOLD_DELAY = timedelta(days=2)
+"""How long after a day the unique visitor sketches of its rollups may still
+change, e.g. while visits spooled during an outage are written."""
+
+
+def _day(time: datetime) -> datetime:
+    """Get the start of the UTC day that ``time`` falls on."""
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc)
+    return datetime(time.year, time.month, time.day, tzinfo=timezone.utc)
+
+
+def _utc(time: datetime) -> datetime:
+    """Get a time as a UTC time, taking one without a timezone to be in UTC
+    already, as the database does."""
+    if time.tzinfo is None:
+        return time.replace(tzinfo=timezone.utc)
+    return time
+
+
+def _geo_counts(visit: Dict[str, Any]) -> Dict[str, int]:
+    """Get the ``visits_daily`` counters of the country and, for visits from
+    the US, the state that an enriched visit came from."""
+    counts: Dict[str, int] = {}
+    weight = visit.get("weight", 1)
+    country_code = visit.get("country_code")
+    if country_code:
+        counts[f"countries.{country_code}"] = weight
+        state_code = visit.get("state_code")
+        if country_code == "US" and state_code:
+            counts[f"states.{state_code}"] = weight
+    return counts
+
+
+def _add_visitor(
+    sketch: Dict[str, int], tracking_id: Optional[str], precision: int
+) -> None:
+    """Add a visitor to the ``hll`` registers of a ``visits_daily`` rollup,
+    given as the ``$max`` update that sets them."""
+    index, rank = HyperLogLog.register(tracking_id or "", precision)
+    field = f"hll.{index}"
+    if rank > sketch.get(field, 0):
+        sketch[field] = rank
+
+
+def _mark_written(visits: List[Dict[str, Any]], step: str) -> None:
+    """Note in the ``written`` field of ``visits`` that ``step`` is done."""
+    for visit in visits:
+        if step not in visit["written"]:
+            visit["written"].append(step)
+
+
+def _visit_document(visit: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the document stored in ``visits`` for a visit being written."""
+    doc = {field: value for field, value in visit.items() if field != "written"}
+    if doc["weight"] == 1:
+        del doc["weight"]
+    return doc
+
+
+Sketches = Dict[Tuple[ObjectId, datetime, Optional[str]], Dict[str, int]]
 
 
 class LinksClient:
@@ -64,7 +199,10 @@ class LinksClient:
         geoip: GeoipClient,
         RESERVED_WORDS: Set[str],
         BANNED_REGEXES: List[str],
+        link_changes: LinkChangeLog,
         other_clients: Any,
+        config: Dict[str, Any],
+        redirect_db: Optional[pymongo.database.Database] = None,
     ):
         self.db = db
         self.geoip = geoip
@@ -76,6 +214,171 @@ class LinksClient:
             int(os.getenv("SHRUNK_TRACKING_PIXELS_ENABLED", 0))
         )
         self.other_clients = other_clients
+        self.redirect_cache = RedirectCache(
+            max_size=config["REDIRECT_CACHE_SIZE"], ttl=config["REDIRECT_CACHE_TTL"]
+        )
+        self.link_changes = link_changes
+        self.link_changes.subscribe(self.redirect_cache.invalidate)
+        self.warmup_stats: Optional[Dict[str, Any]] = None
+        self.alias_filter = self._make_alias_filter(config)
+        self.alias_table = self._make_alias_table(config)
+
+        self.visit_write_concern = self._make_visit_write_concern(config)
+        self.visit_counters = self._make_visit_counters(self.db.urls, config)
+        self.hll_precision = HyperLogLog(precision=config["HLL_PRECISION"]).precision
+        self.rollup_counters = self._make_visit_counters(
+            self.db.visits_daily, config, key_fields=ROLLUP_KEY, upsert=True
+        )
+
+        self.bot_visit_mode = config["BOT_VISITS"]
+        self.bot_classifier = self._make_bot_classifier(config)
+        self.visit_dedup = self._make_visit_dedup(config)
+        self.record_collapsed_visits = config["VISIT_DEDUP_RECORD"]
+
+        self.defer_visit_enrichment = config["VISIT_ENRICHMENT"] == "deferred"
+        self.visit_enricher = VisitEnricher(
+            db=self.db,
+            geoip=self.geoip,
+            batch_size=config["VISIT_ENRICHMENT_BATCH_SIZE"],
+            interval=config["VISIT_ENRICHMENT_INTERVAL"],
+            cache_size=config["VISIT_ENRICHMENT_CACHE_SIZE"],
+            claim_timeout=config["VISIT_ENRICHMENT_CLAIM_TIMEOUT"],
+            on_enriched=self._count_locations,
+        )
+        self.visit_sampler = self._make_visit_sampler(config)
+
+        # Counters of visits that are not stored as visit documents
+        self.aggregate_counters = self._make_aggregate_counters(config)
+
+        self.degraded = self._make_degraded_mode(config)
+
+        # The database as seen by the redirect path. In degraded mode this
+        # should give up quickly when the database is unreachable, so that
+        # redirects are served from the snapshot instead of waiting.
+        self.redirect_db = db
+        if self.degraded is not None and redirect_db is not None:
+            self.redirect_db = redirect_db
+
+        self.visit_writer = self._make_visit_writer(config)
+
+    def _make_alias_filter(self, config: Dict[str, Any]) -> Optional[AliasFilter]:
+        if not config["ALIAS_FILTER_ENABLED"]:
+            return None
+        alias_filter = AliasFilter(
+            db=self.db,
+            error_rate=config["ALIAS_FILTER_ERROR_RATE"],
+            rebuild_interval=config["ALIAS_FILTER_REBUILD_INTERVAL"],
+            negative_ttl=config["ALIAS_FILTER_NEGATIVE_TTL"],
+            negative_max_size=config["ALIAS_FILTER_NEGATIVE_CACHE_SIZE"],
+        )
+        self.link_changes.subscribe(alias_filter.on_link_changes)
+        return alias_filter
+
+    def _make_alias_table(self, config: Dict[str, Any]) -> Optional[AliasTable]:
+        if not config["ALIAS_TABLE_PATH"]:
+            return None
+        return AliasTable(
+            path=config["ALIAS_TABLE_PATH"],
+            link_changes=self.link_changes,
+            reload_interval=config["ALIAS_TABLE_RELOAD_INTERVAL"],
+        )
+
+    def _make_bot_classifier(self, config: Dict[str, Any]) -> Optional[BotClassifier]:
+        if self.bot_visit_mode not in ("count", "ignore"):
+            return None
+        return BotClassifier(
+            signatures_path=config["BOT_SIGNATURES_PATH"],
+            reload_interval=config["BOT_SIGNATURES_RELOAD"],
+        )
+
+    def _make_visit_dedup(self, config: Dict[str, Any]) -> Optional[VisitDeduplicator]:
+        if config["VISIT_DEDUP_WINDOW"] <= 0:
+            return None
+        return VisitDeduplicator(
+            window=config["VISIT_DEDUP_WINDOW"], max_size=config["VISIT_DEDUP_SIZE"]
+        )
+
+    def _make_visit_sampler(self, config: Dict[str, Any]) -> Optional[VisitSampler]:
+        if config["VISIT_SAMPLE_THRESHOLD"] <= 0:
+            return None
+        return VisitSampler(
+            threshold=config["VISIT_SAMPLE_THRESHOLD"],
+            rate=config["VISIT_SAMPLE_RATE"],
+        )
+
+    def _make_aggregate_counters(
+        self, config: Dict[str, Any]
+    ) -> Optional[CounterBuffer]:
+        if self.bot_visit_mode != "count" and (
+            self.visit_dedup is None or not self.record_collapsed_visits
+        ):
+            return None
+        return CounterBuffer(
+            collection=self.db.urls,
+            flush_interval=config["AGGREGATE_COUNTER_FLUSH_INTERVAL"],
+        )
+
+    def _make_degraded_mode(self, config: Dict[str, Any]) -> Optional[DegradedMode]:
+        if not degraded_mode_enabled(config):
+            return None
+        return DegradedMode(
+            snapshot_path=config["REDIRECT_SNAPSHOT_PATH"]
+            or config["ALIAS_TABLE_PATH"],
+            spool_dir=config["VISIT_SPOOL_DIR"],
+            retry_interval=config["DEGRADED_RETRY_INTERVAL"],
+            write=self._write_visits,
+        )
+
+    def _make_visit_write_concern(self, config: Dict[str, Any]) -> WriteConcern:
+        write_concern = config["VISIT_WRITE_CONCERN"]
+        if not write_concern:
+            return self.db.write_concern
+        return WriteConcern(
+            int(write_concern) if write_concern.isdigit() else write_concern
+        )
+
+    def _make_visit_counters(
+        self,
+        collection: pymongo.collection.Collection,
+        config: Dict[str, Any],
+        **options: Any,
+    ) -> Optional[CounterBuffer]:
+        if config["VISIT_COUNTER_FLUSH_INTERVAL"] <= 0:
+            return None
+        return CounterBuffer(
+            collection=collection.with_options(write_concern=self.visit_write_concern),
+            flush_interval=config["VISIT_COUNTER_FLUSH_INTERVAL"],
+            **options,
+        )
+
+    def _make_visit_writer(self, config: Dict[str, Any]) -> Optional[VisitWriter]:
+        if config["VISIT_INGEST_MODE"] != "async":
+            return None
+        return VisitWriter(
+            write=self._store_visits,
+            max_queue_size=config["VISIT_QUEUE_SIZE"],
+            batch_size=config["VISIT_BATCH_SIZE"],
+            flush_interval=config["VISIT_FLUSH_INTERVAL"],
+            block_timeout=config["VISIT_QUEUE_TIMEOUT"],
+        )
+
+    def stop(self) -> None:
+        """Stop the background threads, after writing what they have buffered."""
+        if self.visit_writer is not None:
+            self.visit_writer.stop()
+        if self.visit_counters is not None:
+            self.visit_counters.stop()
+        if self.rollup_counters is not None:
+            self.rollup_counters.stop()
+        if self.aggregate_counters is not None:
+            self.aggregate_counters.stop()
+        self.visit_enricher.stop()
+        if self.degraded is not None:
+            self.degraded.stop()
+        if self.alias_filter is not None:
+            self.alias_filter.stop()
+        if self.alias_table is not None:
+            self.alias_table.stop()
 
     def alias_is_reserved(self, alias: str) -> bool:
         """Check whether a string is a reserved word that cannot be used as a short url.
@@ -85,7 +388,7 @@ class LinksClient:
         return any(alias in str(route) for route in current_app.url_map.iter_rules())
 
     def alias_is_duplicate(self, alias: str, is_tracking_pixel: bool) -> bool:
-        """Check whether the given alias already exists"""
+        """Check whether the given alias already exists, ignoring case"""
 
         # check to see if the alias is already being used
         result = self.db.urls.find_one(
@@ -94,9 +397,10 @@ class LinksClient:
                     {"is_tracking_pixel_link": {"$exists": False}},
                     {"is_tracking_pixel_link": is_tracking_pixel},
                 ],
-                "alias": {"$regex": f"^{alias}$", "$options": "i"},
+                "alias_norm": alias.lower(),
                 "deleted": False,
-            }
+            },
+            {"_id": 1},
         )
         return True if result is not None else False
 
@@ -217,6 +521,7 @@ class LinksClient:
         document = {
             "title": title,
             "alias": alias,
+            "alias_norm": alias.lower(),
             "long_url": long_url,
             "timeCreated": datetime.now(timezone.utc),
             "visits": 0,
@@ -246,6 +551,7 @@ class LinksClient:
         except pymongo.errors.DuplicateKeyError:
             raise BadAliasException
 
+        self.link_changes.record([result.inserted_id])
         return result.inserted_id, alias
 
     def modify(
@@ -284,6 +590,7 @@ class LinksClient:
             fields["expiration_time"] = expiration_time
         if alias is not None:
             fields["alias"] = alias
+            fields["alias_norm"] = alias.lower()
         if owner is not None:
 
             if owner["type"] == "netid" and is_valid_netid(owner["_id"]):
@@ -323,6 +630,7 @@ class LinksClient:
         result = self.db.urls.update_one({"_id": link_id}, update)
         if result.matched_count != 1:
             raise NoSuchObjectException
+        self.link_changes.record([link_id])
 
     def check_link_exists(
         self, long_url: str, owner: Dict[str, Any]
@@ -426,6 +734,8 @@ class LinksClient:
 
     def clear_visits(self, link_id: ObjectId) -> None:
         self.db.visits.delete_many({"link_id": link_id})
+        self.db.link_visitors.delete_many({"link_id": link_id})
+        self._delete_rollups(link_id)
         self.db.urls.update_one(
             {"_id": link_id}, {"$set": {"visits": 0, "unique_visits": 0}}
         )
@@ -443,6 +753,7 @@ class LinksClient:
         )
         if result.modified_count != 1:
             raise NoSuchObjectException
+        self.link_changes.record([link_id])
 
     def remove_expiration_time(self, link_id: ObjectId) -> None:
         result = self.db.urls.update_one(
@@ -450,15 +761,25 @@ class LinksClient:
         )
         if result.matched_count != 1:
             raise NoSuchObjectException
+        self.link_changes.record([link_id])
 
     def delete_visits(self, link_id: ObjectId) -> None:
         self.db.visits.delete_many({"link_id": link_id})
+        self.db.link_visitors.delete_many({"link_id": link_id})
+        self._delete_rollups(link_id)
         result = self.db.urls.update_one(
             {"_id": link_id}, {"$set": {"visits": 0, "unique_visits": 0}}
         )
         if result.modified_count != 1:
             raise NoSuchObjectException
 
+    def _delete_rollups(self, link_id: ObjectId) -> None:
+        """Delete the ``visits_daily`` rollups of a link, and the sketches that
+        :py:meth:`fold_visit_sketches` merged them into, to be folded again."""
+        days = self.db.visits_daily.distinct("day", {"link_id": link_id})
+        self.db.visits_daily.delete_many({"link_id": link_id})
+        self.db.visit_sketches.delete_many({"_id": {"$in": days}})
+
     def get_daily_visits(
         self,
         link_id: ObjectId,
@@ -467,57 +788,87 @@ class LinksClient:
         source: Optional[str] = None,
     ) -> List[Any]:
         """Given a short URL, return how many visits and new unique
-           visitors it gets per day for the given date range.
+           visitors it gets per day for the given date range. A visitor is
+           new on the day of their first visit within the date range.
+
+        The counts are read from the ``visits_daily`` rollups when those give
+        the same result: when :py:meth:`backfill_daily_rollups` has been run,
+        for visits from all sources to all aliases of a link, over a range
+        from before the link was created to today. Otherwise they are
+        computed from the visits themselves.
+
         :param short_url: A shortened URL
         :param date_range: Date range to consider, defaults to one year from today
         """
-
-        if alias is None:
-            match = {"$match": {"link_id": link_id}}
-        else:
-            match = {"$match": {"link_id": link_id, "alias": alias}}
-
-        if source:
-            match["$match"]["source"] = source
-
         if date_range is None:
-            date_match = {
-                "$match": {
-                    "time": {
-                        "$gte": datetime.datetime.now() - datetime.timedelta(days=365)
-                    }
-                }
-            }
-        else:
-            date_match = {
-                "$match": {"time": {"$gte": date_range[0], "$lte": date_range[1]}}
+            now = datetime.now(timezone.utc)
+            date_range = (now - timedelta(days=365), now)
+
+        if alias is None and not source and self._rollups_cover(link_id, date_range):
+            match: Dict[str, Any] = {
+                "link_id": link_id,
+                "day": {"$gte": _day(date_range[0]), "$lte": date_range[1]},
             }
+            aggregation = [{"$match": match}] + cast(
+                List[Any], aggregations.daily_rollups_aggregation
+            )
+            return list(self.db.visits_daily.aggregate(aggregation))
 
-        aggregation = (
-            [match] + [date_match] + cast(List[Any], aggregations.visits_aggregation)
+        match = {
+            "link_id": link_id,
+            "time": {"$gte": date_range[0], "$lte": date_range[1]},
+        }
+        if alias is not None:
+            match["alias"] = alias
+        if source:
+            match["source"] = source
+        aggregation = [{"$match": match}] + cast(
+            List[Any], aggregations.visits_aggregation
         )
         return list(self.db.visits.aggregate(aggregation, allowDiskUse=True))
 
+    def _rollups_cover(
+        self, link_id: ObjectId, date_range: Tuple[datetime, datetime]
+    ) -> bool:
+        """Whether every visit to a link falls within ``date_range``, and is
+        counted in the ``visits_daily`` rollups. Only then is a visitor new
+        in the range on the same day as they are in the rollups: the day of
+        their first visit ever."""
+        begin, end = (_utc(time) for time in date_range)
+        if _day(end) < _day(datetime.now(timezone.utc)):
+            return False
+        link = self.db.urls.find_one({"_id": link_id}, {"timeCreated": 1})
+        if link is None or _utc(link["timeCreated"]) < begin:
+            return False
+        return self.db.migrations.find_one({"_id": "visits_daily"}) is not None
+
     def get_geoip_stats(
         self,
         link_id: Optional[ObjectId] = None,
         alias: Optional[str] = None,
         source: Optional[str] = None,
     ) -> Any:
-        if alias is not None:
-            assert link_id is not None
-
-        aggregation = []
-        if link_id is not None:
-            if alias is None:
-                match = {"$match": {"link_id": link_id}}
-            else:
-                match = {"$match": {"link_id": link_id, "alias": alias}}
-
+        """Count the visits to a link, or to all links, by US state and by
+        country. The counts are read from the ``visits_daily`` rollups, except
+        for a single alias, which are computed from the visits themselves."""
+        if alias is None:
+            match: Dict[str, Any] = {}
+            if link_id is not None:
+                match["link_id"] = link_id
             if source:
-                match["$match"]["source"] = source
+                match["source"] = source
+            return next(
+                self.db.visits_daily.aggregate(
+                    [{"$match": match}, aggregations.geo_rollups_facet]
+                )
+            )
 
-            aggregation.append(match)
+        assert link_id is not None
+        aggregation = []
+        match = {"$match": {"link_id": link_id, "alias": alias}}
+        if source:
+            match["$match"]["source"] = source
+        aggregation.append(match)
         aggregation.append(
             {
                 "$facet": {
@@ -528,13 +879,23 @@ class LinksClient:
                                 "state_code": {"$exists": True, "$ne": None},
                             }
                         },
-                        {"$group": {"_id": "$state_code", "value": {"$sum": 1}}},
+                        {
+                            "$group": {
+                                "_id": "$state_code",
+                                "value": {"$sum": aggregations.visit_weight},
+                            }
+                        },
                         {"$addFields": {"code": "$_id"}},
                         {"$project": {"_id": 0}},
                     ],
                     "world": [
                         {"$match": {"country_code": {"$exists": True, "$ne": None}}},
-                        {"$group": {"_id": "$country_code", "value": {"$sum": 1}}},
+                        {
+                            "$group": {
+                                "_id": "$country_code",
+                                "value": {"$sum": aggregations.visit_weight},
+                            }
+                        },
                         {"$addFields": {"code": "$_id"}},
                         {"$project": {"_id": 0}},
                     ],
@@ -548,30 +909,57 @@ class LinksClient:
         link_id: ObjectId,
         alias: Optional[str] = None,
         source: Optional[str] = None,
+        include_pending: bool = False,
     ) -> Any:
+        """Get the total and unique visit counts of a link.
+
+        :param link_id:
+        :param alias: Only count visits to this alias
+        :param source: Only count visits from this source
+        :param include_pending: Add the counts this process has not written to
+          the link document yet. Only applies when ``alias`` and ``source`` are unset.
+        """
         if alias is None:
             info = self.get_link_info(link_id)
 
             if source:
                 filter = {"link_id": link_id, "source": source}
-                total_visits = self.db.visits.count_documents(filter)
                 visits = self.db.visits.aggregate(
                     [
                         {"$match": filter},
-                        {"$group": {"_id": "$tracking_id"}},
-                        {"$count": "count"},
+                        {
+                            "$group": {
+                                "_id": "$tracking_id",
+                                "visits": {"$sum": aggregations.visit_weight},
+                            }
+                        },
+                        {
+                            "$group": {
+                                "_id": None,
+                                "total": {"$sum": "$visits"},
+                                "unique": {"$sum": 1},
+                            }
+                        },
                     ],
                     allowDiskUse=True,
                 )
-                unique_visits = next(visits, {"count": 0})
+                counts = next(visits, {"total": 0, "unique": 0})
                 return {
-                    "total_visits": total_visits,
-                    "unique_visits": unique_visits["count"],
+                    "total_visits": counts["total"],
+                    "unique_visits": counts["unique"],
                 }
 
+            pending = (
+                self.get_pending_visits(link_id)
+                if include_pending
+                else {"visits": 0, "unique_visits": 0}
+            )
             return {
-                "total_visits": info["visits"],
-                "unique_visits": info.get("unique_visits", 0),
+                "total_visits": info["visits"] + pending["visits"],
+                "unique_visits": info.get("unique_visits", 0)
+                + pending["unique_visits"],
+                "bot_visits": info.get("bot_visits", 0),
+                "collapsed_visits": info.get("collapsed_visits", 0),
             }
 
         # If alias is not None, execute an aggregation to compute the stats.
@@ -586,7 +974,14 @@ class LinksClient:
                     },
                     {
                         "$facet": {
-                            "total_visits": [{"$count": "count"}],
+                            "total_visits": [
+                                {
+                                    "$group": {
+                                        "_id": None,
+                                        "count": {"$sum": aggregations.visit_weight},
+                                    }
+                                }
+                            ],
                             "unique_visits": [
                                 {"$group": {"_id": "$tracking_id"}},
                                 {"$count": "count"},
@@ -603,6 +998,110 @@ class LinksClient:
             "unique_visits": result["unique_visits"][0]["count"],
         }
 
+    def estimate_unique_visitors(
+        self,
+        link_ids: Optional[List[ObjectId]] = None,
+        date_range: Optional[Tuple[datetime, datetime]] = None,
+        source: Optional[str] = None,
+    ) -> int:
+        """Estimate the number of distinct visitors to some links by merging
+        the HyperLogLog sketches of their ``visits_daily`` rollups. For all
+        links from all sources, the days folded by :py:meth:`fold_visit_sketches`
+        are read from their ``visit_sketches`` document instead, so only the
+        rollups of the days not folded yet are merged.
+
+        :param link_ids: The links to count, or ``None`` for all links
+        :param date_range: Only count visitors on the whole UTC days in this range
+        :param source: Only count visits from this source
+        """
+        match: Dict[str, Any] = {}
+        if link_ids is not None:
+            match["link_id"] = {"$in": link_ids}
+        if source:
+            match["source"] = source
+        days: Dict[str, Any] = {"$type": "date"}
+        if date_range is not None:
+            days.update({"$gte": _day(date_range[0]), "$lte": date_range[1]})
+        sketch = HyperLogLog(precision=self.hll_precision)
+        if not match:
+            folded = self.db.visit_sketches.distinct("_id", {"_id": days})
+            if folded:
+                sketch.merge(
+                    self._merge_registers(
+                        self.db.visit_sketches, {"_id": {"$in": folded}}
+                    )
+                )
+                days["$nin"] = folded
+        match["day"] = days
+        sketch.merge(self._merge_registers(self.db.visits_daily, match))
+        return sketch.count()
+
+    def _merge_registers(
+        self, collection: pymongo.collection.Collection, match: Dict[str, Any]
+    ) -> Iterator[Tuple[int, int]]:
+        """Get the largest value of each register of the HyperLogLog sketches
+        in the ``hll`` field of the documents matching ``match``."""
+        registers = collection.aggregate(
+            [{"$match": match}] + cast(List[Any], aggregations.merge_hll_registers),
+            allowDiskUse=True,
+        )
+        return ((int(register["_id"]), register["value"]) for register in registers)
+
+    def fold_visit_sketches(self) -> None:
+        """Merge the unique visitor sketches of the rollups of each day older
+        than ``SKETCH_FOLD_DELAY`` into one ``visit_sketches`` document per
+        day, keyed by the day. Days that are folded already are skipped,
+        unless visits on them were cleared since."""
+        cutoff = _day(datetime.now(timezone.utc) - SKETCH_FOLD_DELAY)
+        folded = self.db.visit_sketches.distinct("_id", {"_id": {"$type": "date"}})
+        self.db.visits_daily.aggregate(
+            [
+                {"$match": {"day": {"$lt": cutoff, "$nin": folded}}},
+                {"$project": {"day": 1, "registers": {"$objectToArray": "$hll"}}},
+                {"$unwind": "$registers"},
+                {
+                    "$group": {
+                        "_id": {"day": "$day", "index": "$registers.k"},
+                        "value": {"$max": "$registers.v"},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": "$_id.day",
+                        "registers": {"$push": {"k": "$_id.index", "v": "$value"}},
+                    }
+                },
+                {"$project": {"hll": {"$arrayToObject": "$registers"}}},
+                {"$merge": {"into": "visit_sketches", "whenMatched": "replace"}},
+            ],
+            allowDiskUse=True,
+        )
+
+    def get_browser_stats(self, link_id: ObjectId, source: Optional[str] = None) -> Any:
+        """Get the top five browsers, platforms and referer domains of the
+        visitors of a link. Enriched visits are counted by the database; the
+        user agents and referers of visits that are not enriched yet are
+        parsed here, one visit at a time."""
+        match: Dict[str, Any] = {"link_id": link_id}
+        if source is not None:
+            match["source"] = source
+        facets = next(
+            self.db.visits.aggregate(
+                [
+                    {"$match": {**match, "browser": {"$exists": True}}},
+                    aggregations.browser_stats_facet,
+                ]
+            )
+        )
+        counts = {
+            name: {group["_id"]: group["value"] for group in groups}
+            for name, groups in facets.items()
+        }
+        unparsed = self.db.visits.find(
+            {**match, **UNPARSED}, {"user_agent": 1, "referer": 1, "weight": 1}
+        )
+        return top_browser_stats(count_browser_stats(unparsed, counts))
+
     def get_visits(
         self,
         link_id: ObjectId,
@@ -792,80 +1291,157 @@ class LinksClient:
         return result
 
     def get_link_info_by_alias(self, alias: str) -> Any:
-        return self.db.urls.find_one({"alias": alias, "deleted": False})
-
-    def _verify_link_alias_is_valid(self, alias):
+        return self.db.urls.find_one({"alias_norm": alias.lower(), "deleted": False})
+
+    def resolve(self, alias: str) -> Optional[ResolvedLink]:
+        """Look up everything needed to serve ``/<alias>`` with a single projected read.
+
+        Aliases are matched case-insensitively through ``alias_norm``.
+        Results are kept in :py:attr:`redirect_cache` until the link changes.
+        When :py:attr:`alias_table` is enabled, links that have not changed
+        since it was built are read from it. When :py:attr:`alias_filter` is
+        enabled, aliases it knows not to exist are rejected without a read.
+        When :py:attr:`degraded` is enabled and the database cannot be
+        reached, links are served from the snapshot file instead.
+
+        :param alias: The alias as requested
+        :returns: A :py:class:`ResolvedLink`, or ``None`` if no live link has the alias.
+            Expired links are returned; callers check :py:meth:`ResolvedLink.is_expired`.
         """
-        Finds a link by an alias and verifies that it is still valid
-        """
-        result = self.get_link_info_by_alias(alias)
-
-        # Fail if the link does not exist
-        if result is None:
-            alias = alias.lower()
-            result = self.get_link_info_by_alias(alias)
-
-        if result is None:
-            return None
-
-        # Fail if the link exists in the database but has been deleted
-        if result.get("deleted"):
+        lowered = alias.lower()
+        if self.degraded is not None and self.degraded.active:
+            return self._resolve_degraded(lowered)
+        try:
+            return self._resolve(lowered)
+        except pymongo.errors.ConnectionFailure:
+            if self.degraded is None:
+                raise
+            self.degraded.trip()
+            return self._resolve_degraded(lowered)
+
+    def _resolve(self, lowered: str) -> Optional[ResolvedLink]:
+        self.link_changes.poll(db=self.redirect_db)
+        cached = self.redirect_cache.get(lowered)
+        if cached is not None:
+            return cached
+        if self.alias_table is not None:
+            doc = self.alias_table.get(lowered)
+            if doc is not None:
+                link = ResolvedLink.from_document(doc)
+                self.redirect_cache.put(lowered, link)
+                return link
+        if self.alias_filter is not None and not self.alias_filter.might_exist(lowered):
             return None
 
-        # Fail if the link exists but has expired
-        expiration_time = result.get("expiration_time")
-        current_time = datetime.now(timezone.utc)
-        if expiration_time and current_time >= expiration_time:
+        doc = self.redirect_db.urls.find_one(
+            {"alias_norm": lowered, "deleted": False}, RESOLVE_PROJECTION
+        )
+        if doc is None:
+            if self.alias_filter is not None:
+                self.alias_filter.record_missing(lowered)
             return None
 
-        return result
-
-    def is_tracking_pixel_link(self, alias: str) -> bool:
-        result = self._verify_link_alias_is_valid(alias)
+        link = ResolvedLink.from_document(doc)
+        self.redirect_cache.put(lowered, link)
+        return link
 
-        if result is None:
-            return False
+    def _resolve_degraded(self, lowered: str) -> Optional[ResolvedLink]:
+        """Resolve an alias without the database, from memory or the snapshot."""
+        cached = self.redirect_cache.get(lowered)
+        if cached is not None:
+            return cached
+        assert self.degraded is not None
+        doc = self.degraded.lookup(lowered)
+        return ResolvedLink.from_document(doc) if doc is not None else None
 
-        return result.get("is_tracking_pixel_link", False)
-
-    def get_long_url(self, alias: str) -> Optional[str]:
-        """Given a short URL, returns the long URL.
-
-        Performs a case-insensitive search for the corresponding long URL.
-
-        :param short_url: A shortened URL
+    def warm_redirect_cache(self, limit: int) -> int:
+        """Load the ``limit`` most visited live links into :py:attr:`redirect_cache`.
 
-        :returns:
-          The long URL, or None if the short URL does not exist.
+        :returns: The number of links loaded.
         """
-        result = self._verify_link_alias_is_valid(alias)
-
-        if result is None:
-            return None
-
-        # Link exists and is valid; return its long URL
-        return cast(str, result["long_url"])
-
-    def get_custom_domain(self, alias: str) -> Optional[str]:
-        """Given a short URL, returns the domain.
-        (for now aliases are still 100% unique ideally different domains can use the same url)
-        Performs a case-insensitive search for the corresponding long URL.
+        if not self.redirect_cache.enabled or limit <= 0:
+            return 0
+        started = time.monotonic()
+        projection = dict(RESOLVE_PROJECTION, alias_norm=1)
+        docs = list(
+            self.db.urls.find(
+                {"alias_norm": {"$exists": True}, "deleted": False}, projection
+            )
+            .sort("visits", pymongo.DESCENDING)
+            .limit(min(limit, self.redirect_cache.max_size))
+        )
+        # Least visited first, so that the most visited are evicted last.
+        for doc in reversed(docs):
+            self.redirect_cache.put(doc["alias_norm"], ResolvedLink.from_document(doc))
+        self.warmup_stats = {
+            "links": len(docs),
+            "seconds": time.monotonic() - started,
+        }
+        return len(docs)
 
-        :param short_url: A shortened URL
+    def build_alias_table(self, path: str) -> int:
+        """Write every live link to an alias table file at ``path``.
 
-        :returns:
-          The domain, or None if the short URL does not exist.
+        :returns: The number of links written.
         """
-        result = self._verify_link_alias_is_valid(alias)
+        version = self.link_changes.current_version()
+        projection = dict(RESOLVE_PROJECTION, alias_norm=1)
+        docs = self.db.urls.find(
+            {"alias_norm": {"$exists": True}, "deleted": False}, projection
+        )
+        return write_alias_table(path, docs, version)
 
-        if result is None:
-            return ""
+    def enrich_visits(self, backfill: bool = False) -> int:
+        """Fill in the derived fields of visits stored in deferred mode, and
+        add them to the location counters of ``visits_daily``.
 
-        return cast(str, result.get("domain", ""))
+        :param backfill: Also enrich visits stored before visits had
+          ``browser``, ``platform`` and ``referer_domain`` fields. Their
+          locations are counted by :py:meth:`backfill_daily_rollups`.
+        :returns: The number of visits enriched.
+        """
+        count = self.visit_enricher.run()
+        if backfill:
+            count += self.visit_enricher.enrich(LEGACY)
+        return count
+
+    def get_redirect_stats(self) -> Dict[str, Any]:
+        """Get counters describing the in-memory state of the redirect path."""
+        stats: Dict[str, Any] = {"cache": self.redirect_cache.stats()}
+        if self.warmup_stats is not None:
+            stats["warmup"] = self.warmup_stats
+        if self.visit_writer is not None:
+            stats["visit_writer"] = self.visit_writer.stats()
+        if self.visit_counters is not None:
+            stats["visit_counters"] = self.visit_counters.stats()
+        if self.alias_filter is not None:
+            stats["alias_filter"] = self.alias_filter.stats()
+        if self.alias_table is not None:
+            stats["alias_table"] = self.alias_table.stats()
+        if self.degraded is not None:
+            stats["degraded"] = self.degraded.stats()
+        if self.bot_classifier is not None:
+            stats["bots"] = self.bot_classifier.stats()
+        if self.visit_dedup is not None:
+            stats["dedup"] = self.visit_dedup.stats()
+        stats["enrichment"] = self.visit_enricher.stats()
+        if self.visit_sampler is not None:
+            stats["sampling"] = self.visit_sampler.stats()
+        if self.aggregate_counters is not None:
+            stats["aggregate_counters"] = self.aggregate_counters.stats()
+        return stats
+
+    def get_pending_visits(self, link_id: ObjectId) -> Dict[str, int]:
+        """Get the visit counts of a link that this process has not written to
+        its document yet. Always zero unless visit counters are coalesced."""
+        pending = {"visits": 0, "unique_visits": 0}
+        if self.visit_counters is not None:
+            pending.update(self.visit_counters.pending(link_id))
+        return pending
 
     def visit(
         self,
-        alias: str,
+        link: ResolvedLink,
         tracking_id: Optional[str],
         source_ip: str,
         user_agent: Optional[str],
@@ -873,6 +1449,7 @@ class LinksClient:
         uid: Optional[str] = None,
         mid: Optional[str] = None,
         source: Optional[str] = None,
+        method: str = "GET",
     ) -> None:
         """Visits the given URL and logs visit information.
 
@@ -882,53 +1459,519 @@ class LinksClient:
           - Increment the hit counter
           - Log the visitor
 
-        If the URL is invalid, no side effects will occur.
+        If the URL is invalid, no side effects will occur. When
+        ``SHRUNK_VISIT_INGEST_MODE`` is ``async``, the side effects happen
+        shortly after this returns, on a background thread. When
+        ``SHRUNK_BOT_VISITS`` is ``count`` or ``ignore``, visits by bots
+        only increment the link's ``bot_visits`` counter, or are dropped.
+        Repeat visits inside ``SHRUNK_VISIT_DEDUP_WINDOW`` are dropped, and
+        counted in ``collapsed_visits`` if ``SHRUNK_VISIT_DEDUP_RECORD`` is set.
 
-        :param short_url: The short URL visited
+        :param link: The link visited, as returned by :py:meth:`resolve`
         :param tracking_id: The contents of the visitor's tracking cookie, if any
         :param source_ip: The client's IP address
         :param user_agent: The client's user agent
         :param referer: The client's referer
         :param uid: The user's unique identifier, if available
         :param mid: The mail ID, if available
+        :param source: Where the link was found, e.g. ``"qr"``
+        :param method: The HTTP method of the request
 
         """
-        resp = self.get_link_info_by_alias(alias)
-        print(resp)
-
-        if not self.db.visits.find_one(
-            {"link_id": resp["_id"], "tracking_id": tracking_id}
+        if self.bot_classifier is not None and self.bot_classifier.classify(
+            user_agent, source_ip, method
         ):
-            self.db.urls.update_one(
-                {"_id": resp["_id"]}, {"$inc": {"visits": 1, "unique_visits": 1}}
-            )
-        else:
-            self.db.urls.update_one({"_id": resp["_id"]}, {"$inc": {"visits": 1}})
-
-        state_code, country_code = self.geoip.get_location_codes(source_ip)
+            if self.aggregate_counters is not None and self.bot_visit_mode == "count":
+                self.aggregate_counters.add(link.id, {"bot_visits": 1})
+            return
+        if self.visit_dedup is not None and self.visit_dedup.is_duplicate(
+            link.id, tracking_id
+        ):
+            if self.aggregate_counters is not None and self.record_collapsed_visits:
+                self.aggregate_counters.add(link.id, {"collapsed_visits": 1})
+            return
 
-        doc = {
-            "link_id": resp["_id"],
-            "alias": alias,
+        visit: Dict[str, Any] = {
+            "link_id": link.id,
+            "alias": link.alias,
             "tracking_id": tracking_id,
             "source_ip": source_ip,
             "time": datetime.now(timezone.utc),
             "user_agent": user_agent,
             "referer": referer,
-            "state_code": state_code,
-            "country_code": country_code,
         }
 
         if mid:
-            doc["mid"] = mid
+            visit["mid"] = mid
 
         if uid:
-            doc["uid"] = uid
+            visit["uid"] = uid
 
         if source:
-            doc["source"] = source
+            visit["source"] = source
 
-        self.db.visits.insert_one(doc)
+        if self.visit_writer is not None:
+            self.visit_writer.enqueue(visit)
+        else:
+            self._store_visits([visit])
+
+    def _store_visits(self, visits: List[Dict[str, Any]]) -> None:
+        """Write visits, or spool them if the database cannot be reached.
+        Visits that were partly written are spooled with the steps already
+        done, which are skipped when they are replayed."""
+        if self.degraded is None:
+            self._write_visits(visits)
+            return
+        self.degraded.start()
+        if self.degraded.active:
+            self.degraded.spool(visits)
+            return
+        try:
+            self._write_visits(visits)
+        except pymongo.errors.ConnectionFailure:
+            self.degraded.trip()
+            self.degraded.spool(visits)
+
+    def _write_visits(self, visits: List[Dict[str, Any]]) -> None:
+        """Store visits recorded by :py:meth:`visit`, in order. Updates the hit
+        counters of the visited links and fills in the fields derived from
+        each visit, unless ``SHRUNK_VISIT_ENRICHMENT`` is ``deferred``.
+        Repeat visits to hot links are sampled if ``SHRUNK_VISIT_SAMPLE_THRESHOLD``
+        is set; the hit counters still count every visit.
+
+        Each visit is given its ``_id`` up front, and the counters it has been
+        added to are listed in its ``written`` field, so visits can be written
+        again after a failure (e.g. when retried or replayed from the spool)
+        without being counted twice.
+
+        :param visits: Visit documents without location fields
+        """
+        retried = {visit["_id"] for visit in visits if "written" in visit}
+        for visit in visits:
+            visit.setdefault("_id", ObjectId())
+            visit.setdefault("written", [])
+        self._record_visitors(visits, retried)
+        increments: Dict[ObjectId, Dict[str, int]] = {}
+        rollups: Dict[Tuple[ObjectId, datetime, Optional[str]], Dict[str, int]] = {}
+        sketches: Sketches = {}
+        for visit in visits:
+            if "weight" not in visit:
+                visit["weight"] = 1
+                if self.visit_sampler is not None:
+                    visit["weight"] = self.visit_sampler.weight(
+                        visit["link_id"], visit["first_visit"]
+                    )
+            if visit["weight"]:
+                if self.defer_visit_enrichment:
+                    visit["enriched"] = False
+                else:
+                    visit.update(self.visit_enricher.fields(visit))
+
+            if "counters" not in visit["written"]:
+                inc = increments.setdefault(
+                    visit["link_id"], {"visits": 0, "unique_visits": 0}
+                )
+                inc["visits"] += 1
+                inc["unique_visits"] += int(visit["first_visit"])
+
+            if "rollups" not in visit["written"]:
+                key = (visit["link_id"], _day(visit["time"]), visit.get("source"))
+                rollup = rollups.setdefault(key, {"visits": 0, "first_visits": 0})
+                _add_visitor(
+                    sketches.setdefault(key, {}),
+                    visit["tracking_id"],
+                    self.hll_precision,
+                )
+                rollup["visits"] += 1
+                rollup["first_visits"] += int(visit["first_visit"])
+                if visit["weight"] and not self.defer_visit_enrichment:
+                    for field, count in _geo_counts(visit).items():
+                        rollup[field] = rollup.get(field, 0) + count
+
+        if self.visit_counters is not None:
+            for link_id, inc in increments.items():
+                self.visit_counters.add(link_id, inc)
+        elif increments:
+            self.redirect_db.urls.with_options(
+                write_concern=self.visit_write_concern
+            ).bulk_write(
+                [
+                    pymongo.UpdateOne({"_id": link_id}, {"$inc": inc})
+                    for link_id, inc in increments.items()
+                ],
+                ordered=False,
+            )
+        _mark_written(visits, "counters")
+        self._write_rollups(rollups, sketches)
+        _mark_written(visits, "rollups")
+
+        stored = [_visit_document(visit) for visit in visits if visit["weight"]]
+        if stored:
+            try:
+                self.redirect_db.visits.with_options(
+                    write_concern=self.visit_write_concern
+                ).insert_many(stored, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                # Visits inserted before an earlier attempt failed.
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+        if self.defer_visit_enrichment:
+            self.visit_enricher.start()
+
+    def _write_rollups(
+        self,
+        rollups: Dict[Tuple[ObjectId, datetime, Optional[str]], Dict[str, int]],
+        sketches: Optional[Sketches] = None,
+    ) -> None:
+        """Add to the ``visits_daily`` counters and raise their HyperLogLog
+        registers, keyed by ``ROLLUP_KEY``, through ``rollup_counters`` if
+        updates are coalesced."""
+        sketches = sketches or {}
+        if self.rollup_counters is not None:
+            for key in rollups.keys() | sketches.keys():
+                self.rollup_counters.add(key, rollups.get(key, {}), sketches.get(key))
+            return
+        updates: Dict[Tuple[ObjectId, datetime, Optional[str]], Dict[str, Any]] = {}
+        for key, rollup in rollups.items():
+            updates[key] = {"$inc": rollup}
+        for key, sketch in sketches.items():
+            updates.setdefault(key, {})["$max"] = sketch
+        self._upsert_rollups(updates)
+
+    def _upsert_rollups(
+        self, updates: Dict[Tuple[ObjectId, datetime, Optional[str]], Dict[str, Any]]
+    ) -> None:
+        """Apply updates to ``visits_daily``, keyed by ``ROLLUP_KEY``."""
+        if not updates:
+            return
+        self.redirect_db.visits_daily.with_options(
+            write_concern=self.visit_write_concern
+        ).bulk_write(
+            [
+                pymongo.UpdateOne(dict(zip(ROLLUP_KEY, key)), update, upsert=True)
+                for key, update in updates.items()
+            ],
+            ordered=False,
+        )
+
+    def _count_locations(self, visits: List[Dict[str, Any]]) -> None:
+        """Add visits enriched in deferred mode to the location counters of
+        ``visits_daily``. The other counters were updated as they were stored."""
+        rollups: Dict[Tuple[ObjectId, datetime, Optional[str]], Dict[str, int]] = {}
+        for visit in visits:
+            counts = _geo_counts(visit)
+            if not counts:
+                continue
+            rollup = rollups.setdefault(
+                (visit["link_id"], _day(visit["time"]), visit.get("source")), {}
+            )
+            for field, count in counts.items():
+                rollup[field] = rollup.get(field, 0) + count
+        self._write_rollups(rollups)
+
+    def _record_visitors(
+        self, visits: List[Dict[str, Any]], retried: Set[ObjectId]
+    ) -> None:
+        """Add the visitors of ``visits`` to ``link_visitors``, and set the
+        ``first_visit`` field of the visits that do not have it yet.
+
+        :param retried: The ids of visits that an earlier attempt may have
+            recorded as the first visit of their visitor before failing.
+        """
+        firsts: Dict[Tuple[ObjectId, Optional[str]], Dict[str, Any]] = {}
+        for visit in visits:
+            if "first_visit" not in visit:
+                firsts.setdefault((visit["link_id"], visit["tracking_id"]), visit)
+        if not firsts:
+            return
+        order = list(firsts)
+        upserts = [
+            pymongo.UpdateOne(
+                {"link_id": link_id, "tracking_id": tracking_id},
+                {
+                    "$setOnInsert": {
+                        "first_visit_time": firsts[(link_id, tracking_id)]["time"],
+                        "first_visit_id": firsts[(link_id, tracking_id)]["_id"],
+                    }
+                },
+                upsert=True,
+            )
+            for link_id, tracking_id in order
+        ]
+        try:
+            result = self.redirect_db.link_visitors.bulk_write(upserts, ordered=False)
+            upserted = result.upserted_ids
+        except pymongo.errors.BulkWriteError as e:
+            # Another worker inserted the same visitor first; they are not new.
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            upserted = {entry["index"]: entry["_id"] for entry in e.details["upserted"]}
+        new_visitors = {order[index] for index in upserted}
+
+        # Visitors recorded by an earlier attempt that failed before it
+        # could note that they were new
+        recorded = []
+        for link_id, tracking_id in order:
+            visit_id = firsts[(link_id, tracking_id)]["_id"]
+            if (link_id, tracking_id) not in new_visitors and visit_id in retried:
+                recorded.append(
+                    {
+                        "link_id": link_id,
+                        "tracking_id": tracking_id,
+                        "first_visit_id": visit_id,
+                    }
+                )
+        if recorded:
+            for doc in self.redirect_db.link_visitors.find({"$or": recorded}):
+                new_visitors.add((doc["link_id"], doc["tracking_id"]))
+
+        for visit in visits:
+            if "first_visit" not in visit:
+                visitor = (visit["link_id"], visit["tracking_id"])
+                visit["first_visit"] = visitor in new_visitors
+                new_visitors.discard(visitor)
+
+    def backfill_link_visitors(self) -> None:
+        """Record the visitors of all existing visits in ``link_visitors``, so
+        that returning visitors from before it existed are not counted as new."""
+        self.db.visits.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {"link_id": "$link_id", "tracking_id": "$tracking_id"},
+                        "first_visit_time": {"$min": "$time"},
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "link_id": "$_id.link_id",
+                        "tracking_id": "$_id.tracking_id",
+                        "first_visit_time": 1,
+                    }
+                },
+                {
+                    "$merge": {
+                        "into": "link_visitors",
+                        "on": ["link_id", "tracking_id"],
+                        "whenMatched": "keepExisting",
+                        "whenNotMatched": "insert",
+                    }
+                },
+            ],
+            allowDiskUse=True,
+        )
+
+    def backfill_daily_rollups(self) -> None:
+        """Compute the ``visits_daily`` rollups, including the counts by
+        country and US state and the unique visitor sketches, from all
+        existing visits. Run this again after changing ``SHRUNK_HLL_PRECISION``.
+
+        Rollups that already exist are overwritten with the recomputed
+        counts. Visits written or enriched while this runs may be counted
+        twice or not at all. :py:meth:`get_daily_visits` reads the rollups
+        once this has run to completion."""
+        day = aggregations.day_of("$time")
+        source = {"$ifNull": ["$source", None]}
+        merge = {
+            "into": "visits_daily",
+            "on": list(ROLLUP_KEY),
+            "whenNotMatched": "insert",
+        }
+        self.db.visits.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {"link_id": "$link_id", "day": day, "source": source},
+                        "visits": {"$sum": aggregations.visit_weight},
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "link_id": "$_id.link_id",
+                        "day": "$_id.day",
+                        "source": "$_id.source",
+                        "visits": 1,
+                        "first_visits": {"$literal": 0},
+                    }
+                },
+                {
+                    "$merge": dict(
+                        merge,
+                        whenMatched=[
+                            {"$set": {"visits": "$$new.visits", "first_visits": 0}},
+                            {"$unset": ["countries", "states", "hll"]},
+                        ],
+                    )
+                },
+            ],
+            allowDiskUse=True,
+        )
+        self.db.visits.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {"link_id": "$link_id", "tracking_id": "$tracking_id"},
+                        "first": {"$min": {"time": "$time", "source": source}},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {
+                            "link_id": "$_id.link_id",
+                            "day": aggregations.day_of("$first.time"),
+                            "source": "$first.source",
+                        },
+                        "first_visits": {"$sum": 1},
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "link_id": "$_id.link_id",
+                        "day": "$_id.day",
+                        "source": "$_id.source",
+                        "first_visits": 1,
+                    }
+                },
+                {
+                    "$merge": dict(
+                        merge,
+                        whenMatched=[{"$set": {"first_visits": "$$new.first_visits"}}],
+                    )
+                },
+            ],
+            allowDiskUse=True,
+        )
+        for field, code, match in [
+            ("countries", "$country_code", {"country_code": {"$nin": [None, ""]}}),
+            (
+                "states",
+                "$state_code",
+                {"country_code": "US", "state_code": {"$nin": [None, ""]}},
+            ),
+        ]:
+            self.db.visits.aggregate(
+                [
+                    {"$match": match},
+                    {
+                        "$group": {
+                            "_id": {
+                                "link_id": "$link_id",
+                                "day": day,
+                                "source": source,
+                                "code": code,
+                            },
+                            "visits": {"$sum": aggregations.visit_weight},
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": {
+                                "link_id": "$_id.link_id",
+                                "day": "$_id.day",
+                                "source": "$_id.source",
+                            },
+                            "counts": {"$push": {"k": "$_id.code", "v": "$visits"}},
+                        }
+                    },
+                    {
+                        "$project": {
+                            "_id": 0,
+                            "link_id": "$_id.link_id",
+                            "day": "$_id.day",
+                            "source": "$_id.source",
+                            field: {"$arrayToObject": "$counts"},
+                        }
+                    },
+                    {
+                        "$merge": dict(
+                            merge, whenMatched=[{"$set": {field: f"$$new.{field}"}}]
+                        )
+                    },
+                ],
+                allowDiskUse=True,
+            )
+
+        # The sketches are built one link at a time, as the database has no
+        # function to hash visitors with. Every day is folded again afterwards.
+        self.db.visit_sketches.delete_many({})
+        sketches: Sketches = {}
+        link_id = None
+        for visit in self.db.visits.find(
+            {}, {"link_id": 1, "time": 1, "source": 1, "tracking_id": 1}
+        ).sort("link_id", pymongo.ASCENDING):
+            if visit["link_id"] != link_id:
+                self._upsert_rollups(
+                    {key: {"$max": sketch} for key, sketch in sketches.items()}
+                )
+                sketches = {}
+                link_id = visit["link_id"]
+            key = (visit["link_id"], _day(visit["time"]), visit.get("source"))
+            _add_visitor(
+                sketches.setdefault(key, {}),
+                visit.get("tracking_id"),
+                self.hll_precision,
+            )
+        self._upsert_rollups(
+            {key: {"$max": sketch} for key, sketch in sketches.items()}
+        )
+        self.db.migrations.update_one(
+            {"_id": "visits_daily"},
+            {"$set": {"time": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def backfill_alias_norm(self) -> List[List[str]]:
+        """Set ``alias_norm`` on links created before it was stored.
+
+        Live links whose aliases differ only in case cannot share an
+        ``alias_norm``. Of each such group, the link whose alias is already
+        lowercase (or else the oldest link) gets it, and the others are
+        skipped. They stay unreachable until they are renamed.
+
+        :returns: The aliases of each group of live links that collide.
+        """
+        live: Dict[str, List[Dict[str, Any]]] = {}
+        updates = []
+        for link in self.db.urls.find(
+            {"alias": {"$exists": True}}, {"alias": 1, "alias_norm": 1, "deleted": 1}
+        ):
+            if link.get("deleted"):
+                if "alias_norm" not in link:
+                    updates.append(
+                        pymongo.UpdateOne(
+                            {"_id": link["_id"]},
+                            {"$set": {"alias_norm": link["alias"].lower()}},
+                        )
+                    )
+                continue
+            live.setdefault(link["alias"].lower(), []).append(link)
+
+        collisions = []
+        for alias_norm, links in live.items():
+            if len(links) > 1:
+                collisions.append(sorted(link["alias"] for link in links))
+            links.sort(
+                key=lambda link: (
+                    "alias_norm" not in link,
+                    link["alias"] != alias_norm,
+                    link["_id"],
+                )
+            )
+            if "alias_norm" not in links[0]:
+                updates.append(
+                    pymongo.UpdateOne(
+                        {"_id": links[0]["_id"]}, {"$set": {"alias_norm": alias_norm}}
+                    )
+                )
+
+        for i in range(0, len(updates), 1000):
+            self.db.urls.bulk_write(updates[i : i + 1000], ordered=False)
+        if updates:
+            self.link_changes.record(None)
+        return collisions
 
     @lru_cache(maxsize=2048)
     def get_visitor_id(self, ipaddr: str) -> str:
@@ -949,7 +1992,7 @@ class LinksClient:
         return res["_id"]
 
     def blacklist_user_links(self, netid: str) -> UpdateResult:
-        return self.db.urls.update_many(
+        result = self.db.urls.update_many(
             {"netid": netid, "deleted": {"$ne": True}},
             {
                 "$set": {
@@ -959,15 +2002,20 @@ class LinksClient:
                 }
             },
         )
+        if result.modified_count:
+            self.link_changes.record(None)
+        return result
 
     def unblacklist_user_links(self, netid: str) -> None:
-        self.db.urls.update_many(
+        result = self.db.urls.update_many(
             {"netid": netid, "deleted": True, "deleted_by": "!BLACKLISTED"},
             {
                 "$set": {"deleted": False},
                 "$unset": {"deleted_by": 1, "deleted_time": 1},
             },
         )
+        if result.modified_count:
+            self.link_changes.record(None)
 
     def block_urls(self, ids: List[ObjectId]) -> None:
         self.db.urls.update_many(
@@ -980,6 +2028,8 @@ class LinksClient:
                 }
             },
         )
+        if ids:
+            self.link_changes.record(ids)
 
     def unblock_urls(self, ids: List[ObjectId]) -> None:
         self.db.urls.update_many(
@@ -989,6 +2039,8 @@ class LinksClient:
                 "$unset": {"deleted_by": 1, "deleted_time": 1},
             },
         )
+        if ids:
+            self.link_changes.record(ids)
 
     def request_edit_access(
         self, mail: Mail, link_id: ObjectId, requesting_netid: str
@@ -12,6 +12,9 @@ from pymongo.collation import Collation
 from .exceptions import (
     NoSuchObjectException,
 )
+from . import aggregations
+from .domains import DomainRoutingTable
+from .redirect_cache import LinkChangeLog
 
 __all__ = ["OrgsClient"]
 
@@ -19,9 +22,24 @@ __all__ = ["OrgsClient"]
 class OrgsClient:
     """This class implements all orgs-related functionality."""
 
-    def __init__(self, *, db: pymongo.database.Database):
+    def __init__(
+        self,
+        *,
+        db: pymongo.database.Database,
+        link_changes: LinkChangeLog,
+        other_clients: Any,
+        redirect_db: Optional[pymongo.database.Database] = None,
+    ):
         self.db = db
+        self.link_changes = link_changes
+        self.other_clients = other_clients
         self.domain_enabled = bool(int(os.getenv("SHRUNK_DOMAINS_ENABLED", 0)))
+        self.domain_changes = LinkChangeLog(
+            db=self.db, name="domains", poll_interval=link_changes.poll_interval
+        )
+        self.domain_routes = DomainRoutingTable(
+            db=redirect_db or self.db, domain_changes=self.domain_changes
+        )
 
     def get_org(self, org_id: ObjectId) -> Optional[Any]:
         """Get information about a given org
@@ -174,6 +192,12 @@ class OrgsClient:
             {"$or": [{"viewers._id": org_id}, {"editors._id": org_id}]},
             {"$pull": {"viewers": {"_id": org_id}, "editors": {"_id": org_id}}},
         )
+        owned_link_ids = [
+            link["_id"]
+            for link in self.db.urls.find(
+                {"owner._id": org_id, "deleted": False}, {"_id": 1}
+            )
+        ]
         self.db.urls.update_many(
             {"owner._id": org_id},
             {
@@ -184,6 +208,8 @@ class OrgsClient:
                 }
             },
         )
+        if owned_link_ids:
+            self.link_changes.record(owned_link_ids)
 
         for member in self.db.organizations.find_one({"_id": org_id})["members"]:
             if member["role"] == "guest":
@@ -323,7 +349,10 @@ class OrgsClient:
             return False
 
         result = self.db.organizations.update_one(org, update)
-        return cast(int, result.modified_count) == 1
+        if cast(int, result.modified_count) != 1:
+            return False
+        self.domain_changes.record(None)
+        return True
 
     def delete_domain(self, org_name: str, domain: str) -> bool:
         org = self.db.organizations.find_one({"name": org_name})
@@ -338,7 +367,10 @@ class OrgsClient:
         except pymongo.errors.DuplicateKeyError:
             return False
         result = self.db.organizations.update_one({"name": org_name}, update)
-        return cast(int, result.modified_count) == 1
+        if cast(int, result.modified_count) != 1:
+            return False
+        self.domain_changes.record(None)
+        return True
 
     def get_domain_status(self) -> bool:
         return self.domain_enabled
@@ -450,17 +482,16 @@ class OrgsClient:
         :param org_id: The org ID
         :returns: A list of stats for the org
         """
+        match = {
+            "$or": [
+                {
+                    "$and": [{"owner.type": "org"}, {"owner._id": org_id}],
+                },
+                {"viewers._id": org_id},
+            ]
+        }
         pipeline = [
-            {
-                "$match": {
-                    "$or": [
-                        {
-                            "$and": [{"owner.type": "org"}, {"owner._id": org_id}],
-                        },
-                        {"viewers._id": org_id},
-                    ]
-                }
-            },
+            {"$match": match},
             {
                 "$group": {
                     "_id": None,
@@ -478,23 +509,23 @@ class OrgsClient:
 
         results = list(self.db.urls.aggregate(pipeline))
         if not results or len(results) == 0:
-            return {"total_links": 0, "total_visits": 0, "total_users": 0}
+            return {
+                "total_links": 0,
+                "total_visits": 0,
+                "total_users": 0,
+                "approx_unique_visitors": 0,
+            }
+        # unique_visits counts a visitor once per link; approx_unique_visitors is
+        # an estimate that counts them once across all of the org's links.
+        link_ids = [link["_id"] for link in self.db.urls.find(match, {"_id": 1})]
+        results[0]["approx_unique_visitors"] = (
+            self.other_clients.links.estimate_unique_visitors(link_ids)
+        )
         return results[0]
 
     def get_geoip_stats(self, org_id: ObjectId) -> Any:
-        def not_null(field: str) -> Any:
-            return [{"$match": {field: {"$exists": True, "$ne": None}}}]
-
-        def group_by(op: str) -> Any:
-            return [{"$group": {"_id": op, "value": {"$sum": 1}}}]
-
-        filter_us = [{"$match": {"country_code": "US"}}]
-
-        rename_id = [
-            {"$addFields": {"code": "$_id"}},
-            {"$project": {"_id": 0}},
-        ]
-
+        """Count the visits to the links of an org's members by US state and
+        by country, by summing the ``visits_daily`` rollups of those links."""
         aggregation = [
             {"$match": {"_id": org_id}},
             {"$unwind": "$members"},
@@ -507,28 +538,18 @@ class OrgsClient:
                 }
             },
             {"$unwind": "$links"},
-            {"$replaceRoot": {"newRoot": "$links"}},
+            {"$project": {"_id": "$links._id"}},
             {
                 "$lookup": {
-                    "from": "visits",
+                    "from": "visits_daily",
                     "localField": "_id",
                     "foreignField": "link_id",
-                    "as": "visits",
-                }
-            },
-            {"$unwind": "$visits"},
-            {"$replaceRoot": {"newRoot": "$visits"}},
-            {
-                "$facet": {
-                    "us": filter_us
-                    + not_null("state_code")
-                    + group_by("$state_code")
-                    + rename_id,
-                    "world": not_null("country_code")
-                    + group_by("$country_code")
-                    + rename_id,
+                    "as": "rollups",
                 }
             },
+            {"$unwind": "$rollups"},
+            {"$replaceRoot": {"newRoot": "$rollups"}},
+            aggregations.geo_rollups_facet,
         ]
 
         return next(self.db.organizations.aggregate(aggregation))
@@ -0,0 +1,217 @@
+"""Implements the :py:class:`RedirectCache` and :py:class:`LinkChangeLog` classes."""
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson.objectid import ObjectId
+import pymongo
+from pymongo.collection import ReturnDocument
+
+__all__ = ["RedirectCache", "LinkChangeLog"]
+
+
+class RedirectCache:
+    """A bounded LRU cache of resolved links, keyed by normalized alias.
+
+    Entries are dropped after ``ttl`` seconds even if nobody invalidates them,
+    so a missed invalidation can never serve a stale redirect forever. A cache
+    with ``max_size`` 0 is disabled and never stores anything."""
+
+    def __init__(self, *, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._keys_by_id: Dict[ObjectId, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a cached entry, or ``None`` if it is missing or too old."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Store an entry. ``value`` must have an ``id`` attribute, which is
+        used to find the entry again when the link changes."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), value)
+            self._keys_by_id.setdefault(value.id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, link_ids: Optional[Iterable[ObjectId]]) -> None:
+        """Drop the entries for the given links, or every entry if ``link_ids`` is ``None``."""
+        with self._lock:
+            if link_ids is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._keys_by_id.clear()
+                return
+            for link_id in link_ids:
+                for key in list(self._keys_by_id.get(link_id, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        self.invalidate(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        keys = self._keys_by_id.get(value.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_id[value.id]
+
+
+class LinkChangeLog:
+    """Tells every process which links have changed, so that in-memory
+    copies of link documents can be invalidated.
+
+    Changes are recorded in a single document in the ``link_changes``
+    collection, which holds a version number and the ids touched by the
+    most recent changes. Each process polls that document at most once
+    every ``poll_interval`` seconds. A process that has fallen further
+    behind than the retained history invalidates everything."""
+
+    def __init__(
+        self,
+        *,
+        db: pymongo.database.Database,
+        name: str = "urls",
+        poll_interval: float = 1.0,
+        max_entries: int = 1000,
+    ):
+        self.db = db
+        self.name = name
+        self.poll_interval = poll_interval
+        self.max_entries = max_entries
+        self._listeners: List[Callable[[Optional[List[ObjectId]]], None]] = []
+        self._version: Optional[int] = None
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[Optional[List[ObjectId]]], None]) -> None:
+        """Register a function to be called with the ids of changed links,
+        or with ``None`` if every link should be considered changed."""
+        self._listeners.append(callback)
+
+    def record(self, link_ids: Optional[List[ObjectId]]) -> None:
+        """Record that the given links (or all links, if ``None``) have changed."""
+        self._notify(link_ids)
+        doc = self.db.link_changes.find_one_and_update(
+            {"_id": self.name},
+            {
+                "$inc": {"version": 1},
+                "$push": {
+                    "changes": {
+                        "$each": [{"ids": link_ids}],
+                        "$slice": -self.max_entries,
+                    },
+                },
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        with self._lock:
+            # Only skip ahead if nobody else changed anything since we last looked.
+            if self._version is not None and doc["version"] == self._version + 1:
+                self._version = doc["version"]
+
+    def poll(
+        self, force: bool = False, db: Optional[pymongo.database.Database] = None
+    ) -> None:
+        """Apply changes made by other processes, if it is time to check.
+
+        :param db: The database to read the changes from, if not :py:attr:`db`
+        """
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+
+        doc = (db or self.db).link_changes.find_one({"_id": self.name}) or {}
+        version = doc.get("version", 0)
+        changes = doc.get("changes", [])
+
+        with self._lock:
+            previous, self._version = self._version, version
+        if previous is None or version == previous:
+            return
+
+        missed = version - previous
+        if missed < 0 or missed > len(changes):
+            self._notify(None)
+            return
+        link_ids: List[ObjectId] = []
+        for change in changes[-missed:]:
+            if change["ids"] is None:
+                self._notify(None)
+                return
+            link_ids.extend(change["ids"])
+        self._notify(link_ids)
+
+    def current_version(self) -> int:
+        """Get the number of changes recorded so far."""
+        doc = self.db.link_changes.find_one({"_id": self.name}, {"version": 1}) or {}
+        return int(doc.get("version", 0))
+
+    def changes_since(self, version: int) -> Optional[List[ObjectId]]:
+        """Get the ids of the links changed after ``version``, or ``None`` if
+        the retained history does not reach back that far or includes a change
+        to every link."""
+        doc = self.db.link_changes.find_one({"_id": self.name}) or {}
+        changes = doc.get("changes", [])
+        missed = doc.get("version", 0) - version
+        if missed < 0 or missed > len(changes):
+            return None
+        link_ids: List[ObjectId] = []
+        for change in changes[len(changes) - missed :]:
+            if change["ids"] is None:
+                return None
+            link_ids.extend(change["ids"])
+        return link_ids
+
+    def _notify(self, link_ids: Optional[List[ObjectId]]) -> None:
+        for callback in self._listeners:
+            callback(link_ids)
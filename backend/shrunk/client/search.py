@@ -219,15 +219,22 @@ class SearchClient:
             else:
                 expiration_time = None
 
+            visits = res["visits"]
+            unique_visits = res.get("unique_visits", 0)
+            if query.get("include_pending_visits", False):
+                pending = self.client.links.get_pending_visits(res["_id"])
+                visits += pending["visits"]
+                unique_visits += pending["unique_visits"]
+
             prepared = {
                 "_id": res["_id"],
                 "title": res["title"],
                 "long_url": res["long_url"],
                 "created_time": res["timeCreated"],
                 "expiration_time": expiration_time,
-                "visits": res["visits"],
+                "visits": visits,
                 "domain": res.get("domain", None),
-                "unique_visits": res.get("unique_visits", 0),
+                "unique_visits": unique_visits,
                 "owner": res["owner"],
                 "alias": res["alias"],
                 "is_expired": res["is_expired"],
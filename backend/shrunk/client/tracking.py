@@ -1,5 +1,6 @@
 """Implements the :py:class:`TrackingClient` class."""
 
+from bson.objectid import ObjectId
 import pymongo
 
 __all__ = ["TrackingClient"]
@@ -12,9 +13,20 @@ class TrackingClient:
         self.db = db
 
     def get_new_id(self) -> str:
-        """Generate a new tracking id.
+        """Generate a new tracking id without touching the database.
 
         :returns: An opaque identifier, guaranteed to be distinct across multiple calls.
+          IDs are ObjectIds, which combine a timestamp, a per-process random value and
+          a counter, so they are also distinct across processes and machines.
         """
-        oid = self.db.tracking_ids.insert_one({})
-        return str(oid.inserted_id)
+        return str(ObjectId())
+
+    def drop_legacy_ids(self) -> int:
+        """Drop the ``tracking_ids`` collection, which older versions filled with
+        one empty document per tracking id and which nothing reads.
+
+        :returns: The number of documents that were dropped.
+        """
+        count = self.db.tracking_ids.estimated_document_count()
+        self.db.tracking_ids.drop()
+        return count
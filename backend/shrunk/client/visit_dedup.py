@@ -0,0 +1,48 @@
+"""Implements the :py:class:`VisitDeduplicator` class."""
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Dict, Hashable, Tuple
+
+__all__ = ["VisitDeduplicator"]
+
+
+class VisitDeduplicator:
+    """Collapses repeat visits by the same visitor to the same link.
+
+    The first visit of a ``(link, tracking id)`` pair opens a window of
+    ``window`` seconds, and further visits inside it are reported as
+    duplicates. At most ``max_size`` pairs are remembered; the oldest are
+    forgotten first. Each process keeps its own windows."""
+
+    def __init__(self, *, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._opened: "OrderedDict[Tuple[Hashable, Hashable], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.collapsed = 0
+
+    def is_duplicate(self, link_id: Hashable, tracking_id: Hashable) -> bool:
+        """Check whether a visit repeats one made less than :py:attr:`window` seconds ago."""
+        key = (link_id, tracking_id)
+        now = time.monotonic()
+        with self._lock:
+            # Entries are in the order their windows opened, so expired ones are in front.
+            while self._opened:
+                oldest_key, opened_at = next(iter(self._opened.items()))
+                if now - opened_at < self.window and len(self._opened) < self.max_size:
+                    break
+                del self._opened[oldest_key]
+            if key in self._opened:
+                self.collapsed += 1
+                return True
+            self._opened[key] = now
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "tracked": len(self._opened),
+            "collapsed": self.collapsed,
+        }
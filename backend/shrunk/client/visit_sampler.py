@@ -0,0 +1,83 @@
+"""Implements the :py:class:`VisitSampler` class."""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+__all__ = ["VisitSampler"]
+
+
+class VisitSampler:
+    """Decides which visits to very popular links are stored.
+
+    Visits are counted per link over fixed windows of ``window`` seconds. A
+    link is hot while it got more than ``threshold`` visits in the current
+    or the previous window. Of the repeat visits to a hot link only every
+    ``rate``-th one is stored, with a ``weight`` of ``rate`` to stand in for
+    the others. First visits of a visitor are always stored, so unique
+    visitor counts stay exact. Visits skipped since the last stored one are
+    added to the weight of the next visit stored for the link, even if that
+    is in a later window, so weighted totals stay exact too. Each process
+    samples on its own."""
+
+    def __init__(
+        self,
+        *,
+        threshold: int,
+        rate: int,
+        window: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.rate = rate
+        self.window = window
+        self.clock = clock
+        self._window_started = clock()
+        self._current: Dict[Hashable, int] = {}
+        self._previous: Dict[Hashable, int] = {}
+        self._skipped: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.sampled = 0
+        self.dropped = 0
+
+    def weight(self, link_id: Hashable, first_visit: bool) -> int:
+        """Count a visit and decide whether to store it.
+
+        :returns: ``0`` if the visit should not be stored, otherwise the
+            number of visits the stored document stands for.
+        """
+        now = self.clock()
+        with self._lock:
+            if now - self._window_started >= self.window:
+                expired = now - self._window_started >= 2 * self.window
+                self._previous = {} if expired else self._current
+                self._current = {}
+                self._window_started = now
+            count = self._current.get(link_id, 0) + 1
+            self._current[link_id] = count
+            hot = max(count, self._previous.get(link_id, 0)) > self.threshold
+            skipped = self._skipped.pop(link_id, 0)
+            if first_visit or not hot:
+                return 1 + skipped
+            if skipped + 1 < self.rate:
+                self._skipped[link_id] = skipped + 1
+                self.dropped += 1
+                return 0
+            self.sampled += 1
+            return skipped + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hot_links = sum(
+                1
+                for link, count in self._current.items()
+                if max(count, self._previous.get(link, 0)) > self.threshold
+            )
+        return {
+            "threshold": self.threshold,
+            "rate": self.rate,
+            "window": self.window,
+            "hot_links": hot_links,
+            "sampled": self.sampled,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,100 @@
+"""Implements the :py:class:`VisitWriter` class."""
+
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, List
+
+from shrunk.util.background import PeriodicWorker
+
+__all__ = ["VisitWriter"]
+
+logger = logging.getLogger("shrunk")
+
+
+class VisitWriter:
+    """Takes visit records off the redirect path. Records are put in a
+    bounded in-memory queue and written by a background thread in batches
+    of up to ``batch_size``, at least every ``flush_interval`` seconds.
+
+    When the queue is full, :py:meth:`enqueue` waits up to
+    ``block_timeout`` seconds for room and then drops the record. A batch
+    that fails to be written is kept and written first on the next flush;
+    the queue is not drained further until it succeeds."""
+
+    def __init__(
+        self,
+        *,
+        write: Callable[[List[Dict[str, Any]]], None],
+        max_queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        block_timeout: float,
+    ):
+        self.write = write
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(max_queue_size)
+        self._flush_lock = threading.Lock()
+        self._retry: List[Dict[str, Any]] = []
+        self._worker = PeriodicWorker(
+            self.flush, interval=flush_interval, name="shrunk-visit-writer"
+        )
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def enqueue(self, visit: Dict[str, Any]) -> bool:
+        """Queue a visit to be written.
+
+        :returns: ``False`` if the visit was dropped because the queue stayed full.
+        """
+        self._worker.start()
+        try:
+            self._queue.put(visit, timeout=self.block_timeout)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        if self._queue.qsize() >= self.batch_size:
+            self._worker.wake()
+        return True
+
+    def flush(self) -> None:
+        """Write everything currently in the queue. Stops at the first batch
+        that fails, which is retried on the next flush."""
+        with self._flush_lock:
+            while True:
+                batch, self._retry = self._retry, []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return
+                try:
+                    self.write(batch)
+                except Exception:  # pylint: disable=broad-except
+                    self._retry = batch
+                    self.failed += len(batch)
+                    logger.exception(f"failed to write {len(batch)} visits, will retry")
+                    return
+                self.written += len(batch)
+                self.batches += 1
+
+    def stop(self) -> None:
+        """Stop the background thread, after writing the queued visits."""
+        self._worker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() + len(self._retry),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,160 @@
+"""Implements maintenance commands. Run them with ``flask shrunk <command>``."""
+
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .client import ShrunkClient
+
+__all__ = ["cli"]
+
+cli = AppGroup("shrunk", help="Shrunk maintenance commands.")
+
+
+@cli.command("backfill-link-visitors")
+def backfill_link_visitors() -> None:
+    """Record the visitors of existing visits in link_visitors.
+
+    Run this once before deploying the link_visitors-based unique visit
+    counting, otherwise returning visitors are counted as new once."""
+    client = ShrunkClient(**current_app.config)
+    client.links.backfill_link_visitors()
+    click.echo(
+        f"link_visitors now has {client.db.link_visitors.count_documents({})} visitors"
+    )
+
+
+@cli.command("backfill-visit-rollups")
+def backfill_visit_rollups() -> None:
+    """Compute the daily visit rollups from the stored visits.
+
+    Run this once after deploying the visits_daily rollups, and again after
+    they began counting visits by location, otherwise the location maps only
+    show visits made since. The daily visit charts are computed from the
+    visits until this has run."""
+    client = ShrunkClient(**current_app.config)
+    client.links.backfill_daily_rollups()
+    click.echo(
+        f"visits_daily now has {client.db.visits_daily.count_documents({})} rollups"
+    )
+
+
+@cli.command("fold-visit-sketches")
+@click.option(
+    "--every",
+    type=float,
+    default=0,
+    help="Keep running and fold new days every this many seconds.",
+)
+def fold_visit_sketches(every: float) -> None:
+    """Merge the unique visitor sketches of all links into one per day.
+
+    The admin dashboard estimates the number of unique visitors from these,
+    and only merges the sketches of every link for the days not folded yet.
+    Days become final two days after they end, so run this at least daily,
+    e.g. with --every 86400."""
+    client = ShrunkClient(**current_app.config)
+    while True:
+        started = time.monotonic()
+        client.links.fold_visit_sketches()
+        click.echo(
+            f"visit_sketches now has {client.db.visit_sketches.count_documents({})} "
+            f"days in {time.monotonic() - started:.1f}s"
+        )
+        if every <= 0:
+            return
+        time.sleep(max(0.0, every - (time.monotonic() - started)))
+
+
+@cli.command("drop-tracking-ids")
+def drop_tracking_ids() -> None:
+    """Drop the unused tracking_ids collection.
+
+    Tracking ids are now generated without a database write, so the
+    collection is no longer written to or read."""
+    client = ShrunkClient(**current_app.config)
+    count = client.tracking.drop_legacy_ids()
+    click.echo(f"dropped {count} tracking ids")
+
+
+@cli.command("backfill-alias-norm")
+def backfill_alias_norm() -> None:
+    """Store the normalized alias of links created before alias_norm existed.
+
+    Run this before deploying the alias_norm-based lookups, otherwise older
+    links cannot be found by their alias. Live links whose aliases differ
+    only in case are reported; all but one of each group must be renamed."""
+    client = ShrunkClient(**current_app.config)
+    collisions = client.links.backfill_alias_norm()
+    for aliases in collisions:
+        click.echo(f"case collision: {', '.join(aliases)}")
+    click.echo(f"{len(collisions)} case collisions")
+
+
+@cli.command("build-alias-table")
+@click.option(
+    "--path",
+    default=lambda: os.getenv("SHRUNK_ALIAS_TABLE_PATH"),
+    help="Where to write the table. Defaults to SHRUNK_ALIAS_TABLE_PATH.",
+)
+@click.option(
+    "--every",
+    type=float,
+    default=0,
+    help="Keep running and rebuild the table every this many seconds.",
+)
+def build_alias_table(path: str, every: float) -> None:
+    """Build the memory-mapped alias table that workers resolve links from.
+
+    The file is replaced atomically, and workers switch to the new one
+    within SHRUNK_ALIAS_TABLE_RELOAD_INTERVAL seconds. Links changed after
+    a build are read from the database until the next one, so rebuild
+    well before the link change history (the last 1000 changes) runs out.
+
+    The same file serves as the snapshot used while the database is
+    unreachable; use --path to write SHRUNK_REDIRECT_SNAPSHOT_PATH."""
+    if not path:
+        raise click.UsageError("no path given and SHRUNK_ALIAS_TABLE_PATH is not set")
+    client = ShrunkClient(**current_app.config)
+    while True:
+        started = time.monotonic()
+        count = client.links.build_alias_table(path)
+        click.echo(
+            f"wrote {count} links to {path} in {time.monotonic() - started:.1f}s"
+        )
+        if every <= 0:
+            return
+        time.sleep(max(0.0, every - (time.monotonic() - started)))
+
+
+@cli.command("enrich-visits")
+@click.option(
+    "--backfill",
+    is_flag=True,
+    help="Also enrich visits stored before visits were enriched.",
+)
+@click.option(
+    "--every",
+    type=float,
+    default=0,
+    help="Keep running and enrich new visits every this many seconds.",
+)
+def enrich_visits(backfill: bool, every: float) -> None:
+    """Fill in the location, browser, platform and referer domain of visits.
+
+    With SHRUNK_VISIT_ENRICHMENT=deferred, visits are stored with only the
+    raw request fields, and are enriched by the web workers every
+    SHRUNK_VISIT_ENRICHMENT_INTERVAL seconds. Set that to 0 to leave the
+    work to this command instead."""
+    client = ShrunkClient(**current_app.config)
+    while True:
+        started = time.monotonic()
+        count = client.links.enrich_visits(backfill=backfill)
+        click.echo(f"enriched {count} visits in {time.monotonic() - started:.1f}s")
+        if every <= 0:
+            return
+        backfill = False
+        time.sleep(max(0.0, every - (time.monotonic() - started)))
@@ -0,0 +1,56 @@
+"""A minimal application that only serves short links.
+
+It registers the endpoints of :py:mod:`shrunk.redirects` and nothing else:
+no sessions, no endpoint statistics and none of the dashboard blueprints.
+This lets the click path run in its own worker pool behind httpd, e.g.
+``FLASK_APP=shrunk.redirector flask run -p 3070``, or with any WSGI server
+pointed at ``shrunk.redirector:create_app()``."""
+
+import os
+from typing import Any
+
+from backports import datetime_fromisoformat
+from flask import Flask
+from flask.sessions import SessionInterface
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from . import redirects
+from .app_setup import (
+    init_logging,
+    init_redirect_cache,
+    init_shrunk_client,
+    load_config,
+)
+
+__all__ = ["create_app"]
+
+
+class _NoSessionInterface(SessionInterface):
+    """Never reads or writes the session cookie. Redirects do not depend on
+    who is logged in, so decoding the cookie would be wasted work."""
+
+    def open_session(self, app: Flask, request: Any) -> Any:
+        return self.make_null_session(app)
+
+    def save_session(self, app: Flask, session: Any, response: Any) -> None:
+        pass
+
+
+def create_app(**kwargs: Any) -> Flask:
+    datetime_fromisoformat.MonkeyPatch.patch_fromisoformat()
+
+    app = Flask(__name__, static_folder=None)
+    app.testing = bool(int(os.getenv("SHRUNK_FLASK_TESTING", 0)))
+    load_config(app, kwargs)
+    app.session_interface = _NoSessionInterface()
+
+    app.before_first_request(init_logging)
+    app.before_first_request(init_shrunk_client)
+    app.before_first_request(init_redirect_cache)
+
+    # httpd sits in front, and visits need the address of the visitor
+    app.wsgi_app = ProxyFix(app.wsgi_app)
+
+    app.register_blueprint(redirects.bp)
+
+    return app
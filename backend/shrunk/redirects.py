@@ -0,0 +1,195 @@
+"""The endpoints that serve short links. They are registered both on the
+full application and on the standalone redirector in :py:mod:`shrunk.redirector`."""
+
+from functools import lru_cache
+import os
+from typing import Any, Dict, NamedTuple, Tuple, cast
+from urllib.parse import parse_qsl, urlencode
+
+from flask import Blueprint, Response, abort, current_app, jsonify, redirect, request
+from werkzeug.urls import iri_to_uri
+
+from shrunk.client import ShrunkClient
+
+__all__ = ["bp"]
+
+bp = Blueprint("redirects", __name__)
+
+PIXEL_MIMETYPES = {"gif": "image/gif", "png": "image/png"}
+
+
+class TrackingPixel(NamedTuple):
+    data: bytes
+    mimetype: str
+    headers: Dict[str, str]
+
+
+def _load_tracking_pixels() -> Dict[str, TrackingPixel]:
+    """Read the tracking pixel images once, so that serving them needs no file I/O."""
+    img_dir = os.path.join(os.path.dirname(__file__), "static", "img")
+    pixels = {}
+    for extension, mimetype in PIXEL_MIMETYPES.items():
+        name = f"pixel.{extension}"
+        with open(os.path.join(img_dir, name), "rb") as f:
+            data = f.read()
+        pixels[extension] = TrackingPixel(
+            data=data,
+            mimetype=mimetype,
+            headers={
+                "X-Image-Name": name,
+                "Cache-Control": "no-store, no-cache, must-revalidate",
+                "Pragma": "no-cache",
+                "Expires": "0",
+            },
+        )
+    return pixels
+
+
+TRACKING_PIXELS = _load_tracking_pixels()
+
+VISIT_PARAMETERS = frozenset(["mid", "uid", "source"])
+"""Query parameters that are recorded with the visit instead of being
+passed on to the long URL."""
+
+
+@lru_cache(maxsize=10000)
+def base_location(long_url: str) -> str:
+    """Get the ``Location`` of a redirect to ``long_url``, before any query
+    parameters of the request are added."""
+    if "://" not in long_url:
+        long_url = f"http://{long_url}"
+    return cast(str, iri_to_uri(long_url, safe_conversion=True))
+
+
+def merge_query(location: str, query_string: bytes) -> Tuple[str, Dict[str, str]]:
+    """Pass the query parameters of a request on to ``location``.
+
+    :returns: The new location, and the parameters in :py:data:`VISIT_PARAMETERS`.
+    """
+    params: Dict[str, str] = {}
+    visit_params: Dict[str, str] = {}
+    for key, value in parse_qsl(query_string.decode("utf-8").replace("&amp;", "&")):
+        if key in VISIT_PARAMETERS:
+            visit_params[key] = value
+        else:
+            params[key] = value
+    if not params:
+        return location, visit_params
+    separator = "&" if "?" in location else "?"
+    return f"{location}{separator}{urlencode(params)}", visit_params
+
+
+@bp.route("/<alias>", methods=["GET"])
+def serve_link(alias: str) -> Any:
+    client: ShrunkClient = current_app.client
+
+    link = client.links.resolve(alias)
+    if link is None:
+        return jsonify({"message": "Link not found1"}), 404
+
+    is_tracking_pixel_link = link.is_tracking_pixel_link and not link.is_expired()
+    if is_tracking_pixel_link:
+        # TODO: Add legacy testing after this is done: https://gitlab.rutgers.edu/MaCS/OSS/shrunk/-/issues/223
+
+        # Documents have "is_trackingpixel_legacy_endpoint" field if not legacy.. lol
+        if link.is_trackingpixel_legacy_endpoint:
+            # Treat legacy tracking pixels.
+
+            # TODO: Make this for the /<alias> route
+            return redirect(f"/api/core/t/{link.alias}")
+        else:
+            # We do not want to promote the use of tracking pixels used under the alias route.
+            return jsonify({"message": "Link not found2"}), 404
+
+    if link.is_expired():
+        return jsonify({"message": "Link not found3"}), 404
+
+    # Check if the request is coming from a custom domain
+    if not client.orgs.domain_routes.may_serve(
+        request.headers.get("Host", ""), link.domain
+    ):
+        return jsonify({"message": "Domain not found"}), 404
+
+    # Get or generate a tracking id
+    tracking_id = request.cookies.get("shrunkid") or client.tracking.get_new_id()
+
+    location = base_location(link.long_url)
+    visit_params: Dict[str, str] = {}
+
+    # Preserve URL parameters from the original request
+    if request.query_string:
+        location, visit_params = merge_query(location, request.query_string)
+
+    allowed_sources = ["qr"]
+
+    source = visit_params.get("source")
+    if source not in allowed_sources:
+        source = None
+
+    client.links.visit(
+        link,
+        tracking_id,
+        request.remote_addr,
+        request.headers.get("User-Agent"),
+        request.headers.get("Referer"),
+        visit_params.get("uid"),
+        visit_params.get("mid"),
+        source,
+        method=request.method,
+    )
+
+    response = redirect(location)
+
+    # Not entirely sure what this is here for, maybe to track unique visitors?
+    response.set_cookie("shrunkid", tracking_id)
+
+    return response
+
+
+# Redirect to the alias stats page if "/manage" is appended to the alias
+@bp.route("/<alias>/manage", methods=["GET"])
+def serve_link_manage(alias: str) -> Any:
+    client: ShrunkClient = current_app.client
+    # might be legacy alias, resolve() also tries the lowercase form
+    link = client.links.resolve(alias)
+
+    if link is None:
+        return jsonify({"message": "Link not found"}), 404
+
+    return redirect(f"/app/links/{str(link.id)}")
+
+
+# Add "/api/core/t/" because you're technically using an API endpoint for the websites using the tracking pixel.
+# This will also make it easier for the NGINX server in the near future.
+@bp.route("/api/core/t/<tracking_pixel>", methods=["GET"])
+def serve_tracking_pixel(tracking_pixel: str) -> Any:
+    client: ShrunkClient = current_app.client
+    tracking_id = request.cookies.get("shrunkid") or client.tracking.get_new_id()
+
+    link = client.links.resolve(tracking_pixel)
+    if link is None:
+        return "There was an error trying to find your tracking pixel.", 404
+
+    mid = request.args.get("mid", None)
+    uid = request.args.get("uid", None)
+
+    client.links.visit(
+        link,
+        tracking_id,
+        request.remote_addr,
+        request.headers.get("User-Agent"),
+        request.headers.get("Referer"),
+        uid,
+        mid,
+        method=request.method,
+    )
+
+    extension = tracking_pixel.split(".")[-1] if "." in tracking_pixel else "gif"
+    if extension not in TRACKING_PIXELS:
+        abort(404)
+    pixel = TRACKING_PIXELS[extension]
+    response = Response(pixel.data, mimetype=pixel.mimetype, headers=pixel.headers)
+
+    response.set_cookie("shrunkid", tracking_id)
+
+    return response
@@ -0,0 +1,88 @@
+"""Helpers for work that runs off the request path."""
+
+import atexit
+import logging
+import os
+import threading
+from typing import Any, Callable, Optional
+
+__all__ = ["PeriodicWorker"]
+
+logger = logging.getLogger("shrunk")
+
+
+class PeriodicWorker:
+    """Calls ``func`` on a daemon thread every ``interval`` seconds, as soon as
+    :py:meth:`wake` is called, and one last time when the process exits
+    unless ``run_at_exit`` is false.
+
+    The thread is started lazily by :py:meth:`start`, and restarted if the
+    process has forked since, so it is safe to create workers before a
+    prefork server spawns its children."""
+
+    def __init__(
+        self,
+        func: Callable[[], Any],
+        *,
+        interval: float,
+        name: str,
+        run_at_exit: bool = True,
+    ):
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self.run_at_exit = run_at_exit
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._atexit_registered = False
+
+    def start(self) -> None:
+        """Start the thread unless it is already running in this process."""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def wake(self) -> None:
+        """Run ``func`` now instead of waiting for the interval to elapse."""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop the thread and run ``func`` one last time if ``run_at_exit``."""
+        if self._atexit_registered:
+            atexit.unregister(self.stop)
+            self._atexit_registered = False
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout=max(self.interval, 5.0))
+        self._thread = None
+        if self.run_at_exit:
+            self._run_once()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            self._run_once()
+
+    def _run_once(self) -> None:
+        try:
+            self.func()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f"background task {self.name} failed")
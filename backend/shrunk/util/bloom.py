@@ -0,0 +1,50 @@
+"""A minimal Bloom filter."""
+
+import hashlib
+import math
+from typing import Tuple
+
+__all__ = ["BloomFilter"]
+
+
+class BloomFilter:
+    """A Bloom filter sized for ``capacity`` keys at a false positive rate
+    of ``error_rate``. Keys can be added but never removed."""
+
+    def __init__(self, *, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.num_bits = max(
+            8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.set_bits = 0
+        self.count = 0
+
+    def _hashes(self, key: str) -> Tuple[int, int]:
+        digest = hashlib.blake2b(key.encode("utf8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(
+            digest[8:], "little"
+        )
+
+    def add(self, key: str) -> None:
+        h1, h2 = self._hashes(key)
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            mask = 1 << (bit & 7)
+            if not self.bits[bit >> 3] & mask:
+                self.bits[bit >> 3] |= mask
+                self.set_bits += 1
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = self._hashes(key)
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            if not self.bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def estimated_false_positive_rate(self) -> float:
+        """Estimate the false positive rate from the fraction of bits set."""
+        return (self.set_bits / self.num_bits) ** self.num_hashes
@@ -1,4 +1,4 @@
-from typing import Tuple, Optional, Any, Dict, List, cast
+from typing import Tuple, Optional, Any, Dict, Iterable, cast
 import urllib.parse
 import collections
 from functools import lru_cache
@@ -6,7 +6,12 @@ from functools import lru_cache
 import httpagentparser
 
 
-__all__ = ["get_human_readable_referer_domain", "browser_stats_from_visits"]
+__all__ = [
+    "get_human_readable_referer_domain",
+    "browser_stats_from_visits",
+    "count_browser_stats",
+    "top_browser_stats",
+]
 
 
 REFERER_STRIP_PREFIXES = ["www.", "amp.", "m.", "l."]
@@ -125,28 +130,49 @@ def get_browser_platform(user_agent: str) -> Tuple[str, str]:
 
 
 def top_n(stats: Dict[str, int], *, n: int) -> Dict[str, int]:
-    if len(stats) >= n:
-        freqs = dict(sorted(stats.items(), key=lambda kv: kv[1], reverse=True))
-        stats = dict(list(freqs.items())[:n])
-        # stats = {key: value for key, value in stats.items() if value >= cutoff}
-        # stats = {}
-    return stats
-
-
-def browser_stats_from_visits(visits: List[Any]) -> Any:
-    platforms: Dict[str, int] = collections.defaultdict(int)
-    browsers: Dict[str, int] = collections.defaultdict(int)
-    referers: Dict[str, int] = collections.defaultdict(int)
+    """Get the ``n`` largest counts, largest first."""
+    freqs = sorted(stats.items(), key=lambda kv: kv[1], reverse=True)
+    return dict(freqs[:n])
+
+
+def count_browser_stats(
+    visits: Iterable[Any], counts: Optional[Dict[str, Dict[str, int]]] = None
+) -> Dict[str, Dict[str, int]]:
+    """Count visits by browser, platform and referer domain, parsing the
+    user agent and referer of visits stored without those fields.
+
+    :param visits: An iterable of visits, which is consumed one at a time
+    :param counts: Counts to add to, in the format returned
+    """
+    if counts is None:
+        counts = {}
+    browsers = collections.defaultdict(int, counts.get("browsers", {}))
+    platforms = collections.defaultdict(int, counts.get("platforms", {}))
+    referers = collections.defaultdict(int, counts.get("referers", {}))
     for visit in visits:
-        user_agent = visit.get("user_agent")
-        browser, platform = get_browser_platform(user_agent)
-        browsers[browser] += 1
-        platforms[platform] += 1
-        referers[
-            get_human_readable_referer_domain(visit.get("referer", "Unknown"))
-        ] += 1
+        weight = visit.get("weight", 1)
+        if "browser" in visit:
+            browser, platform = visit["browser"], visit["platform"]
+        else:
+            browser, platform = get_browser_platform(visit.get("user_agent"))
+        browsers[browser] += weight
+        platforms[platform] += weight
+        if "referer_domain" in visit:
+            referer = visit["referer_domain"]
+        else:
+            referer = get_human_readable_referer_domain(visit.get("referer", "Unknown"))
+        referers[referer] += weight
+    return {"browsers": browsers, "platforms": platforms, "referers": referers}
+
+
+def top_browser_stats(counts: Dict[str, Dict[str, int]]) -> Any:
+    """Format the top five browsers, platforms and referer domains of
+    :py:func:`count_browser_stats` counts."""
     return {
-        "browsers": [{"name": b, "y": n} for (b, n) in top_n(browsers, n=5).items()],
-        "platforms": [{"name": p, "y": n} for (p, n) in top_n(platforms, n=5).items()],
-        "referers": [{"name": r, "y": n} for (r, n) in top_n(referers, n=5).items()],
+        name: [{"name": key, "y": n} for (key, n) in top_n(counts[name], n=5).items()]
+        for name in ["browsers", "platforms", "referers"]
     }
+
+
+def browser_stats_from_visits(visits: Iterable[Any]) -> Any:
+    return top_browser_stats(count_browser_stats(visits))
@@ -1,4 +1,4 @@
-from typing import Any, Generator
+from typing import Any, Callable, Generator, List
 
 import pytest
 from flask import Flask
@@ -13,13 +13,16 @@ def pytest_configure(config: Any) -> None:
 
 
 @pytest.fixture(scope="session")
-def app() -> Flask:
+def app() -> Generator[Flask, None, None]:
     shrunk_app: Flask = shrunk.create_app()
     with shrunk_app.test_client() as test_client:
         # Force the app to initialize the database connection, since that
         # initialization is deferred until the first request.
         test_client.get("/")
-    return shrunk_app
+    try:
+        yield shrunk_app
+    finally:
+        shrunk_app.client.close()
 
 
 @pytest.fixture
@@ -44,3 +47,21 @@ def client(
             yield test_client
         finally:
             app.client.reset_database()
+
+
+@pytest.fixture
+def make_client() -> Generator[Callable[..., ShrunkClient], None, None]:
+    """Build clients with other settings than the app's, and close them after
+    the test."""
+    clients: List[ShrunkClient] = []
+
+    def make(**kwargs: Any) -> ShrunkClient:
+        shrunk_client = ShrunkClient(**kwargs)
+        clients.append(shrunk_client)
+        return shrunk_client
+
+    try:
+        yield make
+    finally:
+        for shrunk_client in clients:
+            shrunk_client.close()
@@ -0,0 +1,167 @@
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import pytest
+from bson.objectid import ObjectId
+
+from shrunk.client import ShrunkClient
+from shrunk.client import aggregations
+
+# The daily visits pipeline before visitors were grouped by day first. It
+# collects every visit document of a visitor into one array.
+LEGACY_VISITS_AGGREGATION: List[Any] = [
+    {"$group": {"_id": "$tracking_id", "visits": {"$addToSet": "$$ROOT"}}},
+    {
+        "$project": {
+            "visits": {
+                "$reduce": {
+                    "input": {"$slice": ["$visits", 1, {"$size": "$visits"}]},
+                    "initialValue": {
+                        "first": {"$arrayElemAt": ["$visits", 0]},
+                        "rest": [],
+                    },
+                    "in": {
+                        "$cond": {
+                            "if": {"$lt": ["$$this.time", "$$value.first.time"]},
+                            "then": {
+                                "first": "$$this",
+                                "rest": {
+                                    "$concatArrays": [
+                                        ["$$value.first"],
+                                        "$$value.rest",
+                                    ]
+                                },
+                            },
+                            "else": {
+                                "first": "$$value.first",
+                                "rest": {"$concatArrays": [["$$this"], "$$value.rest"]},
+                            },
+                        },
+                    },
+                },
+            },
+        }
+    },
+    {
+        "$project": {
+            "visits": {
+                "$let": {
+                    "vars": {
+                        "first": {
+                            "$mergeObjects": ["$visits.first", {"first_time": 1}]
+                        },
+                        "rest": {
+                            "$map": {
+                                "input": "$visits.rest",
+                                "as": "visit",
+                                "in": {"$mergeObjects": ["$$visit", {"first_time": 0}]},
+                            }
+                        },
+                    },
+                    "in": {"$concatArrays": [["$$first"], "$$rest"]},
+                },
+            },
+        }
+    },
+    {"$unwind": "$visits"},
+    {
+        "$group": {
+            "_id": {
+                "month": {"$month": "$visits.time"},
+                "year": {"$year": "$visits.time"},
+                "day": {"$dayOfMonth": "$visits.time"},
+            },
+            "first_time_visits": {"$sum": "$visits.first_time"},
+            "all_visits": {"$sum": {"$ifNull": ["$visits.weight", 1]}},
+        }
+    },
+    aggregations.make_sortable,
+    aggregations.chronological_sort,
+    aggregations.clean_results,
+]
+
+
+def insert_visits(
+    db: ShrunkClient, link_id: ObjectId, count: int, visitors: int
+) -> None:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for offset in range(0, count, 10000):
+        db.db.visits.insert_many(
+            [
+                {
+                    "link_id": link_id,
+                    "alias": "aggregation",
+                    "tracking_id": f"visitor{random.randrange(visitors)}",
+                    "time": start + timedelta(seconds=random.randrange(365 * 86400)),
+                    "source_ip": "127.0.0.1",
+                }
+                for _ in range(min(10000, count - offset))
+            ],
+            ordered=False,
+        )
+
+
+def daily_visits(db: ShrunkClient, link_id: ObjectId, pipeline: List[Any]) -> List[Any]:
+    return list(
+        db.db.visits.aggregate(
+            [{"$match": {"link_id": link_id}}] + pipeline, allowDiskUse=True
+        )
+    )
+
+
+def test_visits_aggregation_matches_legacy(db: ShrunkClient) -> None:
+    link_id = ObjectId()
+    insert_visits(db, link_id, 2000, 150)
+    db.db.visits.update_many({"tracking_id": "visitor0"}, {"$set": {"weight": 3}})
+
+    expected = daily_visits(db, link_id, LEGACY_VISITS_AGGREGATION)
+    actual = daily_visits(db, link_id, aggregations.visits_aggregation)
+    assert actual == expected
+    assert sum(day["first_time_visits"] for day in actual) == 150
+
+
+@pytest.mark.slow
+def test_visits_aggregation_benchmark(db: ShrunkClient) -> None:
+    """Compare the latency and $group memory of the daily visits pipeline
+    with the one it replaced. Run with ``pytest -m slow -s``; the number of
+    visits is read from SHRUNK_BENCHMARK_VISITS (default 1000000)."""
+    count = int(os.getenv("SHRUNK_BENCHMARK_VISITS", 1000000))
+    link_id = ObjectId()
+    insert_visits(db, link_id, count, max(1, count // 20))
+
+    def group_memory(pipeline: List[Any]) -> Optional[Dict[str, Any]]:
+        explain = db.db.command(
+            "explain",
+            {
+                "aggregate": "visits",
+                "pipeline": [{"$match": {"link_id": link_id}}] + pipeline,
+                "cursor": {},
+                "allowDiskUse": True,
+            },
+            verbosity="executionStats",
+        )
+        groups = [stage for stage in explain.get("stages", []) if "$group" in stage]
+        if not groups:
+            return None  # the server does not report per-stage statistics
+        return {
+            "peak_bytes": max(
+                sum(group.get("maxAccumulatorMemoryUsageBytes", {}).values())
+                for group in groups
+            ),
+            "used_disk": any(group.get("usedDisk", False) for group in groups),
+        }
+
+    results = {}
+    for name, pipeline in [
+        ("legacy", LEGACY_VISITS_AGGREGATION),
+        ("current", aggregations.visits_aggregation),
+    ]:
+        started = time.perf_counter()
+        results[name] = daily_visits(db, link_id, pipeline)
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {elapsed:.2f}s, $group memory {group_memory(pipeline)}")
+
+    assert results["current"] == results["legacy"]
@@ -0,0 +1,30 @@
+from shrunk.client import ShrunkClient
+from shrunk.client.alias_filter import AliasFilter
+
+
+def test_alias_filter(db: ShrunkClient) -> None:
+    alias_filter = AliasFilter(
+        db=db.db,
+        error_rate=0.001,
+        rebuild_interval=3600,
+        negative_ttl=60,
+        negative_max_size=10,
+    )
+    link_id = db.db.urls.insert_one(
+        {"alias": "filtered", "long_url": "https://example.com", "deleted": False}
+    ).inserted_id
+
+    alias_filter.rebuild()
+    assert alias_filter.might_exist("filtered")
+    assert not alias_filter.might_exist("doesnotexist")
+
+    alias_filter.record_missing("created-later")
+    assert not alias_filter.might_exist("created-later")
+    db.db.urls.update_one({"_id": link_id}, {"$set": {"alias": "created-later"}})
+    alias_filter.on_link_changes([link_id])
+    assert alias_filter.might_exist("created-later")
+
+    stats = alias_filter.stats()
+    assert stats["ready"]
+    assert stats["rebuilds"] == 1
+    assert stats["negative_cache_hits"] == 1
@@ -1,5 +1,6 @@
 # admin.get_endpoint_stats      GET      /api/core/admin/stats/endpoint
 # admin.get_overview_stats      POST     /api/core/admin/stats/overview
+# admin.get_redirect_stats      GET      /api/core/admin/stats/redirect
 
 from datetime import datetime, timezone, timedelta
 
@@ -16,6 +17,15 @@ def test_endpoint_stats(client: Client) -> None:
         assert isinstance(resp.json["stats"], list)
 
 
+def test_endpoint_stats_counts(client: Client) -> None:
+    with dev_login(client, "admin"):
+        for _ in range(3):
+            resp = client.get("/api/core/admin/stats/endpoint")
+        stats = {stat["endpoint"]: stat for stat in resp.json["stats"]}
+        assert stats["admin.get_endpoint_stats"]["total_visits"] == 3
+        assert stats["admin.get_endpoint_stats"]["unique_visits"] == 1
+
+
 def test_endpoint_stats_unauthorized(client: Client) -> None:
     with dev_login(client, "user"):
         resp = client.get("/api/core/admin/stats/endpoint")
@@ -64,3 +74,33 @@ def test_user_overview_stats(client: Client) -> None:
         assert "roles" in user
         assert "linksCreated" in user
         assert user["linksCreated"] == 1
+
+
+def test_redirect_stats(client: Client) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="cachedlink")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+        before = client.get("/api/core/admin/stats/redirect").json["cache"]
+        assert client.get("/cachedlink").status_code == 302
+        assert client.get("/cachedlink").status_code == 302
+        after = client.get("/api/core/admin/stats/redirect").json["cache"]
+        assert after["hits"] > before["hits"]
+
+        # Editing the link must not leave the old redirect in the cache
+        resp = client.patch(
+            f"/api/core/link/{link_id}", json={"long_url": "https://example.org"}
+        )
+        assert resp.status_code == 204
+        resp = client.get("/cachedlink")
+        assert resp.headers["Location"] == "https://example.org"
+
+        assert client.delete(f"/api/core/link/{link_id}").status_code == 204
+        assert client.get("/cachedlink").status_code == 404
+
+
+def test_redirect_stats_unauthorized(client: Client) -> None:
+    with dev_login(client, "user"):
+        resp = client.get("/api/core/admin/stats/redirect")
+        assert resp.status_code == 403
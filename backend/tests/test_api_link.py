@@ -4,10 +4,22 @@ import base64
 from datetime import datetime, timezone, timedelta
 import random
 import csv
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import pytest
+import pymongo
+from bson.objectid import ObjectId
+from flask import Flask
 from werkzeug.test import Client
 
+from shrunk.client.alias_table import AliasTable
+from shrunk.util.hyperloglog import HyperLogLog
+from shrunk.client import ShrunkClient, aggregations
+from shrunk.client.degraded import DegradedMode
+from shrunk.client.geoip import GeoipClient
+from shrunk.util.stats import get_browser_platform
+
 from util import dev_login, create_link, setup_guest_user
 
 
@@ -1214,3 +1226,565 @@ def test_create_second_link_with_deleted_alias(client: Client) -> None:
         resp = create_link(client, "new title", "https://example.com", alias="funny")
         assert resp.status_code == 201
         assert resp.json["alias"] == "funny"
+
+
+def test_manage_redirect(client: Client) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="manageme")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    resp = client.get("/manageme/manage")
+    assert resp.status_code == 302
+    assert resp.headers["Location"].endswith(f"/app/links/{link_id}")
+
+    resp = client.get("/MANAGEME/manage")
+    assert resp.status_code == 302
+
+    resp = client.get("/doesnotexist/manage")
+    assert resp.status_code == 404
+
+
+def test_first_visit_flag(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="firstvisit")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    for _ in range(3):
+        assert client.get("/firstvisit").status_code == 302
+
+    visits = list(app.client.db.visits.find({"alias": "firstvisit"}).sort("time", 1))
+    assert [visit["first_visit"] for visit in visits] == [True, False, False]
+    assert app.client.db.link_visitors.count_documents({}) == 1
+
+    with dev_login(client, "admin"):
+        resp = client.get(f"/api/core/link/{link_id}/stats")
+        assert resp.json["total_visits"] == 3
+        assert resp.json["unique_visits"] == 1
+
+
+def test_backfill_alias_norm(client: Client, app: Flask) -> None:
+    legacy = {"long_url": "https://example.com", "deleted": False}
+    app.client.db.urls.insert_many(
+        [
+            dict(legacy, alias="Legacy"),
+            dict(legacy, alias="CaseA"),
+            dict(legacy, alias="casea"),
+        ]
+    )
+    assert app.client.links.get_link_info_by_alias("legacy") is None
+
+    assert app.client.links.backfill_alias_norm() == [["CaseA", "casea"]]
+    assert app.client.links.get_link_info_by_alias("LEGACY")["alias"] == "Legacy"
+    assert app.client.links.get_link_info_by_alias("CASEA")["alias"] == "casea"
+    assert app.client.links.backfill_alias_norm() == [["CaseA", "casea"]]
+
+
+def test_alias_table(client: Client, app: Flask, tmp_path: Path) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="tabled")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    path = str(tmp_path / "aliases.tbl")
+    assert app.client.links.build_alias_table(path) == 1
+    alias_table = AliasTable(
+        path=path, link_changes=app.client.link_changes, reload_interval=3600
+    )
+    assert alias_table.get("tabled")["long_url"] == "https://example.com"
+    assert alias_table.get("missing") is None
+
+    with dev_login(client, "admin"):
+        resp = client.patch(
+            f"/api/core/link/{link_id}", json={"long_url": "https://example.org"}
+        )
+        assert resp.status_code == 204
+    assert alias_table.get("tabled") is None
+    assert alias_table.stats()["hits"] == 1
+    assert alias_table.stats()["stale"] == 1
+
+
+def test_degraded_mode(client: Client, app: Flask, tmp_path: Path) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="degraded")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    snapshot_path = str(tmp_path / "snapshot.tbl")
+    app.client.links.build_alias_table(snapshot_path)
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    now = [0.0]
+    degraded = DegradedMode(
+        snapshot_path=snapshot_path,
+        spool_dir=str(spool_dir),
+        retry_interval=5,
+        write=app.client.links._write_visits,  # pylint: disable=protected-access
+        clock=lambda: now[0],
+    )
+
+    degraded.trip()
+    assert degraded.active
+    assert degraded.lookup("degraded")["long_url"] == "https://example.com"
+    visit = {
+        "link_id": ObjectId(link_id),
+        "alias": "degraded",
+        "tracking_id": "tracking-id",
+        "source_ip": "127.0.0.1",
+        "time": datetime.now(timezone.utc),
+        "user_agent": None,
+        "referer": None,
+    }
+    degraded.spool([visit])
+    degraded.replay()
+    assert app.client.db.visits.count_documents({"alias": "degraded"}) == 0
+
+    now[0] += 5
+    assert not degraded.active
+    degraded.replay()
+    assert app.client.db.visits.count_documents({"alias": "degraded"}) == 1
+    assert list(spool_dir.iterdir()) == []
+
+
+def test_degraded_mode_unreachable_database(
+    client: Client, app: Flask, tmp_path: Path
+) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="outage")
+        assert resp.status_code == 201
+
+    links = app.client.links
+    snapshot_path = str(tmp_path / "snapshot.tbl")
+    links.build_alias_table(snapshot_path)
+    links.redirect_cache.clear()
+    degraded, redirect_db = links.degraded, links.redirect_db
+    # Nothing listens on port 1, so server selection fails.
+    unreachable = pymongo.MongoClient(
+        "localhost", 1, connect=False, serverSelectionTimeoutMS=300
+    )
+    links.degraded = DegradedMode(
+        snapshot_path=snapshot_path,
+        spool_dir=None,
+        retry_interval=60,
+        write=links._write_visits,  # pylint: disable=protected-access
+    )
+    links.redirect_db = unreachable[app.client.db.name]
+    try:
+        start = time.monotonic()
+        link = links.resolve("outage")
+        assert time.monotonic() - start < 5
+        assert link is not None and link.long_url == "https://example.com"
+        assert links.degraded.stats()["trips"] == 1
+    finally:
+        links.degraded, links.redirect_db = degraded, redirect_db
+        unreachable.close()
+
+
+class FlakyDatabase:
+    """Forwards to a database, except that its ``fail_on``-th write raises a
+    connection error, after being applied if ``applied`` is set."""
+
+    def __init__(self, db: Any, fail_on: int, applied: bool) -> None:
+        self.db = db
+        self.fail_on = fail_on
+        self.applied = applied
+        self.writes = 0
+
+    def __getattr__(self, name: str) -> "FlakyCollection":
+        return FlakyCollection(self, self.db[name])
+
+
+class FlakyCollection:
+    def __init__(self, flaky: FlakyDatabase, collection: Any) -> None:
+        self.flaky = flaky
+        self.collection = collection
+
+    def with_options(self, **kwargs: Any) -> "FlakyCollection":
+        return FlakyCollection(self.flaky, self.collection.with_options(**kwargs))
+
+    def find(self, *args: Any, **kwargs: Any) -> Any:
+        return self.collection.find(*args, **kwargs)
+
+    def bulk_write(self, *args: Any, **kwargs: Any) -> Any:
+        return self._write("bulk_write", *args, **kwargs)
+
+    def insert_many(self, *args: Any, **kwargs: Any) -> Any:
+        return self._write("insert_many", *args, **kwargs)
+
+    def _write(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        self.flaky.writes += 1
+        if self.flaky.writes != self.flaky.fail_on:
+            return getattr(self.collection, method)(*args, **kwargs)
+        if self.flaky.applied:
+            getattr(self.collection, method)(*args, **kwargs)
+        raise pymongo.errors.AutoReconnect("connection lost")
+
+
+@pytest.mark.parametrize(
+    ("fail_on", "applied"),
+    [
+        pytest.param(1, True, id="visitors"),
+        pytest.param(2, False, id="counters"),
+        pytest.param(3, False, id="rollups"),
+        pytest.param(4, True, id="visits"),
+    ],
+)
+def test_degraded_mode_partial_write(
+    client: Client, app: Flask, tmp_path: Path, fail_on: int, applied: bool
+) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="partial")
+        assert resp.status_code == 201
+        link_id = ObjectId(resp.json["id"])
+
+    links = app.client.links
+    degraded, redirect_db = links.degraded, links.redirect_db
+    now = [0.0]
+    links.degraded = DegradedMode(
+        snapshot_path=None,
+        spool_dir=str(tmp_path),
+        retry_interval=3600,
+        write=links._write_visits,  # pylint: disable=protected-access
+        clock=lambda: now[0],
+    )
+    links.redirect_db = FlakyDatabase(app.client.db, fail_on, applied)
+    try:
+        visit = {
+            "link_id": link_id,
+            "alias": "partial",
+            "tracking_id": "tracking-id",
+            "source_ip": "127.0.0.1",
+            "time": datetime.now(timezone.utc),
+            "user_agent": None,
+            "referer": None,
+        }
+        links._store_visits([visit])  # pylint: disable=protected-access
+        assert links.degraded.stats()["spooled"] == 1
+        now[0] += 3600
+        links.degraded.replay()
+        assert links.degraded.stats()["replayed"] == 1
+    finally:
+        links.degraded._worker.stop()  # pylint: disable=protected-access
+        links.degraded, links.redirect_db = degraded, redirect_db
+
+    db = app.client.db
+    link = db.urls.find_one({"_id": link_id})
+    assert (link["visits"], link["unique_visits"]) == (1, 1)
+    rollups = list(db.visits_daily.find({"link_id": link_id}))
+    assert [(rollup["visits"], rollup["first_visits"]) for rollup in rollups] == [
+        (1, 1)
+    ]
+    visits = list(db.visits.find({"link_id": link_id}))
+    assert len(visits) == 1 and visits[0]["first_visit"]
+    assert "written" not in visits[0]
+    assert db.link_visitors.count_documents({"link_id": link_id}) == 1
+
+
+def test_warm_redirect_cache(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        for alias in ["warm1", "warm2", "warm3"]:
+            resp = create_link(client, "title", "https://example.com", alias=alias)
+            assert resp.status_code == 201
+    for _ in range(2):
+        assert client.get("/warm2").status_code == 302
+    assert client.get("/warm3").status_code == 302
+
+    app.client.links.redirect_cache.clear()
+    assert app.client.links.warm_redirect_cache(2) == 2
+    assert app.client.links.redirect_cache.get("warm2") is not None
+    assert app.client.links.redirect_cache.get("warm3") is not None
+    assert app.client.links.redirect_cache.get("warm1") is None
+
+    with dev_login(client, "admin"):
+        resp = client.get("/api/core/admin/stats/redirect")
+        assert resp.json["warmup"]["links"] == 2
+
+
+def test_custom_domain_routing(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        resp = client.post(
+            "/api/core/link",
+            json={
+                "title": "title",
+                "long_url": "https://example.com",
+                "alias": "domainlink",
+                "domain": "custom",
+            },
+        )
+        assert resp.status_code == 201
+
+    def get(host: str) -> int:
+        return client.get("/domainlink", headers={"Host": host}).status_code
+
+    assert get("custom.example.edu") == 302
+    assert get("other.example.edu") == 404
+    assert get("go.example.edu") == 302
+    assert get("localhost:5000") == 302
+
+    domain_routes = app.client.orgs.domain_routes
+    assert "custom" not in domain_routes.domains()
+    assert app.client.orgs.create("domainorg") is not None
+    assert app.client.orgs.create_domain("domainorg", "custom")
+    assert "custom" in domain_routes.domains()
+    assert app.client.orgs.delete_domain("domainorg", "custom")
+    assert "custom" not in domain_routes.domains()
+    assert domain_routes.stats()["reloads"] >= 2
+
+
+def test_daily_rollups(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="rollups")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    for query in ["", "", "?source=qr"]:
+        assert client.get(f"/rollups{query}").status_code == 302
+
+    rollups = {
+        rollup["source"]: rollup
+        for rollup in app.client.db.visits_daily.find({"link_id": ObjectId(link_id)})
+    }
+    assert rollups[None]["visits"] == 2
+    assert rollups[None]["first_visits"] == 1
+    assert rollups["qr"]["visits"] == 1
+    assert rollups["qr"]["first_visits"] == 0
+
+    def daily_visits(query: str = "") -> List[Tuple[int, int]]:
+        with dev_login(client, "admin"):
+            resp = client.get(f"/api/core/link/{link_id}/stats/visits{query}")
+            assert resp.status_code == 200
+            return [
+                (day["all_visits"], day["first_time_visits"])
+                for day in resp.json["visits"]
+            ]
+
+    # Computed from the visits until the rollups are backfilled. The
+    # visitor's first visit from a QR code is their first with that source.
+    assert daily_visits() == [(3, 1)]
+    assert daily_visits("?source=qr") == [(1, 1)]
+
+    app.client.db.visits_daily.delete_many({})
+    app.client.links.backfill_daily_rollups()
+    app.client.db.visits.delete_many({})
+    assert daily_visits() == [(3, 1)]
+    assert daily_visits("?source=qr") == []
+
+
+def test_daily_visits_range(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="range")
+        assert resp.status_code == 201
+        link_id = ObjectId(resp.json["id"])
+
+    links = app.client.links
+    today = datetime.now(timezone.utc)
+    app.client.db.urls.update_one(
+        {"_id": link_id}, {"$set": {"timeCreated": today - timedelta(days=10)}}
+    )
+    for days_ago, tracking_id in [(5, "a"), (2, "a"), (2, "b"), (1, "b")]:
+        links._write_visits(  # pylint: disable=protected-access
+            [
+                {
+                    "link_id": link_id,
+                    "alias": "range",
+                    "tracking_id": tracking_id,
+                    "source_ip": "127.0.0.1",
+                    "time": today - timedelta(days=days_ago),
+                    "user_agent": None,
+                    "referer": None,
+                }
+            ]
+        )
+    links.backfill_daily_rollups()
+
+    def legacy(date_range: Tuple[datetime, datetime]) -> List[Any]:
+        match = {
+            "link_id": link_id,
+            "time": {"$gte": date_range[0], "$lte": date_range[1]},
+        }
+        return list(
+            app.client.db.visits.aggregate(
+                [{"$match": match}] + aggregations.visits_aggregation
+            )
+        )
+
+    def counts(visits: List[Any]) -> List[Tuple[int, int]]:
+        return [(day["all_visits"], day["first_time_visits"]) for day in visits]
+
+    # "a" first visited before the range, but is new within it
+    date_range = (today - timedelta(days=3), today)
+    assert links.get_daily_visits(link_id, date_range=date_range) == legacy(date_range)
+    assert counts(legacy(date_range)) == [(2, 2), (1, 0)]
+
+    date_range = (today - timedelta(days=30), today)
+    assert links.get_daily_visits(link_id, date_range=date_range) == legacy(date_range)
+    assert counts(legacy(date_range)) == [(1, 1), (2, 1), (1, 0)]
+
+
+class NewJerseyGeoip(GeoipClient):
+    """Locates every address in New Jersey."""
+
+    def get_location_codes(self, ipaddr: str) -> Tuple[Optional[str], Optional[str]]:
+        return "NJ", "US"
+
+
+def test_geo_rollups(
+    client: Client, app: Flask, make_client: Callable[..., ShrunkClient]
+) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="georollups")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    links = app.client.links
+    inline = make_client(geoip=NewJerseyGeoip())
+    deferred = make_client(
+        geoip=NewJerseyGeoip(), VISIT_ENRICHMENT="deferred", VISIT_ENRICHMENT_INTERVAL=0
+    )
+
+    def geoip(source: Optional[str] = None) -> Tuple[Any, Any]:
+        stats = links.get_geoip_stats(ObjectId(link_id), source=source)
+        return stats["us"], stats["world"]
+
+    link = links.resolve("georollups")
+    assert link is not None
+    for source in [None, "qr"]:
+        inline.links.visit(link, "tracking-id", "127.0.0.1", None, None, source=source)
+    deferred.links.visit(link, "tracking-id", "127.0.0.1", None, None)
+
+    assert geoip() == ([{"value": 2, "code": "NJ"}], [{"value": 2, "code": "US"}])
+    assert geoip("qr") == ([{"value": 1, "code": "NJ"}], [{"value": 1, "code": "US"}])
+
+    assert deferred.links.enrich_visits() == 1
+    assert geoip()[1] == [{"value": 3, "code": "US"}]
+
+    with dev_login(client, "admin"):
+        resp = client.get(f"/api/core/link/{link_id}/stats/geoip")
+        assert resp.status_code == 200
+        assert resp.json["world"] == [{"value": 3, "code": "US"}]
+
+    app.client.db.visits_daily.delete_many({})
+    assert geoip() == ([], [])
+    links.backfill_daily_rollups()
+    assert geoip() == ([{"value": 3, "code": "NJ"}], [{"value": 3, "code": "US"}])
+    assert geoip("qr") == ([{"value": 1, "code": "NJ"}], [{"value": 1, "code": "US"}])
+
+
+def test_browser_stats(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="browsers")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    firefox = "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0"
+    for _ in range(2):
+        resp = client.get(
+            "/browsers",
+            headers={"User-Agent": firefox, "Referer": "https://www.reddit.com/r/x"},
+        )
+        assert resp.status_code == 302
+
+    # A visit stored before visits were enriched
+    app.client.db.visits.insert_one(
+        {
+            "link_id": ObjectId(link_id),
+            "alias": "browsers",
+            "tracking_id": "legacy",
+            "time": datetime.now(timezone.utc),
+            "source_ip": "127.0.0.1",
+            "user_agent": firefox,
+            "referer": "https://t.co/abc",
+            "weight": 3,
+        }
+    )
+
+    browser, platform = get_browser_platform(firefox)
+    with dev_login(client, "admin"):
+        resp = client.get(f"/api/core/link/{link_id}/stats/browser")
+        assert resp.status_code == 200
+        assert resp.json["browsers"] == [{"name": browser, "y": 5}]
+        assert resp.json["platforms"] == [{"name": platform, "y": 5}]
+        assert resp.json["referers"] == [
+            {"name": "Twitter", "y": 3},
+            {"name": "Reddit", "y": 2},
+        ]
+
+        resp = client.get(f"/api/core/link/{link_id}/stats/browser?source=qr")
+        assert resp.json == {"browsers": [], "platforms": [], "referers": []}
+
+
+def test_unique_visitor_sketches(client: Client, app: Flask) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="sketches")
+        assert resp.status_code == 201
+        link_id = ObjectId(resp.json["id"])
+
+    links = app.client.links
+    link = links.resolve("sketches")
+    assert link is not None
+    visitors: Dict[Optional[str], Set[str]] = {None: set(), "qr": set()}
+    for i in range(600):
+        tracking_id = f"visitor{random.randrange(400)}"
+        source = "qr" if i % 4 == 0 else None
+        visitors[source].add(tracking_id)
+        links.visit(link, tracking_id, "127.0.0.1", None, None, source=source)
+
+    def within(estimate: int, exact: int) -> bool:
+        return abs(estimate - exact) <= 0.1 * exact
+
+    exact = len(visitors[None] | visitors["qr"])
+    assert within(links.estimate_unique_visitors([link_id]), exact)
+    assert within(
+        links.estimate_unique_visitors([link_id], source="qr"), len(visitors["qr"])
+    )
+    stats = links.get_overall_visits(link_id, source="qr")
+    assert stats["total_visits"] == 150
+    assert stats["unique_visits"] == len(visitors["qr"])
+
+    past = datetime.now(timezone.utc) - timedelta(days=30)
+    assert links.estimate_unique_visitors([link_id], (past, past)) == 0
+
+    estimate = links.estimate_unique_visitors([link_id])
+    app.client.db.visits_daily.update_many({}, {"$unset": {"hll": ""}})
+    assert links.estimate_unique_visitors([link_id]) == 0
+    links.backfill_daily_rollups()
+    assert links.estimate_unique_visitors([link_id]) == estimate
+
+    # Days older than SKETCH_FOLD_DELAY are merged into one sketch per day.
+    old_link_id = ObjectId()
+    old_day = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    old_visitors = HyperLogLog(precision=links.hll_precision)
+    for i in range(100):
+        old_visitors.add(f"old{i}")
+    app.client.db.visits_daily.insert_one(
+        {
+            "link_id": old_link_id,
+            "day": old_day,
+            "source": None,
+            "visits": 100,
+            "first_visits": 100,
+            "hll": {str(index): rank for index, rank in old_visitors.registers.items()},
+        }
+    )
+    total = links.estimate_unique_visitors()
+    assert within(total, exact + 100)
+    assert app.client.db.visit_sketches.count_documents({}) == 0
+    links.fold_visit_sketches()
+    folded = app.client.db.visit_sketches.find_one({"_id": old_day})
+    assert len(folded["hll"]) == len(old_visitors.registers)
+    assert app.client.db.visit_sketches.count_documents({}) == 1
+    assert links.estimate_unique_visitors() == total
+    app.client.db.visits_daily.update_one(
+        {"link_id": old_link_id}, {"$unset": {"hll": ""}}
+    )
+    assert within(links.estimate_unique_visitors(date_range=(old_day, old_day)), 100)
+    assert links.estimate_unique_visitors([old_link_id]) == 0
+
+    # Clearing a link's visits only drops the days it was visited on.
+    links.clear_visits(link_id)
+    assert app.client.db.visit_sketches.count_documents({}) == 1
+    assert within(links.estimate_unique_visitors(), 100)
+    links.clear_visits(old_link_id)
+    assert app.client.db.visit_sketches.count_documents({}) == 0
+    assert links.estimate_unique_visitors() == 0
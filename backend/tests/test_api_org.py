@@ -408,6 +408,7 @@ def test_org_get_overall_stats_no_links(client: Client) -> None:
         assert resp.json["total_links"] == 0
         assert resp.json["total_visits"] == 0
         assert resp.json["total_users"] == 0
+        assert resp.json["approx_unique_visitors"] == 0
 
 
 @pytest.mark.parametrize(
@@ -1,4 +1,6 @@
 import pytest
+from bson.objectid import ObjectId
+from flask import Flask
 from werkzeug.test import Client
 from util import dev_login, create_tracking_pixel, assert_is_response_valid
 
@@ -45,6 +47,23 @@ def test_get_tracking_pixel(client: Client, tracking_pixel_data):
         resp = client.get(f"/api/core/t/{tracking_pixel_data['alias']}")
         assert resp.status_code == 200
         assert resp.headers["X-Image-Name"] == "pixel.png"
+        assert resp.mimetype == "image/png"
+        assert resp.headers["Cache-Control"] == "no-store, no-cache, must-revalidate"
+        assert resp.data.startswith(b"\x89PNG")
 
         resp = client.get(f"/{tracking_pixel_data['alias']}")
         assert resp.status_code == 404
+
+
+def test_get_tracking_pixel_unknown_extension(
+    client: Client, app: Flask, tracking_pixel_data
+):
+    """Test that only the image formats that are served can be requested"""
+    alias = tracking_pixel_data["alias"][: -len(".png")] + ".bmp"
+    app.client.db.urls.update_one(
+        {"_id": ObjectId(tracking_pixel_data["link_id"])},
+        {"$set": {"alias": alias, "alias_norm": alias.lower()}},
+    )
+    app.client.links.redirect_cache.clear()
+    resp = client.get(f"/api/core/t/{alias}")
+    assert resp.status_code == 404
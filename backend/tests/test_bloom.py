@@ -0,0 +1,13 @@
+from shrunk.util.bloom import BloomFilter
+
+
+def test_bloom_filter() -> None:
+    bloom = BloomFilter(capacity=100, error_rate=0.01)
+    for i in range(100):
+        bloom.add(f"alias{i}")
+    assert all(f"alias{i}" in bloom for i in range(100))
+    assert sum(f"other{i}" in bloom for i in range(1000)) < 50
+
+    # The set bits are counted as they are set, not on every estimate
+    assert bloom.set_bits == sum(bin(byte).count("1") for byte in bloom.bits)
+    assert 0 < bloom.estimated_false_positive_rate() < 0.05
@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from shrunk.client.bots import BotClassifier
+
+
+def test_bot_classifier(tmp_path: Path) -> None:
+    signatures_path = tmp_path / "bots.json"
+    classifier = BotClassifier(signatures_path=str(signatures_path), reload_interval=0)
+    browser = "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0"
+    assert classifier.classify(browser, "192.0.2.10", "GET") is None
+    assert classifier.classify(browser, "192.0.2.10", "HEAD") == "head"
+    assert (
+        classifier.classify("Slackbot-LinkExpanding 1.0", None, "GET") == "user_agent"
+    )
+
+    signatures_path.write_text(
+        '{"user_agents": ["ExampleScanner"], "networks": ["192.0.2.0/24"]}'
+    )
+    assert classifier.classify(browser, "192.0.2.10", "GET") == "network"
+    assert classifier.classify(browser, "198.51.100.1", "GET") is None
+    assert (
+        classifier.classify("ExampleScanner/2", "198.51.100.1", "GET") == "user_agent"
+    )
+    assert classifier.stats()["reloads"] == 1
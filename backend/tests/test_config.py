@@ -0,0 +1,22 @@
+from typing import Any
+
+from shrunk.client.config import DEFAULTS, from_env
+
+
+def test_from_env(monkeypatch: Any) -> None:
+    for name in DEFAULTS:
+        monkeypatch.delenv(f"SHRUNK_{name}", raising=False)
+    assert from_env() == {}
+
+    monkeypatch.setenv("SHRUNK_ALIAS_FILTER_ENABLED", "1")
+    monkeypatch.setenv("SHRUNK_REDIRECT_CACHE_SIZE", "20")
+    monkeypatch.setenv("SHRUNK_REDIRECT_CACHE_TTL", "1.5")
+    monkeypatch.setenv("SHRUNK_ALIAS_TABLE_PATH", "")
+    monkeypatch.setenv("SHRUNK_VISIT_INGEST_MODE", "")
+    assert from_env() == {
+        "ALIAS_FILTER_ENABLED": True,
+        "REDIRECT_CACHE_SIZE": 20,
+        "REDIRECT_CACHE_TTL": 1.5,
+        "ALIAS_TABLE_PATH": None,
+        "VISIT_INGEST_MODE": "sync",
+    }
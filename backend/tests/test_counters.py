@@ -0,0 +1,32 @@
+from bson.objectid import ObjectId
+
+from shrunk.client import ShrunkClient
+from shrunk.client.counters import CounterBuffer
+
+
+def test_coalesces_increments_and_maxima(db: ShrunkClient) -> None:
+    buffer = CounterBuffer(
+        collection=db.db.visits_daily,
+        flush_interval=3600,
+        key_fields=("link_id",),
+        upsert=True,
+    )
+    link_id = ObjectId()
+    buffer.add(link_id, {"visits": 1}, {"hll.3": 2})
+    buffer.add(link_id, {"visits": 1}, {"hll.3": 1, "hll.7": 4})
+    buffer.add(link_id, {}, {"hll.3": 5})
+    assert buffer.pending(link_id) == {"visits": 2}
+    assert db.db.visits_daily.count_documents({}) == 0
+
+    buffer.flush()
+    rollup = db.db.visits_daily.find_one({"link_id": link_id})
+    assert rollup["visits"] == 2
+    assert rollup["hll"] == {"3": 5, "7": 4}
+
+    buffer.add(link_id, {"visits": 1}, {"hll.3": 1})
+    buffer.flush()
+    rollup = db.db.visits_daily.find_one({"link_id": link_id})
+    assert rollup["visits"] == 3
+    assert rollup["hll"] == {"3": 5, "7": 4}
+    assert buffer.stats()["flushed_updates"] == 2
+    assert buffer.stats()["pending_documents"] == 0
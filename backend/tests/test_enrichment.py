@@ -0,0 +1,148 @@
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytest
+from bson.objectid import ObjectId
+from werkzeug.test import Client
+
+from shrunk.client import ShrunkClient
+from shrunk.client.enrichment import LEGACY, VisitEnricher
+from shrunk.client.geoip import GeoipClient
+from shrunk.util.stats import get_browser_platform
+
+from util import dev_login, create_link
+
+
+class FlakyGeoip(GeoipClient):
+    """Locates every address in New Jersey, after failing ``failures`` times."""
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+
+    def get_location_codes(self, ipaddr: str) -> Tuple[Optional[str], Optional[str]]:
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("geoip lookup failed")
+        return "NJ", "US"
+
+
+def make_enricher(
+    db: ShrunkClient,
+    geoip: GeoipClient,
+    counted: List[Dict[str, Any]],
+    clock: Callable[[], float] = time.time,
+) -> VisitEnricher:
+    return VisitEnricher(
+        db=db.db,
+        geoip=geoip,
+        batch_size=10,
+        interval=0,
+        cache_size=10,
+        claim_timeout=60,
+        on_enriched=counted.extend,
+        clock=clock,
+    )
+
+
+def insert_visits(db: ShrunkClient, count: int, **fields: Any) -> List[ObjectId]:
+    result = db.db.visits.insert_many(
+        [
+            {
+                "link_id": ObjectId(),
+                "time": datetime.now(timezone.utc),
+                "source_ip": "10.0.0.1",
+                "user_agent": None,
+                "referer": None,
+                **fields,
+            }
+            for _ in range(count)
+        ]
+    )
+    return list(result.inserted_ids)
+
+
+def test_enrich_pending(db: ShrunkClient) -> None:
+    ids = insert_visits(db, 25, enriched=False)
+    counted: List[Dict[str, Any]] = []
+    enricher = make_enricher(db, FlakyGeoip(), counted)
+
+    assert enricher.run() == 25
+    assert sorted(visit["_id"] for visit in counted) == sorted(ids)
+    assert counted[0]["country_code"] == "US"
+    assert db.db.visits.count_documents({"enriched": True, "state_code": "NJ"}) == 25
+    assert enricher.stats()["batches"] == 3
+    assert enricher.run() == 0
+
+
+def test_interrupted_claim_is_reclaimed(db: ShrunkClient) -> None:
+    ids = insert_visits(db, 3, enriched=False)
+    counted: List[Dict[str, Any]] = []
+    now = [time.time()]
+    enricher = make_enricher(db, FlakyGeoip(failures=1), counted, lambda: now[0])
+
+    # The process dies after claiming the batch, before writing it.
+    with pytest.raises(RuntimeError):
+        enricher.run()
+    assert db.db.visits.count_documents({"enriched": {"$type": "objectId"}}) == 3
+    assert counted == []
+
+    # The claim is only taken over once it has timed out.
+    assert enricher.run() == 0
+    now[0] += 61
+    assert enricher.run() == 3
+    assert sorted(visit["_id"] for visit in counted) == sorted(ids)
+    assert db.db.visits.count_documents({"enriched": True, "country_code": "US"}) == 3
+    assert enricher.stats()["reclaimed"] == 3
+
+    now[0] += 61
+    assert enricher.run() == 0
+    assert len(counted) == 3
+
+
+def test_backfill_leaves_deferred_visits(db: ShrunkClient) -> None:
+    pending = insert_visits(db, 1, enriched=False)
+    legacy = insert_visits(db, 1, state_code="NJ", country_code="US")
+    counted: List[Dict[str, Any]] = []
+    enricher = make_enricher(db, FlakyGeoip(), counted)
+
+    assert enricher.enrich(LEGACY) == 1
+    assert "browser" in db.db.visits.find_one({"_id": legacy[0]})
+    assert db.db.visits.find_one({"_id": pending[0]})["enriched"] is False
+    assert counted == []
+
+    assert enricher.run() == 1
+    assert [visit["_id"] for visit in counted] == pending
+
+
+def test_deferred_visit_enrichment(
+    client: Client, make_client: Callable[..., ShrunkClient]
+) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="deferred")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    deferred = make_client(VISIT_ENRICHMENT="deferred", VISIT_ENRICHMENT_INTERVAL=0)
+    link = deferred.links.resolve("deferred")
+    assert link is not None
+    firefox = "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0"
+    deferred.links.visit(
+        link, "tracking-id", "127.0.0.1", firefox, "https://www.reddit.com/r/x"
+    )
+
+    visit = deferred.db.visits.find_one({"link_id": link.id})
+    assert visit["enriched"] is False
+    assert "browser" not in visit
+
+    assert deferred.links.enrich_visits() == 1
+    visit = deferred.db.visits.find_one({"link_id": link.id})
+    assert visit["enriched"] is True
+    assert (visit["browser"], visit["platform"]) == get_browser_platform(firefox)
+    assert visit["referer_domain"] == "Reddit"
+    assert deferred.links.enrich_visits() == 0
+
+    with dev_login(client, "admin"):
+        resp = client.get(f"/api/core/link/{link_id}/stats/browser")
+        assert resp.json["browsers"] == [{"name": visit["browser"], "y": 1}]
@@ -0,0 +1,30 @@
+import pytest
+
+from shrunk.util.hyperloglog import HyperLogLog
+
+
+@pytest.mark.parametrize(("precision", "tolerance"), [(6, 0.3), (10, 0.1), (14, 0.03)])
+@pytest.mark.parametrize("count", [0, 1, 50, 1000, 20000])
+def test_count(precision: int, tolerance: float, count: int) -> None:
+    sketch = HyperLogLog(precision=precision)
+    for i in range(count):
+        sketch.add(f"visitor{i}")
+        sketch.add(f"visitor{i // 2}")
+    assert abs(sketch.count() - count) <= tolerance * count
+    assert len(sketch.registers) <= min(count, 2**precision)
+
+
+def test_merge() -> None:
+    left, right, both = (HyperLogLog(precision=10) for _ in range(3))
+    for i in range(3000):
+        (left if i % 3 else right).add(f"visitor{i}")
+        both.add(f"visitor{i}")
+    left.merge(right.registers.items())
+    assert left.registers == both.registers
+    assert abs(left.count() - 3000) <= 0.1 * 3000
+
+
+@pytest.mark.parametrize("precision", [3, 17])
+def test_precision_bounds(precision: int) -> None:
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=precision)
@@ -0,0 +1,89 @@
+import os
+import time
+from typing import Any, Callable, Dict
+from urllib.parse import parse_qsl, urlencode
+
+import pytest
+from flask import Flask, redirect
+from werkzeug.test import Client
+
+from shrunk import redirector, redirects
+
+from util import dev_login, create_link
+
+
+def test_redirector(client: Client, app: Flask) -> None:
+    with dev_login(client, "user"):
+        resp = create_link(client, "title", "https://example.com", alias="redirector")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    redirector_app = redirector.create_app()
+    with redirector_app.test_client() as redirector_client:
+        resp = redirector_client.get("/redirector?a=b")
+        assert resp.status_code == 302
+        assert resp.headers["Location"] == "https://example.com?a=b"
+        assert b'href="https://example.com?a=b"' in resp.data
+        assert "shrunkid" in resp.headers["Set-Cookie"]
+
+        resp = redirector_client.get("/redirector/manage")
+        assert resp.status_code == 302
+        assert resp.headers["Location"].endswith(f"/app/links/{link_id}")
+
+        assert redirector_client.get("/doesnotexist").status_code == 404
+        assert redirector_client.get("/api/core/enabled").status_code == 404
+
+    assert app.client.db.visits.count_documents({"alias": "redirector"}) == 1
+
+
+@pytest.mark.slow
+def test_redirect_response_benchmark() -> None:
+    """Report the CPU time spent building a redirect response next to the
+    per-request work it replaced. Run with ``pytest -m slow -s``; the numbers
+    are only printed, since timings vary too much between runs to assert on."""
+    long_url = "https://example.com/some/path"
+    iterations = 20000
+
+    with open(os.devnull, "w") as devnull:
+
+        def before(query_string: bytes) -> Any:
+            url = long_url
+            if query_string:
+                print("true", query_string, flush=True, file=devnull)
+                separator = "&" if "?" in url else "?"
+                decoded = query_string.decode("utf-8").replace("&amp;", "&")
+                q_strings = dict(parse_qsl(decoded))
+                for key in ["mid", "uid", "source"]:
+                    q_strings.pop(key, None)
+                if len(q_strings) == 0:
+                    separator = ""
+                url = f"{url}{separator}{urlencode(q_strings)}"
+            if "://" not in url:
+                url = f"http://{url}"
+            return redirect(url)
+
+        def after(query_string: bytes) -> Any:
+            location = redirects.base_location(long_url)
+            if query_string:
+                location, _ = redirects.merge_query(location, query_string)
+            return redirect(location)
+
+        for query_string in [b"", b"utm_source=mail&mid=123&utm_campaign=spring"]:
+            assert (
+                before(query_string).headers["Location"]
+                == after(query_string).headers["Location"]
+            )
+            micros: Dict[str, float] = {}
+            builders: Dict[str, Callable[[bytes], Any]] = {
+                "before": before,
+                "after": after,
+            }
+            for name, build in builders.items():
+                started = time.process_time()
+                for _ in range(iterations):
+                    build(query_string)
+                micros[name] = (time.process_time() - started) / iterations * 1e6
+            print(
+                f"query {query_string!r}: {micros['before']:.1f}us before, "
+                f"{micros['after']:.1f}us after"
+            )
@@ -0,0 +1,19 @@
+from bson.objectid import ObjectId
+
+from shrunk.client.visit_dedup import VisitDeduplicator
+
+
+def test_visit_dedup() -> None:
+    dedup = VisitDeduplicator(window=60, max_size=2)
+    link_id = ObjectId()
+    assert not dedup.is_duplicate(link_id, "a")
+    assert dedup.is_duplicate(link_id, "a")
+    assert not dedup.is_duplicate(link_id, "b")
+    assert not dedup.is_duplicate(ObjectId(), "a")
+    # The oldest window was forgotten to stay within max_size
+    assert not dedup.is_duplicate(link_id, "a")
+    assert dedup.stats()["collapsed"] == 1
+
+    dedup = VisitDeduplicator(window=0, max_size=2)
+    assert not dedup.is_duplicate(link_id, "a")
+    assert not dedup.is_duplicate(link_id, "a")
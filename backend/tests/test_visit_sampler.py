@@ -0,0 +1,70 @@
+from typing import Callable, List
+
+from werkzeug.test import Client
+
+from shrunk.client import ShrunkClient
+from shrunk.client.visit_sampler import VisitSampler
+
+from util import dev_login, create_link
+
+
+def weights(sampler: VisitSampler, link_id: str, count: int) -> List[int]:
+    return [sampler.weight(link_id, False) for _ in range(count)]
+
+
+def test_samples_hot_links() -> None:
+    sampler = VisitSampler(threshold=2, rate=4, clock=lambda: 0.0)
+    # 2 below the threshold, then 1 in 4 of the remaining 8
+    assert weights(sampler, "hot", 10) == [1, 1, 0, 0, 0, 4, 0, 0, 0, 4]
+    assert sampler.weight("hot", True) == 1
+    assert weights(sampler, "cold", 2) == [1, 1]
+    assert sampler.stats()["hot_links"] == 1
+    assert sampler.stats()["sampled"] == 2
+    assert sampler.stats()["dropped"] == 6
+
+
+def test_carries_skipped_visits_across_windows() -> None:
+    now = [0.0]
+    sampler = VisitSampler(threshold=2, rate=4, window=60, clock=lambda: now[0])
+    stored = weights(sampler, "hot", 5)
+    assert stored == [1, 1, 0, 0, 0]
+
+    # Still hot from the previous window
+    now[0] += 60
+    stored += weights(sampler, "hot", 3)
+    assert stored[5:] == [4, 0, 0]
+
+    # Cold again: the next visit stands for the two skipped before it
+    now[0] += 120
+    stored += weights(sampler, "hot", 1)
+    assert stored[8:] == [3]
+    assert sum(stored) == len(stored)
+
+
+def test_sampled_visit_stats(
+    client: Client, make_client: Callable[..., ShrunkClient]
+) -> None:
+    with dev_login(client, "admin"):
+        resp = create_link(client, "title", "https://example.com", alias="sampled")
+        assert resp.status_code == 201
+        link_id = resp.json["id"]
+
+    sampling = make_client(VISIT_SAMPLE_THRESHOLD=2, VISIT_SAMPLE_RATE=4)
+    link = sampling.links.resolve("sampled")
+    assert link is not None
+    for _ in range(10):
+        sampling.links.visit(link, "tracking-id", "127.0.0.1", None, None)
+
+    # 2 below the threshold, then 1 in 4 of the remaining 8
+    visits = list(sampling.db.visits.find({"link_id": link.id}).sort("_id", 1))
+    assert [visit.get("weight", 1) for visit in visits] == [1, 1, 4, 4]
+
+    with dev_login(client, "admin"):
+        resp = client.get(f"/api/core/link/{link_id}/stats")
+        assert resp.json["total_visits"] == 10
+        assert resp.json["unique_visits"] == 1
+        resp = client.get(f"/api/core/link/{link_id}/stats/visits")
+        assert sum(day["all_visits"] for day in resp.json["visits"]) == 10
+        assert sum(day["first_time_visits"] for day in resp.json["visits"]) == 1
+        resp = client.get(f"/api/core/link/{link_id}/stats/browser")
+        assert sum(platform["y"] for platform in resp.json["platforms"]) == 10
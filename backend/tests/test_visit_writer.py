@@ -0,0 +1,35 @@
+from typing import Any, Dict, List
+
+from shrunk.client.visit_writer import VisitWriter
+
+
+def test_retries_failed_batch() -> None:
+    written: List[Dict[str, Any]] = []
+    failures = [RuntimeError("database unreachable")]
+
+    def write(batch: List[Dict[str, Any]]) -> None:
+        if failures:
+            raise failures.pop()
+        written.extend(batch)
+
+    writer = VisitWriter(
+        write=write,
+        max_queue_size=10,
+        batch_size=2,
+        flush_interval=3600,
+        block_timeout=0,
+    )
+    for i in range(3):
+        assert writer.enqueue({"n": i})
+
+    # The first batch fails, and the queue is left alone until the next flush
+    writer.flush()
+    assert written == []
+    assert writer.stats()["queued"] == 3
+    assert writer.stats()["failed"] == 2
+
+    writer.flush()
+    assert [visit["n"] for visit in written] == [0, 1, 2]
+    assert writer.stats()["queued"] == 0
+    assert writer.stats()["written"] == 3
+    writer._worker.stop()